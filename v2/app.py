@@ -1,10 +1,20 @@
 import streamlit as st
 from dotenv import load_dotenv
-from vector_store import VectorStore
-from llm_utils import generate_response
+from corpus_registry import ALL_CORPORA, get_registry
+from llm_utils import generate_response, get_genai, hedged_generator, prefix_cache
 from rag_utils import create_embeddings # load_chunks behövs inte direkt i app.py längre
-from numpy import dot
-from numpy.linalg import norm
+from predefined_qa import predefined_qa_en, predefined_qa_sv
+from chat_session import ChatSession
+from generation_queue import EVALUATION, INTERACTIVE, generation_queue
+from prompts import no_answer_phrase
+from query_router import query_router
+from vector_store import adaptive_k
+from autocomplete import SectionAutocomplete
+from async_pipeline import AsyncRagPipeline, background_loop
+from query_capture import query_capture
+from warmup import Warmup, load_top_queries, query_embedding_cache
+from faq_store import DEFAULT_FAQ_PATH, FaqStore
+from typing import Optional
 import os
 
 st.set_page_config(
@@ -90,19 +100,114 @@ div[role="combobox"] > div > div > select {
 </style>
 """, unsafe_allow_html=True)
 
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+EMBEDDINGS_PARQUET_PATH = os.path.join(DATA_DIR, "full_embeddings.parquet")
+CHUNKS_JSONL_PATH = os.path.join(DATA_DIR, "full_manual_chunks.jsonl")
+
+# Shardat läge aktiveras med t.ex. VECTOR_SHARDS=local:4 eller VECTOR_SHARDS=nod-a:7000,nod-b:7000
+shard_spec = os.environ.get("VECTOR_SHARDS")
+
+def load_default_corpus() -> bool:
+    # Standardkorpusens snapshots i data/index har företräde; den gamla parquet-filen används om inga finns.
+    # Registret bevakar nya versioner och byter index i bakgrunden; övriga korpusar laddas först när de efterfrågas.
+    try:
+        registry = get_registry()
+        registry.manager(registry.default)
+        return True
+    except FileNotFoundError:
+        return False
+
+def warm_clients():
+    get_genai()
+    for language in ("English", "Swedish"):
+        prefix_cache.get_model("gemini-2.0-flash", language)
+        if hedged_generator.hedge_model:
+            prefix_cache.get_model(hedged_generator.hedge_model, language)
+
+def warm_query_embeddings() -> int:
+    predefined = predefined_qa_en + predefined_qa_sv
+    texts = [qa["question"] for qa in predefined]
+    texts += [qa["ideal_answer"] for qa in predefined] # Evaluation-sidan embeddar idealsvaren för poängen
+    texts += load_top_queries()
+    return query_embedding_cache.warm(texts, create_embeddings)
+
 @st.cache_resource(show_spinner=False)
-def initialize_vector_store() -> VectorStore:
-    embeddings_parquet_path = os.path.join(os.path.dirname(__file__), "data", "full_embeddings.parquet")
+def start_warmup() -> Warmup:
+    # En gång per process: indexet, klienterna och vanliga frågors embeddings laddas i
+    # bakgrunden medan första sidan ritas.
+    warmup = Warmup()
+    if not shard_spec:
+        warmup.add_step("index", load_default_corpus)
+    warmup.add_step("autocomplete", lambda: SectionAutocomplete.from_jsonl(CHUNKS_JSONL_PATH))
+    warmup.add_step("clients", warm_clients)
+    warmup.add_step("query_embeddings", warm_query_embeddings)
+    warmup.start()
+    return warmup
+
+warmup = start_warmup()
+embed_cached = query_embedding_cache.wrap(create_embeddings)
 
-    store = VectorStore()
-    if store.load(embeddings_parquet_path): # Försök ladda från fil
-        print(f"Vector store loaded from {embeddings_parquet_path}")
-        return store
-    else:
-        st.error(f"Embeddingsfilen '{embeddings_parquet_path}' saknas. Vänligen kör 'generate_and_save_embeddings.py' först för att skapa den.")
-        st.stop() # Stoppa appen om embeddings inte kan laddas
+@st.cache_resource(show_spinner=False)
+def load_section_autocomplete() -> SectionAutocomplete:
+    return warmup.result("autocomplete") or SectionAutocomplete.from_jsonl(CHUNKS_JSONL_PATH)
 
-vector_store = initialize_vector_store()
+@st.cache_resource(show_spinner=False)
+def load_eval_pipeline() -> AsyncRagPipeline:
+    # Lägre prioritet än Chatbot-frågor i den delade generationskön. Svaren embeddas utan
+    # cache för poängen; frågor och idealsvar går genom cachen (de är förvärmda).
+    def generate(query, context, **kwargs):
+        return generation_queue.run(generate_response, query, context, priority=EVALUATION, **kwargs)
+
+    return AsyncRagPipeline(embed_cached, generate, answer_embed_fn=create_embeddings,
+                            lexical=load_section_autocomplete())
+
+@st.cache_resource(show_spinner=False)
+def initialize_sharded_store(shard_spec: str):
+    from sharded_store import ShardedVectorStore, resolve_index # Bara i shardat läge
+
+    if not shard_spec.startswith("local"):
+        return None, ShardedVectorStore.from_spec(shard_spec, None) # Varje nod laddar sin snapshot (serve)
+    # Standardkorpusens aktiva snapshot när shards startar; ett nytt index kräver omstart.
+    registry = get_registry()
+    corpus = registry.corpora[registry.default]
+    index_version, parquet_path = resolve_index(corpus.index_root, corpus.legacy_path, corpus.version)
+    return index_version, ShardedVectorStore.from_spec(shard_spec, parquet_path)
+
+@st.cache_resource(show_spinner=False, ttl=300)
+def load_faq_store(index_version: str) -> Optional[FaqStore]:
+    # Nyckel på indexversionen: efter ett indexbyte används bara svar byggda mot det nya indexet.
+    return FaqStore.load(DEFAULT_FAQ_PATH, index_version)
+
+def get_index(corpus: Optional[str] = None):
+    """
+    (index_version, vector_store, faq) för den här körningen. Standardkorpusens index laddas
+    i bakgrunden av uppvärmningen; en sida som behöver det innan dess väntar här, efter att
+    sidomenyn och sidans rubrik redan ritats. Andra korpusar laddas vid första frågan och
+    ALL_CORPORA ger en vy som söker i alla. FAQ-storen finns bara för standardkorpusen.
+    Anropas en gång per körning, så en pågående fråga avslutas mot samma index även om
+    ett nytt index aktiveras under tiden.
+    """
+    with st.spinner("Loading index..."):
+        if shard_spec:
+            try:
+                index_version, vector_store = initialize_sharded_store(shard_spec)
+            except FileNotFoundError:
+                st.error(f"Embeddingsfilen '{EMBEDDINGS_PARQUET_PATH}' saknas. Vänligen kör 'generate_and_save_embeddings.py' först för att skapa den.")
+                st.stop()
+            return index_version, vector_store, None
+        if corpus == ALL_CORPORA:
+            return None, corpus_registry.fanout(ALL_CORPORA), None
+        name = corpus or corpus_registry.default
+        try:
+            index_version, vector_store = corpus_registry.snapshot(name)
+        except FileNotFoundError:
+            if name == corpus_registry.default:
+                st.error(f"Embeddingsfilen '{EMBEDDINGS_PARQUET_PATH}' saknas. Vänligen kör 'generate_and_save_embeddings.py' först för att skapa den.")
+            else:
+                st.error(f"The corpus '{corpus_registry.label(name)}' has no index yet. Run 'python corpus_registry.py build {name}' first.")
+            st.stop() # Stoppa appen om embeddings inte kan laddas
+        faq = load_faq_store(index_version) if name == corpus_registry.default else None
+        return index_version, vector_store, faq
 
 # --- Meny ---
 st.sidebar.title("Navigation")
@@ -116,18 +221,102 @@ answer_language = st.sidebar.selectbox(
 
 page = st.sidebar.radio("Select a page", ["Chatbot", "Evaluation", "About the app"], index=0)
 
+# Korpus för Chatbot-sidan; Evaluation-frågorna hör till standardkorpusen.
+corpus_registry = get_registry() # Byggs vid första anropet i processen, inte vid importen
+corpus = corpus_registry.default
+if not shard_spec and len(corpus_registry.corpora) > 1:
+    corpus = st.sidebar.selectbox("Corpus:", options=corpus_registry.names() + [ALL_CORPORA],
+                                  format_func=corpus_registry.label)
+
+with st.sidebar.expander("Prompt cache stats"):
+    st.json(prefix_cache.report())
+
+with st.sidebar.expander("Warm-up" if warmup.ready.is_set() else "Warm-up (running...)"):
+    st.json(warmup.report())
+
+with st.sidebar.expander("Generation queue"):
+    st.json(generation_queue.report())
+
+with st.sidebar.expander("Generation latency"):
+    st.json(hedged_generator.report())
+
+with st.sidebar.expander("Model routing"):
+    st.json(query_router.report())
+
+if len(corpus_registry.corpora) > 1:
+    with st.sidebar.expander("Corpora"):
+        st.json(corpus_registry.report())
+
+if query_capture.enabled:
+    with st.sidebar.expander("Query capture"):
+        st.json(query_capture.report())
+
 if page == "Chatbot":
     st.title("The Ableton Live 12 RAG-Bot") # Uppdaterad titel
-    query = st.text_input("Ask your question:")
-    if query:
-        query_emb = create_embeddings([query])[0]
-        results = vector_store.semantic_search(query_emb, k=5)
-        top_texts = [r["text"] for r in results]
-        joined_texts = "\n\n".join(top_texts)
 
-        answer = generate_response(query, joined_texts, answer_language=answer_language)
-        st.markdown("### Answer:")
-        st.write(answer)
+    # Konversationen och dess cachar lever i sessionen; omkörningar (t.ex. byte av språk)
+    # ritar bara om historiken i stället för att embedda, söka och generera på nytt.
+    if "chat" not in st.session_state:
+        st.session_state.chat = ChatSession()
+    chat = st.session_state.chat
+
+    # Hoppa direkt till ett avsnitt eller en enhet: prefixet slås upp lokalt och avsnittets
+    # text visas utan embedding, sökning eller generering.
+    sections = load_section_autocomplete()
+    prefix = st.text_input("Jump to a section or device:", key="section_prefix", placeholder="e.g. glue comp")
+    if prefix:
+        suggestions = sections.suggest(prefix)
+        if not suggestions:
+            st.caption("No matching sections.")
+        for suggestion in suggestions:
+            if st.button(sections.label(suggestion["entry"]), key=f"section_{suggestion['entry']}"):
+                st.session_state.section_entry = suggestion["entry"]
+    if st.session_state.get("section_entry") is not None:
+        entry = st.session_state.section_entry
+        with st.expander(sections.label(entry), expanded=True):
+            for text in sections.section_texts(entry, max_chunks=10):
+                st.markdown(text)
+            if st.button("Close section"):
+                st.session_state.section_entry = None
+                st.rerun()
+
+    for message in chat.messages:
+        with st.chat_message(message["role"]):
+            st.markdown(message["content"])
+
+    query = st.chat_input("Ask your question:")
+    if query:
+        with st.chat_message("user"):
+            st.markdown(query)
+        index_version, vector_store, faq = get_index(corpus)
+        answer = chat.ask(query, answer_language, vector_store, embed_cached,
+                          generation_queue.wrap(generate_response, INTERACTIVE), k=5, faq=faq,
+                          router=query_router, adaptive=adaptive_k)
+        # Opt-in (QUERY_CAPTURE=1): anonymiserad post för replay, se query_capture.py.
+        query_capture.record(query, answer_language, chat.last_trace, answer,
+                             session_id=st.session_state.setdefault("capture_session", os.urandom(8).hex()),
+                             embedding=chat.query_embeddings.get(query.strip()), index_version=index_version)
+        with st.chat_message("assistant"):
+            st.markdown(answer)
+            # Grannarna är förberäknade i snapshotet (related_sections.py); här görs bara uppslag.
+            related = getattr(vector_store, "related", None)
+            if related is not None and chat.last_hits:
+                rows = [row for row, _ in chat.last_hits]
+                shown = set()
+                with st.expander("Related sections"):
+                    for row, score in related.related_to(rows, limit=10, exclude=rows):
+                        metadata = vector_store.metadata[row]
+                        title = metadata.get("title") or "Untitled"
+                        if title in shown:
+                            continue
+                        shown.add(title)
+                        st.markdown(f"**{title}** ({score:.2f})  \n{vector_store.texts[row][:200]}...")
+                        if len(shown) == 5:
+                            break
+
+    if chat.messages and st.button("New conversation"):
+        chat.clear_history()
+        st.rerun()
 
 elif page == "About the app":
     st.title("About the app")
@@ -147,34 +336,6 @@ elif page == "Evaluation":
     st.title("Evaluate Chatbot Responses")
     st.markdown("Test how well the chatbot performs by selecting a question and comparing the AI's answer with the ideal answer.")
 
-    # Frågor och svar på engelska (utökad för hela manualen)
-    predefined_qa_en = [
-        {"question": "How do I use automation in Ableton Live to change a parameter over time?", "ideal_answer": "Automation is drawn directly in tracks using breakpoint envelopes. Select the parameter you want to automate, and then draw its curve using the pen tool or by clicking and dragging breakpoints."},
-        {"question": "What is the purpose of the Arrangement View in Ableton Live?", "ideal_answer": "The Arrangement View is a linear timeline for recording, arranging, and editing MIDI and audio clips in a traditional song structure."},
-        {"question": "Explain the function of Sends and Returns in Ableton Live.", "ideal_answer": "Sends route a portion of a track's signal to a Return track, where effects can be applied. This allows multiple tracks to share the same effect processing, saving CPU and providing a consistent sound."},
-        {"question": "How can I create a custom drum rack in Ableton Live?", "ideal_answer": "Drag individual samples or instruments into the pads of an empty Drum Rack. You can then configure each pad's settings and effects independently."},
-        {"question": "What is the difference between hot-swapping and replacing a device?", "ideal_answer": "Hot-swapping allows you to audition different devices while keeping their current settings intact. Replacing a device permanently swaps it with a new one, discarding the old device's settings."},
-        {"question": "How do I consolidate tracks or clips in Ableton Live?", "ideal_answer": "Select the desired clips or a range of time across multiple tracks, then go to the Edit menu and choose 'Consolidate Time to New Track' or 'Consolidate' (Cmd/Ctrl+J)."},
-        {"question": "What are Scenes in the Session View and how are they used?", "ideal_answer": "Scenes in Session View are horizontal rows that contain a collection of clips, typically representing a section of a song. Launching a scene plays all clips within that row simultaneously, useful for live performance and improvisation."},
-        {"question": "How can I reduce CPU usage in Ableton Live when my project is complex?", "ideal_answer": "To reduce CPU usage, you can freeze tracks, flatten tracks, reduce buffer size, disable unused devices, or use fewer CPU-intensive effects."},
-        {"question": "Describe the function of the Follow Actions feature for MIDI and audio clips.", "ideal_answer": "Follow Actions allow you to define what happens after a clip finishes playing, such as playing another clip, stopping, retriggering itself, or launching a different scene. This is useful for creating dynamic arrangements and generative music."},
-        {"question": "How do I set up an external MIDI controller in Ableton Live 12?", "ideal_answer": "Go to Live's Preferences, then 'Link/Tempo/MIDI'. Select your controller from the 'Control Surface' dropdown, enable its 'Track' and 'Remote' switches in the 'MIDI Ports' section, and ensure its MIDI input is active."}
-    ]
-
-    # Frågor och svar på svenska (utökad för hela manualen)
-    predefined_qa_sv = [
-        {"question": "Hur använder jag automation i Ableton Live för att ändra en parameter över tid?", "ideal_answer": "Automation ritas direkt i spåren med hjälp av brytpunktskuvert. Välj den parameter du vill automatisera och rita sedan dess kurva med pennverktyget eller genom att klicka och dra brytpunkter."},
-        {"question": "Vad är syftet med Arrangement View i Ableton Live?", "ideal_answer": "Arrangement View är en linjär tidslinje för inspelning, arrangering och redigering av MIDI- och ljudklipp i en traditionell låtstruktur."},
-        {"question": "Förklara funktionen av Sends och Returns i Ableton Live.", "ideal_answer": "Sends dirigerar en del av ett spårs signal till ett Return-spår, där effekter kan appliceras. Detta gör att flera spår kan dela samma effektprocessering, vilket sparar CPU och ger ett konsekvent ljud."},
-        {"question": "Hur kan jag skapa ett anpassat Drum Rack i Ableton Live?", "ideal_answer": "Dra individuella samplingar eller instrument till padsen i ett tomt Drum Rack. Du kan sedan konfigurera varje pads inställningar och effekter oberoende av varandra."},
-        {"question": "Vad är skillnaden mellan hot-swapping och att ersätta en enhet?", "ideal_answer": "Hot-swapping låter dig provlyssna olika enheter samtidigt som deras nuvarande inställningar behålls. Att ersätta en enhet byter ut den permanent mot en ny, vilket kasserar den gamla enhetens inställningar."},
-        {"question": "Hur konsoliderar jag spår eller klipp i Ableton Live?", "ideal_answer": "Markera önskade klipp eller ett tidsintervall över flera spår, gå sedan till menyn Redigera och välj 'Consolidate Time to New Track' eller 'Consolidate' (Cmd/Ctrl+J)."},
-        {"question": "Vad är Scener i Session View och hur används de?", "ideal_answer": "Scener i Session View är horisontella rader som innehåller en samling klipp, typiskt representerande en sektion av en låt. Att starta en scen spelar alla klipp inom den raden samtidigt, vilket är användbart för liveframträdanden och improvisation."},
-        {"question": "Hur kan jag minska CPU-användningen i Ableton Live när mitt projekt är komplext?", "ideal_answer": "För att minska CPU-användningen kan du frysa spår, 'flattena' spår, minska buffertstorleken, inaktivera oanvända enheter eller använda färre CPU-intensiva effekter."},
-        {"question": "Beskriv funktionen 'Follow Actions' för MIDI- och ljudklipp.", "ideal_answer": "Follow Actions låter dig definiera vad som händer efter att ett klipp spelats klart, till exempel att spela ett annat klipp, stoppa, återstarta sig själv, eller starta en annan scen. Detta är användbart för att skapa dynamiska arrangemang och generativ musik."},
-        {"question": "Hur ställer jag in en extern MIDI-kontroller i Ableton Live 12?", "ideal_answer": "Gå till Lives inställningar, sedan 'Link/Tempo/MIDI'. Välj din kontroller från rullgardinsmenyn 'Control Surface', aktivera dess 'Track' och 'Remote' omkopplare i sektionen 'MIDI Ports', och se till att dess MIDI-ingång är aktiv."}
-    ]
-
     # Välj språk
     predefined_qa = predefined_qa_en if answer_language == "English" else predefined_qa_sv
 
@@ -188,12 +349,31 @@ elif page == "Evaluation":
     question = predefined_qa[question_idx]["question"]
     ideal_answer = predefined_qa[question_idx]["ideal_answer"]
 
-    query_emb = create_embeddings([question])[0]
-    results = vector_store.semantic_search(query_emb, k=15)
-    top_texts = [r["text"] for r in results]
-    joined_texts = "\n\n".join(top_texts)
-    model_answer = generate_response(question, joined_texts, answer_language=answer_language)
+    # Memo per session: samma fråga och språk räknas inte om vid varje omkörning av sidan.
+    if "eval_memo" not in st.session_state:
+        st.session_state.eval_memo = {}
+    memo_key = (question, answer_language)
 
+    score_future = None
+    if memo_key in st.session_state.eval_memo:
+        model_answer, score, no_answer = st.session_state.eval_memo[memo_key]
+    else:
+        index_version, vector_store, faq = get_index()
+        # Stegen överlappar (async_pipeline.py): FAQ-uppslaget (Evaluation-frågorna finns
+        # förberäknade mot aktivt index), lexikal träff på enhetsnamn och frågans embedding
+        # startar samtidigt; genereringen startar så snart sökträffarna finns. Adaptivt k:
+        # utan chunks över likhetsgolvet svarar generate_response direkt med no-answer-frasen.
+        result = background_loop.run(load_eval_pipeline().answer(
+            question, answer_language, vector_store, faq=faq, k=15, adaptive=adaptive_k, faq_similar=False))
+        model_answer = result["answer"]
+        no_answer = model_answer.strip() == no_answer_phrase(answer_language).strip()
+        if result["source"] == "degraded":
+            score = None # Poängsätts inte; sparas inte i memot så frågan körs igen vid nästa försök
+        elif no_answer:
+            score = 0.00
+        else:
+            # Poängens embeddings (svaret och idealsvaret) hämtas parallellt medan svaren ritas.
+            score_future = background_loop.submit(load_eval_pipeline().score(model_answer, ideal_answer))
 
     st.markdown("### RAG-Bot's answer:")
     st.write(model_answer)
@@ -201,20 +381,16 @@ elif page == "Evaluation":
     st.markdown("### Ideal answer:")
     st.write(ideal_answer)
 
-    no_answer_phrase = (
-        "I found no relevant information in my sources. Try rephrasing your question or consult the Ableton Live 12 manual."
-        if answer_language == "English"
-        else "Jag hittade ingen relevant information i mina källor. Försök att omformulera din fråga eller konsultera Ableton Live 12 manualen."
-    )
+    if score_future is not None:
+        score = round(score_future.result(), 2)
+    if memo_key not in st.session_state.eval_memo and score is not None:
+        st.session_state.eval_memo[memo_key] = (model_answer, score, no_answer)
 
-    if model_answer.strip() == no_answer_phrase.strip():
-        score = 0.00
+    if score is None:
+        st.markdown("### Similarity Score: `n/a` (no generated answer in time, try again shortly)")
+    elif no_answer:
         st.markdown(f"### Similarity Score: `{score}` (AI did not provide an answer)")
     else:
-        model_emb = create_embeddings([model_answer])[0]
-        ideal_emb = create_embeddings([ideal_answer])[0]
-        similarity = dot(model_emb, ideal_emb) / (norm(model_emb) * norm(ideal_emb))
-        score = round(similarity, 2)
         st.markdown(f"### Similarity Score: `{score}`")
 
     if "eval_scores" not in st.session_state:
@@ -0,0 +1,236 @@
+# async_pipeline.py
+"""
+Asynkron RAG-pipeline där oberoende steg överlappar.
+
+Tidigare kördes varje fråga strikt i följd: FAQ-uppslag, embedding, sökning,
+generering och (på Evaluation-sidan) embedding av svaret för poängen. Här är
+stegen asyncio-uppgifter och blockerande anrop (Gemini, numpy) körs i en trådpool:
+- FAQ-uppslaget, den lexikala träffen på enhets- och avsnittsnamn
+  (SectionAutocomplete.mentions) och frågans embedding startar samtidigt,
+- ett exakt FAQ-svar avbryter resten,
+- sökningen (och FAQ-uppslaget på närmaste granne) startar när embeddingen är klar,
+- genereringen startar så snart sökträffarna finns; lexikala träffar tas med om de
+  hunnit bli klara men väntas inte in,
+- poängens embeddings (svaret och idealsvaret) körs parallellt och kan startas
+  innan svaret ritas.
+Total latens närmar sig då det längsta steget i stället för summan av stegen.
+
+Från skript: asyncio.run(pipeline.answer(...)). Streamlit har ingen egen loop;
+där körs korutinerna på en gemensam loop i en bakgrundstråd via
+background_loop.run(...) (vänta på resultatet) eller background_loop.submit(...)
+(ett Future att hämta senare).
+
+    python async_pipeline.py bench --queries 20 --embed-latency const:150 --generate-latency const:600
+"""
+import argparse
+import asyncio
+import functools
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from generation_queue import GenerationRejected
+from prompts import build_retrieval_only_answer
+
+DEFAULT_WORKERS = int(os.environ.get("ASYNC_PIPELINE_WORKERS", "16"))
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def default_executor() -> ThreadPoolExecutor:
+    """Gemensam trådpool för blockerande steg; skapas vid första användningen."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=DEFAULT_WORKERS, thread_name_prefix="rag-stage")
+        return _executor
+
+
+def cosine(a, b) -> float:
+    a, b = np.asarray(a, dtype=np.float32), np.asarray(b, dtype=np.float32)
+    return float(a @ b / ((np.linalg.norm(a) * np.linalg.norm(b)) or 1.0))
+
+
+class AsyncRagPipeline:
+    def __init__(self, embed_fn: Callable[[List[str]], List[List[float]]], generate_fn: Callable,
+                 answer_embed_fn: Optional[Callable[[List[str]], List[List[float]]]] = None, lexical=None,
+                 lexical_chunks: int = 2, executor: Optional[ThreadPoolExecutor] = None):
+        self.embed_fn = embed_fn
+        self.generate_fn = generate_fn  # (query, context, answer_language=..., history=...) -> svar
+        self.answer_embed_fn = answer_embed_fn or embed_fn  # Svaren varierar och behöver inte cachas
+        self.lexical = lexical  # autocomplete.SectionAutocomplete eller None
+        self.lexical_chunks = lexical_chunks
+        self.executor = executor
+
+    async def _call(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor or default_executor(), functools.partial(fn, *args, **kwargs))
+
+    def _lexical_texts(self, query: str) -> List[str]:
+        texts = []
+        for entry in self.lexical.mentions(query):
+            texts.extend(self.lexical.section_texts(entry, self.lexical_chunks))
+        return texts
+
+    async def answer(self, query: str, answer_language: str, store, faq=None, k: int = 5, adaptive=None,
+                     history: Optional[List[Dict]] = None, faq_similar: bool = True) -> Dict:
+        """
+        Besvarar en fråga. Returnerar {"answer", "source" (faq/live/no_context/degraded),
+        "context", "timings" (sekunder per steg), "total", "stage_sum"}.
+        """
+        t0 = time.perf_counter()
+        timings: Dict[str, float] = {}
+
+        async def timed(stage, awaitable):
+            start = time.perf_counter()
+            try:
+                return await awaitable
+            finally:
+                timings[stage] = time.perf_counter() - start
+
+        def result(answer, source, context=()):
+            total = time.perf_counter() - t0
+            return {"answer": answer, "source": source, "context": list(context), "timings": timings,
+                    "total": total, "stage_sum": sum(timings.values())}
+
+        embed = asyncio.create_task(timed("embed", self._call(self.embed_fn, [query])))
+        lexical = None
+        if self.lexical is not None:
+            lexical = asyncio.create_task(timed("lexical", self._call(self._lexical_texts, query)))
+        pending = [task for task in (embed, lexical) if task is not None]
+
+        if faq is not None:
+            entry = await timed("faq_exact", self._call(faq.lookup_exact, query, answer_language))
+            if entry is not None:
+                for task in pending:
+                    task.cancel()
+                return result(entry["answer"], "faq")
+
+        query_emb = (await embed)[0]
+        search = asyncio.create_task(timed("search", self._call(store.semantic_search, query_emb, k=k,
+                                                                  adaptive=adaptive)))
+        if faq is not None and faq_similar:
+            entry = await timed("faq_similar", self._call(faq.lookup_similar, query_emb, answer_language))
+            if entry is not None:
+                search.cancel()
+                if lexical is not None:
+                    lexical.cancel()
+                return result(entry["answer"], "faq")
+
+        context = [r["text"] for r in await search]
+        if lexical is not None:
+            if lexical.done():
+                # Namngivna enheter/avsnitt kompletterar sökträffarna; generering väntar inte på dem.
+                context += [text for text in lexical.result() if text not in context]
+            else:
+                lexical.cancel()
+
+        try:
+            answer = await timed("generate", self._call(self.generate_fn, query, context,
+                                                        answer_language=answer_language, history=history))
+            source = "live" if context else "no_context"
+        except GenerationRejected:
+            answer = build_retrieval_only_answer(context, answer_language)
+            source = "degraded"
+        return result(answer, source, context)
+
+    async def score(self, answer: str, reference: str) -> float:
+        """Cosinuslikhet mellan svaret och ett referenssvar; de två embeddingarna hämtas parallellt."""
+        answer_emb, reference_emb = await asyncio.gather(self._call(self.answer_embed_fn, [answer]),
+                                                         self._call(self.embed_fn, [reference]))
+        return cosine(answer_emb[0], reference_emb[0])
+
+
+class BackgroundLoop:
+    """En asyncio-loop i en daemon-tråd, så synkron kod (Streamlit) kan köra korutiner samtidigt."""
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="async-pipeline", daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    def submit(self, coro) -> Future:
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    def run(self, coro, timeout: Optional[float] = None):
+        return self.submit(coro).result(timeout)
+
+
+background_loop = BackgroundLoop()
+
+
+def _sequential(pipeline: AsyncRagPipeline, query: str, reference: str, store, k: int) -> float:
+    """Samma steg i följd, som appen körde dem tidigare. Returnerar total tid."""
+    start = time.perf_counter()
+    query_emb = pipeline.embed_fn([query])[0]
+    context = [r["text"] for r in store.semantic_search(query_emb, k=k)]
+    if pipeline.lexical is not None:
+        context += [text for text in pipeline._lexical_texts(query) if text not in context]
+    answer = pipeline.generate_fn(query, context, answer_language="English")
+    cosine(pipeline.answer_embed_fn([answer])[0], pipeline.embed_fn([reference])[0])
+    return time.perf_counter() - start
+
+
+def main():
+    from autocomplete import DEFAULT_CHUNKS_PATH, SectionAutocomplete
+    from loadtest import build_store
+    from predefined_qa import predefined_qa_en
+    from stub_servers import LatencyModel, stub_embedding
+
+    parser = argparse.ArgumentParser(description="Jämför den asynkrona pipelinen med stegen i följd.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("bench", help="Stubbade embeddings och svar med konfigurerbar latens")
+    bench.add_argument("--queries", type=int, default=20)
+    bench.add_argument("--k", type=int, default=15)
+    bench.add_argument("--embed-latency", default="const:150", help="stub_servers.LatencyModel, t.ex. lognormal:150:0.3")
+    bench.add_argument("--generate-latency", default="const:600")
+    bench.add_argument("--parquet", default=os.path.join("data", "full_embeddings.parquet"))
+    bench.add_argument("--chunks", default=DEFAULT_CHUNKS_PATH)
+    args = parser.parse_args()
+
+    store = build_store(args.parquet, args.chunks)
+    embed_latency, generate_latency = LatencyModel(args.embed_latency), LatencyModel(args.generate_latency)
+
+    def embed(texts):
+        time.sleep(embed_latency.sample())
+        return [stub_embedding(text, len(store.vectors[0])) for text in texts]
+
+    def generate(query, context, answer_language="English", history=None):
+        time.sleep(generate_latency.sample())
+        return f"[stub] {len(context)} chunks."
+
+    pipeline = AsyncRagPipeline(embed, generate, lexical=SectionAutocomplete.from_jsonl(args.chunks))
+    pairs = [(qa["question"], qa["ideal_answer"]) for qa in predefined_qa_en][: args.queries]
+
+    sequential = [_sequential(pipeline, question, ideal, store, args.k) for question, ideal in pairs]
+
+    async def overlapped(question, ideal):
+        start = time.perf_counter()
+        result = await pipeline.answer(question, "English", store, k=args.k)
+        await pipeline.score(result["answer"], ideal)  # I appen ritas svaret medan detta pågår
+        return time.perf_counter() - start, result
+
+    runs = [asyncio.run(overlapped(question, ideal)) for question, ideal in pairs]
+    stage_sum = [result["stage_sum"] for _, result in runs]
+    print(f"{len(pairs)} frågor, median (ms):")
+    print(f"  i följd, med poäng:   {np.median(sequential) * 1000:.0f}")
+    print(f"  asynkron, med poäng:  {np.median([t for t, _ in runs]) * 1000:.0f}")
+    print(f"  asynkron, till svar:  {np.median([r['total'] for _, r in runs]) * 1000:.0f} "
+          f"(summa av stegen {np.median(stage_sum) * 1000:.0f}, "
+          f"längsta steget {np.median([max(r['timings'].values()) for _, r in runs]) * 1000:.0f})")
+
+
+if __name__ == "__main__":
+    main()
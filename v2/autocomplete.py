@@ -0,0 +1,231 @@
+# autocomplete.py
+"""
+Prefixindex för autocomplete av avsnittsrubriker och enhetsnamn.
+
+Användare skriver ofta halva enhets- eller funktionsnamn ("comp", "glue c", "warp").
+I stället för att varje variant kostar en embedding och en generering slås prefixet
+upp här: alla rubriker i full_manual_chunks.jsonl (även titlarna i parent_chain)
+normaliseras och varje ordstart läggs som nyckel i en sorterad lista, så en
+uppslagning är en binärsökning plus en kort skanning. Enhetsnamn är de numrerade
+rubrikerna på toppnivå i referenskapitlen (t.ex. "9 Compressor" i "Live Audio Effect
+Reference").
+
+Ett valt förslag ger avsnittets chunks direkt ur indexet, utan embedding eller sökning.
+
+    python autocomplete.py "glue c"
+"""
+import argparse
+import os
+import re
+import time
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, Optional
+
+from rag_utils import load_chunks
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+DEFAULT_CHUNKS_PATH = os.path.join(DATA_DIR, "full_manual_chunks.jsonl")
+
+SECTION_NUMBER = re.compile(r"^\d+(\.\d+)*\s+")
+TOP_LEVEL_NUMBER = re.compile(r"^\d+\s+\S")
+REFERENCE_CHAPTER = re.compile(r"\b(Reference|Devices)\b")
+KIND_ORDER = {"device": 0, "chapter": 1, "section": 2}
+MAX_TITLE_CHARS = 100  # Längre "rubriker" är brödtext som extraktionen råkat ta som rubrik
+
+
+def display_title(title: str) -> str:
+    """Rubriken utan avsnittsnummer: "9.1 Sidechain Parameters" -> "Sidechain Parameters"."""
+    return SECTION_NUMBER.sub("", title.strip())
+
+
+def normalize(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+class SectionAutocomplete:
+    def __init__(self):
+        self.titles: List[str] = []
+        self.contexts: List[Optional[str]] = []  # Närmaste överordnade rubrik (enhet eller kapitel)
+        self.kinds: List[str] = []
+        self.members: List[array] = []  # Chunkrader som hör till avsnittet
+        self.texts: List[str] = []  # content per chunkrad
+        self.sizes = array("i")  # Antal chunks med text per avsnitt
+        self.keys: List[str] = []  # Sorterade nycklar, en per ordstart i varje rubrik
+        self.key_entries = array("i")
+        self.key_at_start = array("b")  # 1 om nyckeln börjar vid rubrikens första ord
+
+    def __len__(self):
+        return len(self.titles)
+
+    def _add_entry(self, title: str, context: Optional[str], kind: str) -> int:
+        self.titles.append(title)
+        self.contexts.append(context)
+        self.kinds.append(kind)
+        self.members.append(array("i"))
+        return len(self.titles) - 1
+
+    @classmethod
+    def from_chunks(cls, chunks: List[Dict]) -> "SectionAutocomplete":
+        """
+        Bygger indexet ur chunks i manualens ordning. Ett kapitel omfattar alla chunks med
+        samma chunk_id, ett numrerat avsnitt på toppnivå ("9 Compressor") chunks fram till
+        nästa sådant, och ett underavsnitt bara sin egen chunk. Finns parent_chain räknas
+        chunken även till varje avsnitt i kedjan.
+        """
+        index = cls()
+        entries: Dict[tuple, int] = {}
+        chapters: Dict[str, int] = {}
+        chapter_titles: Dict[str, str] = {}
+        current_top: Optional[int] = None
+        previous_chapter = None
+
+        def entry(title, context, kind):
+            key = (title, context)
+            if key not in entries:
+                entries[key] = index._add_entry(title, context, kind)
+            return entries[key]
+
+        for row, chunk in enumerate(chunks):
+            index.texts.append(chunk.get("content") or "")
+            chapter = str(chunk.get("chunk_id", "")).split(".")[0]
+            raw_title = (chunk.get("title") or "").strip()
+            title = display_title(raw_title)
+
+            if chapter != previous_chapter:
+                # Första chunken i ett kapitel bär kapitlets rubrik. Filen innehåller först
+                # innehållsförteckningen och sedan texten, så varje kapitel börjar två gånger;
+                # rubriken tas från första förekomsten.
+                if chapter not in chapters:
+                    chapter_titles[chapter] = title
+                    chapters[chapter] = entry(title, None, "chapter")
+                current_top, previous_chapter = None, chapter
+            elif len(title) > MAX_TITLE_CHARS:
+                if current_top is not None:
+                    index.members[current_top].append(row)
+            else:
+                chapter_title = chapter_titles[chapter]
+                if TOP_LEVEL_NUMBER.match(raw_title) or not SECTION_NUMBER.match(raw_title):
+                    kind = "device" if REFERENCE_CHAPTER.search(chapter_title) and SECTION_NUMBER.match(raw_title) else "section"
+                    current_top = entry(title, chapter_title, kind)
+                    index.members[current_top].append(row)
+                else:
+                    parent = current_top if current_top is not None else chapters[chapter]
+                    own = entry(title, index.titles[parent], "section")
+                    index.members[own].append(row)
+                    if current_top is not None:
+                        index.members[current_top].append(row)
+            index.members[chapters[chapter]].append(row)
+
+            context = None
+            for link in chunk.get("parent_chain") or []:
+                link_title = display_title(link.get("title") or "")
+                if link_title:
+                    linked = entry(link_title, context, "section")
+                    if not index.members[linked] or index.members[linked][-1] != row:
+                        index.members[linked].append(row)
+                    context = link_title
+
+        index._build_keys()
+        return index
+
+    @classmethod
+    def from_jsonl(cls, path: str = DEFAULT_CHUNKS_PATH) -> "SectionAutocomplete":
+        return cls.from_chunks(load_chunks(path))
+
+    def _build_keys(self):
+        self.sizes = array("i", (sum(1 for row in rows if self.texts[row].strip()) for rows in self.members))
+        pairs = []
+        for i, title in enumerate(self.titles):
+            words = normalize(title).split()
+            for start in range(len(words)):
+                pairs.append((" ".join(words[start:]), i, 1 if start == 0 else 0))
+        pairs.sort()
+        self.keys = [key for key, _, _ in pairs]
+        self.key_entries = array("i", (i for _, i, _ in pairs))
+        self.key_at_start = array("b", (s for _, _, s in pairs))
+
+    def suggest(self, prefix: str, limit: int = 8, max_scan: int = 400) -> List[Dict]:
+        """
+        Förslag för ett prefix. Träffar i rubrikens början, enhetsnamn och korta rubriker
+        rankas först. Högst max_scan nycklar skannas, så ett prefix på en bokstav är lika snabbt.
+        """
+        query = normalize(prefix)
+        if not query:
+            return []
+        best: Dict[int, tuple] = {}
+        position = bisect_left(self.keys, query)
+        end = min(position + max_scan, len(self.keys))
+        while position < end and self.keys[position].startswith(query):
+            i = self.key_entries[position]
+            if self.sizes[i]:  # Rubriker utan text (bara i innehållsförteckningen) föreslås inte
+                rank = (0 if self.key_at_start[position] else 1, KIND_ORDER[self.kinds[i]], len(self.titles[i]), i)
+                if i not in best or rank < best[i]:
+                    best[i] = rank
+            position += 1
+        ranked = sorted(best, key=best.get)[:limit]
+        return [
+            {"entry": i, "title": self.titles[i], "context": self.contexts[i], "kind": self.kinds[i],
+             "chunks": self.sizes[i]}
+            for i in ranked
+        ]
+
+    def mentions(self, text: str, limit: int = 3, max_words: int = 4) -> List[int]:
+        """
+        Enheter och avsnitt som nämns vid namn i en fråga ("how does the Glue Compressor
+        work" -> Glue Compressor, inte även Compressor), längsta namnet först. Ett ord
+        räcker för enhetsnamn; avsnitt kräver minst två ord, så vanliga ord inte matchar.
+        Finns samma namn i flera kapitel väljs enheten, annars avsnittet med flest chunks.
+        """
+        words = normalize(text).split()
+        spans = []  # (rang, start, längd, avsnitt)
+        for start in range(len(words)):
+            for n in range(min(max_words, len(words) - start), 0, -1):
+                key = " ".join(words[start:start + n])
+                if len(key) < 4:
+                    continue
+                position = bisect_left(self.keys, key)
+                while position < len(self.keys) and self.keys[position] == key:
+                    i = self.key_entries[position]
+                    if (self.key_at_start[position] and self.sizes[i]
+                            and (self.kinds[i] == "device" or (self.kinds[i] == "section" and n > 1))):
+                        spans.append(((-n, KIND_ORDER[self.kinds[i]], -self.sizes[i], i), start, n, i))
+                    position += 1
+        covered, found = set(), []
+        for _, start, n, i in sorted(spans):
+            if covered.isdisjoint(range(start, start + n)) and i not in found:
+                covered.update(range(start, start + n))
+                found.append(i)
+        return found[:limit]
+
+    def label(self, entry: int) -> str:
+        context = self.contexts[entry]
+        return f"{self.titles[entry]} — {context}" if context else self.titles[entry]
+
+    def section_texts(self, entry: int, max_chunks: Optional[int] = None) -> List[str]:
+        """Avsnittets chunks i manualens ordning (tomma hoppas över), utan embedding eller sökning."""
+        texts = [self.texts[row] for row in self.members[entry] if self.texts[row].strip()]
+        return texts[:max_chunks] if max_chunks else texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Testa autocomplete över rubriker och enhetsnamn.")
+    parser.add_argument("prefix")
+    parser.add_argument("--chunks", default=DEFAULT_CHUNKS_PATH)
+    parser.add_argument("--limit", type=int, default=8)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = SectionAutocomplete.from_jsonl(args.chunks)
+    print(f"{len(index)} avsnitt, {len(index.keys)} nycklar, byggt på {time.perf_counter() - start:.2f} s.")
+
+    start = time.perf_counter()
+    suggestions = index.suggest(args.prefix, args.limit)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    for s in suggestions:
+        print(f"  [{s['kind']}] {index.label(s['entry'])} ({s['chunks']} chunks)")
+    print(f"{len(suggestions)} förslag på {elapsed_ms:.3f} ms.")
+
+
+if __name__ == "__main__":
+    main()
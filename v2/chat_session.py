@@ -0,0 +1,192 @@
+# chat_session.py
+"""
+Konversationsläge för Chatbot-sidan med återanvändning av retrieval per session.
+
+En ChatSession ligger i st.session_state och håller:
+- historiken (user/assistant-meddelanden),
+- cache av frågeembeddings, så samma fråga aldrig embeddas två gånger,
+- cache av redan hämtade chunks (text, metadata och vektor), så följdfrågor bara
+  hämtar de chunks som inte redan finns i kontexten,
+- ett memo över färdiga svar, så en omkörning med oförändrade indata inte kostar något.
+"""
+import hashlib
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from generation_queue import GenerationRejected
+from prompts import build_retrieval_only_answer
+
+
+class ChatSession:
+    def __init__(self, max_context_chunks: int = 10, max_history_turns: int = 6):
+        self.max_context_chunks = max_context_chunks
+        self.max_history_turns = max_history_turns
+        self.reset()
+
+    def reset(self):
+        self.query_embeddings: Dict[str, List[float]] = {}
+        self.chunks: Dict[object, Dict] = {}  # chunk-nyckel -> {"text", "metadata", "vector"}
+        self.memo: Dict[str, str] = {}
+        self._store_id: Optional[int] = None
+        self.stats = {"turns": 0, "memo_hits": 0, "embedding_hits": 0, "chunks_fetched": 0, "chunks_reused": 0,
+                      "faq_hits": 0, "degraded": 0}
+        self.clear_history()
+
+    def clear_history(self):
+        """Startar en ny konversation men behåller cacharna (de är fortfarande giltiga)."""
+        self.messages: List[Dict[str, str]] = []
+        self.context_keys: List[object] = []  # Chunks i nuvarande kontext, mest relevanta först
+        self.last_hits: List[Tuple[object, float]] = []  # Senaste sökningens (nyckel, likhet)
+        self.last_trace: Dict = {}  # Hur senaste frågan besvarades, med tider per steg (se query_capture.py)
+
+    def _memo_key(self, query: str, answer_language: str, k: int) -> str:
+        history = "\n".join(f"{m['role']}:{m['content']}" for m in self.messages)
+        raw = f"{query.strip()}\x00{answer_language}\x00{k}\x00{history}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def embed_query(self, query: str, embed_fn: Callable[[List[str]], List[List[float]]]) -> List[float]:
+        key = query.strip()
+        if key in self.query_embeddings:
+            self.stats["embedding_hits"] += 1
+        else:
+            self.query_embeddings[key] = embed_fn([key])[0]
+        return self.query_embeddings[key]
+
+    def retrieve(self, store, query_emb, k: int = 5, adaptive=None) -> List[Dict]:
+        """
+        Hämtar top-k för frågan. Chunks som redan finns i sessionens cache återanvänds
+        i stället för att hämtas igen, och tidigare kontext-chunks som fortfarande är
+        relevanta för frågan behålls i kontexten.
+        """
+        if id(store) != self._store_id:
+            # Nytt index (t.ex. efter hot-swap): radindexen pekar på andra chunks nu.
+            self.chunks = {}
+            self.context_keys = []
+            self._store_id = id(store)
+
+        if hasattr(store, "search"):
+            hits: List[Tuple[object, float]] = store.search(query_emb, k, adaptive=adaptive)
+            for idx, _ in hits:
+                if idx in self.chunks:
+                    self.stats["chunks_reused"] += 1
+                else:
+                    result = store.result(idx, 0.0)
+                    self.chunks[idx] = {
+                        "text": result["text"],
+                        "metadata": result["metadata"],
+                        "vector": store.vectors[idx],
+                    }
+                    self.stats["chunks_fetched"] += 1
+        else:
+            # Store utan index-API (t.ex. ShardedVectorStore): nyckla på texten.
+            hits = []
+            for r in store.semantic_search(query_emb, k=k, adaptive=adaptive):
+                key = hashlib.sha1(r["text"].encode("utf-8")).hexdigest()
+                if key in self.chunks:
+                    self.stats["chunks_reused"] += 1
+                else:
+                    self.chunks[key] = {"text": r["text"], "metadata": r["metadata"], "vector": None}
+                    self.stats["chunks_fetched"] += 1
+                hits.append((key, r["similarity"]))
+
+        # Tidigare kontext-chunks behålls om de är minst lika lika frågan som den sämsta nya träffen.
+        hit_keys = [key for key, _ in hits]
+        floor = min((score for _, score in hits), default=1.0)
+        # Cachade vektorer ligger i storens (ev. projicerade) rum.
+        if hasattr(store, "project_query"):
+            query_vector = store.project_query(query_emb)
+        else:
+            query_vector = np.asarray(query_emb, dtype=np.float32)
+        query_norm = np.linalg.norm(query_vector) or 1.0
+        kept = []
+        for key in self.context_keys:
+            vector = self.chunks[key]["vector"]
+            if key in hit_keys or vector is None:
+                continue
+            vector = np.asarray(vector, dtype=np.float32)
+            score = float(vector @ query_vector / ((np.linalg.norm(vector) or 1.0) * query_norm))
+            if score >= floor:
+                kept.append(key)
+
+        self.context_keys = (hit_keys + kept)[: self.max_context_chunks]
+        self.last_hits = hits
+        return [self.chunks[key] for key in self.context_keys]
+
+    def _faq_lookup(self, query: str, answer_language: str, faq, embed_fn) -> Optional[Dict]:
+        if faq is None:
+            return None
+        entry = faq.lookup_exact(query, answer_language)
+        if entry is None:
+            entry = faq.lookup_similar(self.embed_query(query, embed_fn), answer_language)
+        return entry
+
+    def ask(self, query: str, answer_language: str, store, embed_fn, generate_fn, k: int = 5, faq=None,
+            router=None, adaptive=None) -> str:
+        """
+        Besvarar en fråga i konversationen och lägger till båda meddelandena i historiken.
+        Ordning: sessionens memo, FAQ-storen (exakt, sedan närmaste granne) och sist live-pipelinen.
+        Med en router (query_router.QueryRouter) väljs modell och kontextstorlek per fråga,
+        och med adaptive (vector_store.AdaptiveK) är k ett tak för antalet träffar.
+        """
+        t_start = time.perf_counter()
+        memo_key = self._memo_key(query, answer_language, k)
+        self.last_hits = []  # Fylls bara om frågan går genom retrieval
+        trace = {"source": None, "timings": {}, "context": [], "model": None, "route": None,
+                 "embedding_cached": query.strip() in self.query_embeddings}
+        faq_entry = None
+        if memo_key not in self.memo:
+            faq_entry = self._faq_lookup(query, answer_language, faq, embed_fn)
+
+        if memo_key in self.memo:
+            self.stats["memo_hits"] += 1
+            answer = self.memo[memo_key]
+            trace["source"] = "memo"
+        elif faq_entry is not None:
+            self.stats["faq_hits"] += 1
+            answer = faq_entry["answer"]
+            trace["source"] = "faq"
+        else:
+            t0 = time.perf_counter()
+            query_emb = self.embed_query(query, embed_fn)
+            trace["timings"]["embed"] = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            context_chunks = self.retrieve(store, query_emb, k=k, adaptive=adaptive)
+            trace["timings"]["search"] = time.perf_counter() - t0
+            context_texts = [c["text"] for c in context_chunks]
+            history = self.messages[-2 * self.max_history_turns:]
+            options = {}
+            decision = None
+            if router is not None:
+                decision = router.route(query, [score for _, score in self.last_hits],
+                                        [self.chunks[key]["metadata"] for key, _ in self.last_hits],
+                                        has_history=bool(history), full_k=len(context_texts))
+                context_texts = context_texts[: decision.k]
+                options["model_name"] = decision.model_name
+                trace["route"], trace["model"] = decision.route, decision.model_name
+            trace["context"] = list(context_texts)
+            start = time.perf_counter()
+            try:
+                answer = generate_fn(query, context_texts, answer_language=answer_language, history=history, **options)
+                self.memo[memo_key] = answer
+                outcome = "ok"
+                trace["source"] = "live" if context_texts else "no_context"  # Utan kontext anropas ingen LLM
+            except GenerationRejected as e:
+                # Kön är full: visa de hämtade chunks direkt. Memoiseras inte, så frågan
+                # genereras på riktigt om den ställs igen när trycket har släppt.
+                self.stats["degraded"] += 1
+                answer = build_retrieval_only_answer(context_texts, answer_language)
+                outcome = e.reason
+                trace["source"] = "degraded"
+            trace["timings"]["generate"] = time.perf_counter() - start
+            if decision is not None:
+                prompt_chars = len(query) + sum(len(t) for t in context_texts) + sum(len(m["content"]) for m in history)
+                router.record(decision, time.perf_counter() - start, prompt_chars, len(answer), outcome)
+
+        trace["timings"]["total"] = time.perf_counter() - t_start
+        self.last_trace = trace
+        self.messages.append({"role": "user", "content": query})
+        self.messages.append({"role": "assistant", "content": answer})
+        self.stats["turns"] += 1
+        return answer
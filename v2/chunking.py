@@ -1,9 +1,16 @@
+import argparse
+import os
 import re
 import json
 from typing import List, Dict, Optional
 
+from dedup import DEFAULT_THRESHOLD, dedup_stage
+from ingest_profile import add_profile_arguments, ingest_profiler
+
 
 class Chunk:
+    __slots__ = ("chunk_id", "title", "content", "level", "parent_chain", "page_start", "page_end")
+
     def __init__(
         self,
         chunk_id: str,
@@ -11,21 +18,29 @@ class Chunk:
         content: str,
         level: str,
         parent_chain: List[Dict[str, str]],
+        page_start: Optional[int] = None,
+        page_end: Optional[int] = None,
     ):
         self.chunk_id = chunk_id
         self.title = title
         self.content = content
         self.level = level
         self.parent_chain = parent_chain  # [{"chunk_id":..., "title":...}, ...]
+        self.page_start = page_start  # 1-baserade sidnummer i PDF:en, om kända
+        self.page_end = page_end
 
     def to_dict(self) -> Dict:
-        return {
+        data = {
             "chunk_id": self.chunk_id,
             "title": self.title,
             "level": self.level,
             "content": self.content,
             "parent_chain": self.parent_chain,
         }
+        if self.page_start is not None:
+            data["page_start"] = self.page_start
+            data["page_end"] = self.page_end
+        return data
 
 
 def determine_level(chunk_id: str) -> str:
@@ -69,13 +84,15 @@ def update_parent_chain(
     return new_chain
 
 
-def chunk_text_from_file(input_path: str, output_path: str):
+def chunk_text_from_file(input_path: str, output_path: str, dedup_threshold: Optional[float] = DEFAULT_THRESHOLD):
     """
     Läser textfil och chunkar enligt numrerade rubriker.
+    Nästan identiska chunks slås ihop med dedup.py innan de sparas (dedup_threshold=None stänger av det).
     Sparar chunks som JSONL med metadata.
     """
-    with open(input_path, "r", encoding="utf-8") as f:
-        lines = f.readlines()
+    with ingest_profiler.stage("read"):
+        with open(input_path, "r", encoding="utf-8") as f:
+            lines = f.readlines()
 
     chunks: List[Chunk] = []
     current_chunk_id: Optional[str] = None
@@ -142,20 +159,34 @@ def chunk_text_from_file(input_path: str, output_path: str):
             )
         )
 
+    records = [chunk.to_dict() for chunk in chunks]
+    if dedup_threshold is not None:
+        with ingest_profiler.stage("dedup"):
+            report_path = os.path.join(os.path.dirname(output_path), "dedup_report.json")
+            records = dedup_stage(records, dedup_threshold, report_path)
+
     # Skriv till JSONL
-    with open(output_path, "w", encoding="utf-8") as out_file:
-        for chunk in chunks:
-            json.dump(chunk.to_dict(), out_file, ensure_ascii=False)
-            out_file.write("\n")
+    with ingest_profiler.stage("write"):
+        with open(output_path, "w", encoding="utf-8") as out_file:
+            for record in records:
+                json.dump(record, out_file, ensure_ascii=False)
+                out_file.write("\n")
 
-    print(f"Chunkning klar! {len(chunks)} chunks sparade i '{output_path}'.")
+    print(f"Chunkning klar! {len(records)} chunks sparade i '{output_path}'.")
     
 
 if __name__ == "__main__":
     # Observera användningen av r"" för att hantera backslashes korrekt i Windows-vägar.
     # Du måste köra denna kod på din egen dator för att den ska kunna läsa filen.
-    input_file = r"C:\DS24\chatbot_ableton_live_full_manual\data\full_manual_text.txt"
-    output_file = "full_manual_chunks.jsonl" # Ny utfil för chunks
+    parser = argparse.ArgumentParser(description="Chunka manualtexten enligt numrerade rubriker.")
+    parser.add_argument("input_file", nargs="?", default=r"C:\DS24\chatbot_ableton_live_full_manual\data\full_manual_text.txt")
+    parser.add_argument("output_file", nargs="?", default="full_manual_chunks.jsonl") # Ny utfil för chunks
+    parser.add_argument("--dedup-threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Minsta Jaccard-likhet för att slå ihop chunks (se dedup.py)")
+    parser.add_argument("--no-dedup", action="store_true", help="Spara chunks utan deduplicering")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
 
     # Korrigerat funktionsanrop från chunk_document till chunk_text_from_file
-    chunk_text_from_file(input_file, output_file)
\ No newline at end of file
+    with ingest_profiler.session("chunking", args):
+        chunk_text_from_file(args.input_file, args.output_file, None if args.no_dedup else args.dedup_threshold)
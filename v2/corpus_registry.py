@@ -0,0 +1,449 @@
+# corpus_registry.py
+"""
+Register över korpusar (manualer) som en och samma process kan svara från.
+
+Korpusarna listas i data/corpora.json med titel, indexkatalog, chunkfil,
+embeddingmodell och ev. en fast indexversion. Varje korpus har ett eget
+versionerat index (index_snapshots.py) som laddas först när korpusen efterfrågas
+och släpps igen vid minnesbrist, minst nyligen använd först:
+- CORPUS_MEMORY_MB: tak för summan av laddade index (VectorStore.memory_bytes),
+- CORPUS_MIN_AVAILABLE_MB: släpp ett index när systemets lediga minne understiger gränsen.
+Frågor över flera korpusar skickas till varje korpus parallellt och träffarna slås
+ihop på likhet; varje träff får korpusens namn i metadata["corpus"]. Samma text från
+flera korpusar (en delmanual ingår i hela manualen) tas bara med en gång.
+En korpus utan index provas inte igen förrän dess CURRENT ändrats.
+
+Sökvägar i manifestet är relativa till manifestets katalog. Registret byggs först när
+get_registry() anropas och index_snapshots importeras först vid första laddningen, så
+appens import av modulen är billig.
+
+    python corpus_registry.py list
+    python corpus_registry.py build live12-midi
+    python corpus_registry.py search "how do I quantize notes" --corpus all
+"""
+import argparse
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
+
+from text_store import text_id
+from vector_store import VectorStore
+
+if TYPE_CHECKING:
+    from index_snapshots import IndexManager  # Importeras först när ett index laddas
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+DEFAULT_MANIFEST_PATH = os.path.join(DATA_DIR, "corpora.json")
+DEFAULT_EMBEDDING_MODEL = "models/embedding-001"
+ALL_CORPORA = "all"
+
+
+def _available_bytes() -> Optional[int]:
+    """Systemets lediga minne (MemAvailable) eller None där /proc/meminfo saknas."""
+    try:
+        with open("/proc/meminfo", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _megabytes(value: Optional[str]) -> Optional[int]:
+    return int(float(value) * 1024 * 1024) if value else None
+
+
+class Corpus:
+    __slots__ = ("name", "title", "index_root", "legacy_path", "chunks_path", "embedding_model", "version")
+
+    def __init__(self, name: str, title: str, index_root: str, chunks_path: Optional[str] = None,
+                 legacy_path: Optional[str] = None, embedding_model: str = DEFAULT_EMBEDDING_MODEL,
+                 version: Optional[str] = None):
+        self.name = name
+        self.title = title
+        self.index_root = index_root
+        self.chunks_path = chunks_path
+        self.legacy_path = legacy_path
+        self.embedding_model = embedding_model
+        self.version = version  # Fast snapshot-version; None = den som CURRENT pekar på
+
+    @classmethod
+    def from_dict(cls, entry: Dict, base_dir: str) -> "Corpus":
+        def path(key):
+            return os.path.normpath(os.path.join(base_dir, entry[key])) if entry.get(key) else None
+
+        return cls(entry["name"], entry.get("title") or entry["name"], path("index_root"), path("chunks"),
+                   path("legacy_path"), entry.get("embedding_model", DEFAULT_EMBEDDING_MODEL), entry.get("version"))
+
+
+def default_corpora() -> List[Corpus]:
+    """Utan manifest: bara hela Live 12-manualen, med samma sökvägar som appen alltid använt."""
+    return [Corpus("live12", "Ableton Live 12 Reference Manual", os.path.join(DATA_DIR, "index"),
+                   os.path.join(DATA_DIR, "full_manual_chunks.jsonl"),
+                   os.path.join(DATA_DIR, "full_embeddings.parquet"))]
+
+
+class CorpusResults(list):
+    """Sammanslagen resultatlista (samma format som VectorStore.semantic_search) med korpusar som inte kunde sökas."""
+
+    def __init__(self, results=(), missing_corpora: Sequence[str] = ()):
+        super().__init__(results)
+        self.missing_corpora = list(missing_corpora)
+
+
+class CorpusRegistry:
+    def __init__(self, corpora: List[Corpus], default: Optional[str] = None, memory_budget: Optional[int] = None,
+                 min_available: Optional[int] = None, watch: bool = True, poll_interval: float = 30.0,
+                 check_interval: float = 5.0):
+        if not corpora:
+            raise ValueError("Registret behöver minst en korpus")
+        self.corpora: Dict[str, Corpus] = {corpus.name: corpus for corpus in corpora}
+        self.default = default or corpora[0].name
+        if self.default not in self.corpora:
+            raise ValueError(f"Okänd standardkorpus '{self.default}'")
+        self.memory_budget = memory_budget
+        self.min_available = min_available
+        self.watch = watch
+        self.poll_interval = poll_interval
+        self.check_interval = check_interval
+        self._managers: "OrderedDict[str, IndexManager]" = OrderedDict()  # Laddade index, minst nyligen använt först
+        self._load_locks = {name: threading.Lock() for name in self.corpora}
+        self._lock = threading.Lock()
+        self._sizes: Dict[Tuple[str, str], int] = {}  # (korpus, indexversion) -> memory_bytes
+        self._missing: Dict[str, Tuple] = {}  # Korpus utan index -> _index_marker när laddningen misslyckades
+        self._last_check = 0.0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._fanouts: Dict[Tuple[str, ...], "CorpusFanout"] = {}
+        self.stats = {"loads": 0, "evictions": 0, "load_seconds": {}}
+
+    @classmethod
+    def from_manifest(cls, path: str = DEFAULT_MANIFEST_PATH, **kwargs) -> "CorpusRegistry":
+        if not os.path.exists(path):
+            return cls(default_corpora(), **kwargs)
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        base_dir = os.path.dirname(os.path.abspath(path))
+        corpora = [Corpus.from_dict(entry, base_dir) for entry in manifest["corpora"]]
+        return cls(corpora, default=manifest.get("default"), **kwargs)
+
+    def names(self) -> List[str]:
+        return list(self.corpora)
+
+    def label(self, name: str) -> str:
+        return "All corpora" if name == ALL_CORPORA else self.corpora[name].title
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._managers
+
+    @staticmethod
+    def _index_marker(corpus: Corpus) -> Tuple:
+        from index_snapshots import read_current_version
+
+        legacy = corpus.legacy_path is not None and os.path.exists(corpus.legacy_path)
+        return corpus.version, read_current_version(corpus.index_root), legacy
+
+    @staticmethod
+    def _missing_error(corpus: Corpus) -> FileNotFoundError:
+        return FileNotFoundError(f"Korpusen '{corpus.name}' har inget index i '{corpus.index_root}'; "
+                                 f"kör 'python corpus_registry.py build {corpus.name}'.")
+
+    def manager(self, name: Optional[str] = None) -> "IndexManager":
+        """Korpusens IndexManager; indexet laddas vid första anropet. FileNotFoundError om inget index finns."""
+        name = name or self.default
+        corpus = self.corpora[name]
+        with self._lock:
+            manager = self._managers.get(name)
+            if manager is not None:
+                self._managers.move_to_end(name)
+        if manager is None:
+            if name in self._missing and self._missing[name] == self._index_marker(corpus):
+                raise self._missing_error(corpus)  # Inget nytt index sedan förra försöket
+            with self._load_locks[name]:  # Samtidiga frågor mot samma korpus laddar den bara en gång
+                manager = self._managers.get(name) or self._load(corpus)
+        if time.monotonic() - self._last_check > self.check_interval:
+            self.relieve_pressure(keep=name)
+        return manager
+
+    def snapshot(self, name: Optional[str] = None) -> Tuple[Optional[str], Optional[VectorStore]]:
+        return self.manager(name).snapshot()
+
+    def _load(self, corpus: Corpus) -> "IndexManager":
+        from index_snapshots import IndexManager
+
+        start = time.perf_counter()
+        marker = self._index_marker(corpus)
+        manager = IndexManager(corpus.index_root, legacy_path=corpus.legacy_path, poll_interval=self.poll_interval,
+                               pinned_version=corpus.version)
+        if not manager.load_initial():
+            error = self._missing_error(corpus)
+            if self._missing.get(corpus.name) != marker:
+                print(error)
+            self._missing[corpus.name] = marker
+            raise error
+        self._missing.pop(corpus.name, None)
+        if self.watch:
+            manager.start_watcher()
+        with self._lock:
+            self._managers[corpus.name] = manager
+            self.stats["loads"] += 1
+            self.stats["load_seconds"][corpus.name] = round(time.perf_counter() - start, 3)
+        print(f"Laddade korpus {corpus.name} ({manager.version}) på {time.perf_counter() - start:.1f} s.")
+        self.relieve_pressure(keep=corpus.name)
+        return manager
+
+    def _store_bytes(self, name: str, version: str, store) -> int:
+        size = self._sizes.get((name, version))
+        if size is None:
+            size = self._sizes[(name, version)] = store.memory_bytes()
+        return size
+
+    def _loaded(self) -> List[Tuple[str, str, VectorStore]]:
+        with self._lock:
+            managers = list(self._managers.items())
+        loaded = [(name, *manager.snapshot()) for name, manager in managers]
+        return [(name, version, store) for name, version, store in loaded if store is not None]
+
+    def loaded_bytes(self) -> int:
+        loaded = self._loaded()
+        live = {(name, version) for name, version, _ in loaded}
+        # Versioner som bytts ut (hot swap) eller släppts räknas inte längre.
+        self._sizes = {key: size for key, size in self._sizes.items() if key in live}
+        return sum(self._store_bytes(name, version, store) for name, version, store in loaded)
+
+    def evict(self, name: str) -> bool:
+        """Släpper korpusens index. Pågående frågor har egna referenser och avslutas mot det."""
+        with self._lock:
+            manager = self._managers.pop(name, None)
+            if manager is None:
+                return False
+            self.stats["evictions"] += 1
+            self._sizes = {key: size for key, size in self._sizes.items() if key[0] != name}
+        manager.stop_watcher()
+        print(f"Släppte korpus {name}.")
+        return True
+
+    def relieve_pressure(self, keep: Optional[str] = None) -> List[str]:
+        """Släpper minst nyligen använda index tills budgeten håller; keep släpps aldrig."""
+        self._last_check = time.monotonic()
+        evicted = []
+
+        def oldest():
+            with self._lock:
+                return next((name for name in self._managers if name != keep), None)
+
+        while self.memory_budget is not None and self.loaded_bytes() > self.memory_budget:
+            victim = oldest()
+            if victim is None or not self.evict(victim):
+                break
+            evicted.append(victim)
+        if self.min_available is not None:
+            available = _available_bytes()
+            victim = oldest()
+            # Ett index per kontroll: minnet återlämnas först när pågående frågor släppt sina referenser.
+            if available is not None and available < self.min_available and victim is not None and self.evict(victim):
+                evicted.append(victim)
+        return evicted
+
+    def _resolve(self, names) -> List[str]:
+        if names is None or names == ALL_CORPORA:
+            return self.names()
+        if isinstance(names, str):
+            return [names]
+        return list(names)
+
+    def search(self, query_embedding, names=None, k: int = 15, adaptive=None) -> CorpusResults:
+        """
+        Söker i en eller flera korpusar (None/"all" = alla) och slår ihop träffarna på likhet.
+        Korpusar utan index hoppas över och listas i resultatets missing_corpora.
+        """
+        names = self._resolve(names)
+        models = {self.corpora[name].embedding_model for name in names}
+        if len(models) > 1:
+            raise ValueError(f"Korpusarna har olika embeddingmodeller ({', '.join(sorted(models))}); "
+                             "likheterna går inte att jämföra.")
+
+        def search_one(name):
+            _, store = self.snapshot(name)
+            return [{**r, "metadata": {**r["metadata"], "corpus": name}}
+                    for r in store.semantic_search(query_embedding, k=k, adaptive=adaptive)]
+
+        if len(names) == 1:
+            pending = {names[0]: None}
+        else:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=len(self.corpora), thread_name_prefix="corpus-search")
+            pending = {name: self._executor.submit(search_one, name) for name in names}
+        per_corpus, missing = [], []
+        for name, future in pending.items():
+            try:
+                per_corpus.append(future.result() if future is not None else search_one(name))
+            except FileNotFoundError:
+                missing.append(name)  # Skrivs ut av _load första gången
+        merged = heapq.merge(*per_corpus, key=lambda r: r["similarity"], reverse=True)
+        if len(per_corpus) > 1:
+            # Bästa träffen per text behålls, så överlappande korpusar inte tar dubbla platser i top-k.
+            seen = set()
+            merged = (r for r in merged if not (text_id(r["text"]) in seen or seen.add(text_id(r["text"]))))
+        merged = list(itertools.islice(merged, k))
+        if adaptive is not None:  # Samma urval som VectorStore.search, på den sammanslagna listan
+            merged = merged[: adaptive.select([r["similarity"] for r in merged])]
+        return CorpusResults(merged, missing_corpora=missing)
+
+    def fanout(self, names=None) -> "CorpusFanout":
+        """En store-liknande vy över flera korpusar; samma objekt per urval, så ChatSessions cachar består."""
+        key = tuple(self._resolve(names))
+        with self._lock:
+            if key not in self._fanouts:
+                self._fanouts[key] = CorpusFanout(self, list(key))
+            return self._fanouts[key]
+
+    def report(self) -> List[Dict]:
+        from index_snapshots import read_current_version
+
+        loaded = {name: (version, store) for name, version, store in self._loaded()}
+        rows = []
+        for name, corpus in self.corpora.items():
+            version, store = loaded.get(name, (None, None))
+            rows.append({
+                "corpus": name,
+                "title": corpus.title,
+                "loaded": store is not None,
+                "version": version if store is not None else corpus.version or read_current_version(corpus.index_root),
+                "items": len(store) if store is not None else None,
+                "memory_mb": round(self._store_bytes(name, version, store) / 1e6, 1) if store is not None else None,
+                "missing_index": name in self._missing,
+                "load_seconds": self.stats["load_seconds"].get(name),
+            })
+        return rows
+
+
+class CorpusFanout:
+    """
+    Sök över flera korpusar med samma gränssnitt som ShardedVectorStore (bara semantic_search),
+    så ChatSession och Evaluation-sidan kan använda den som store. Indexen slås upp i registret
+    vid varje sökning, så vyn fungerar även efter att en korpus släppts och laddats om.
+    """
+    related = None  # Grannar finns per korpus, inte över korpusar
+
+    def __init__(self, registry: CorpusRegistry, names: List[str]):
+        self.registry = registry
+        self.names = names
+
+    def semantic_search(self, query_embedding, k=15, adaptive=None) -> CorpusResults:
+        return self.registry.search(query_embedding, self.names, k=k, adaptive=adaptive)
+
+
+def build_corpus(corpus: Corpus, embed_fn, batch_size: int = 100) -> str:
+    """Embeddar korpusens chunks och publicerar dem som ny version i korpusens indexkatalog."""
+    import shutil
+
+    from hierarchical_search import HIERARCHY_FILE, HierarchicalIndex
+    from rag_utils import load_chunks
+    from related_sections import RELATED_FILE, RelatedSections
+    from index_snapshots import EMBEDDINGS_FILE, commit_snapshot, stage_snapshot
+    from text_store import TEXTS_FILE, write_for_store
+
+    chunks = [c for c in load_chunks(corpus.chunks_path) if c.get("content", "").strip()]
+    if not chunks:
+        raise SystemExit(f"Inga chunks med text i '{corpus.chunks_path}'.")
+    store = VectorStore()
+    for i in range(0, len(chunks), batch_size):
+        batch = chunks[i:i + batch_size]
+        for chunk, embedding in zip(batch, embed_fn([c["content"] for c in batch])):
+            store.add_item(chunk["content"], embedding, chunk)
+        print(f"Embeddat {min(i + batch_size, len(chunks))}/{len(chunks)} chunks.")
+
+    staging_dir = stage_snapshot(corpus.index_root)
+    try:
+        store.save(os.path.join(staging_dir, EMBEDDINGS_FILE))
+        RelatedSections.build(store).save(os.path.join(staging_dir, RELATED_FILE))
+        HierarchicalIndex.build(store).save(os.path.join(staging_dir, HIERARCHY_FILE))
+        write_for_store(store, os.path.join(staging_dir, TEXTS_FILE))
+        return commit_snapshot(staging_dir, {"corpus": corpus.name, "embedding_model": corpus.embedding_model,
+                                             "n_items": len(store)})
+    except Exception:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+
+
+_registry: Optional[CorpusRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> CorpusRegistry:
+    """Processens gemensamma register, byggt ur CORPORA_MANIFEST vid första anropet."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = CorpusRegistry.from_manifest(
+                os.environ.get("CORPORA_MANIFEST", DEFAULT_MANIFEST_PATH),
+                memory_budget=_megabytes(os.environ.get("CORPUS_MEMORY_MB")),
+                min_available=_megabytes(os.environ.get("CORPUS_MIN_AVAILABLE_MB")),
+            )
+        return _registry
+
+
+def _embed_fn(kind: str):
+    if kind == "stub":
+        from stub_servers import stub_embedding
+
+        return lambda texts: [stub_embedding(text) for text in texts]
+    from dotenv import load_dotenv
+    from rag_utils import create_embeddings
+
+    load_dotenv()
+    return create_embeddings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hantera korpusarna i data/corpora.json.")
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="Lista korpusar, versioner och embeddingmodeller")
+    build = sub.add_parser("build", help="Embedda en korpus och publicera dess index")
+    build.add_argument("corpus")
+    build.add_argument("--embed", choices=["live", "stub"], default="live")
+    build.add_argument("--batch-size", type=int, default=100)
+    search = sub.add_parser("search", help="Sök i en eller alla korpusar")
+    search.add_argument("query")
+    search.add_argument("--corpus", default=ALL_CORPORA)
+    search.add_argument("--k", type=int, default=5)
+    search.add_argument("--embed", choices=["live", "stub"], default="live")
+    args = parser.parse_args()
+
+    from index_snapshots import list_snapshots, read_current_version
+
+    registry = CorpusRegistry.from_manifest(args.manifest, watch=False)
+    if args.command == "list":
+        for name, corpus in registry.corpora.items():
+            current = corpus.version or read_current_version(corpus.index_root)
+            print(f"{'*' if name == registry.default else ' '} {name}: {corpus.title}")
+            print(f"    version {current or '-'} ({'fast' if corpus.version else 'CURRENT'}), "
+                  f"{len(list_snapshots(corpus.index_root))} snapshots, {corpus.embedding_model}")
+            print(f"    index {corpus.index_root}, chunks {corpus.chunks_path or '-'}")
+    elif args.command == "build":
+        version = build_corpus(registry.corpora[args.corpus], _embed_fn(args.embed), args.batch_size)
+        print(f"Publicerade {args.corpus} version {version}.")
+    elif args.command == "search":
+        query_embedding = _embed_fn(args.embed)([args.query])[0]
+        start = time.perf_counter()
+        results = registry.search(query_embedding, args.corpus, k=args.k)
+        elapsed = time.perf_counter() - start
+        for r in results:
+            print(f"  {r['similarity']:.3f}  [{r['metadata']['corpus']}] {str(r['metadata'].get('title'))[:70]}")
+        if results.missing_corpora:
+            print(f"Utan index: {', '.join(results.missing_corpora)}")
+        print(f"{len(results)} träffar på {elapsed:.2f} s (inklusive laddning).")
+        for row in registry.report():
+            print(f"  {row['corpus']}: {'laddad' if row['loaded'] else 'ej laddad'}, {row['memory_mb']} MB")
+
+
+if __name__ == "__main__":
+    main()
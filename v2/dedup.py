@@ -0,0 +1,237 @@
+# dedup.py
+"""
+Hittar nästan identiska chunks (parametertabeller, "see also"-stycken, upprepade
+intron) med MinHash och LSH och slår ihop dem innan de embeddas.
+
+Varje chunk får en MinHash-signatur över sina ord-shingles. Signaturen delas i
+band och chunks som delar minst ett band hamnar i samma hink; bara de paren
+jämförs, så körtiden växer ungefär linjärt med antalet chunks i stället för
+kvadratiskt. Par vars uppskattade Jaccard-likhet når tröskeln slås ihop till en
+kanonisk chunk (den första i läsordning) som får "aliases" med de övrigas
+chunk_id, titel och sidor, så att källhänvisningar till dem inte går förlorade.
+Varje medlem jämförs mot klustrets kanoniska chunk, inte bara mot sin granne, så
+en kedja av små ändringar (A~B~C~...) slås inte ihop till ett kluster där sista
+chunken knappt liknar den första.
+
+chunking.py och outline_chunking.py kör dedupliceringen som ett steg innan de skriver
+sina chunks (--no-dedup stänger av det). Skriptet nedan skriver aldrig över indatat:
+
+    python dedup.py data/full_manual_chunks.jsonl                 # -> data/full_manual_chunks.dedup.jsonl
+    python dedup.py data/full_manual_chunks.jsonl --threshold 0.9 --dry-run
+"""
+import argparse
+import json
+import os
+import re
+import zlib
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+DEFAULT_CHUNKS_PATH = os.path.join("data", "full_manual_chunks.jsonl")
+DEFAULT_REPORT_PATH = os.path.join("data", "dedup_report.json")
+DEFAULT_THRESHOLD = 0.85
+
+MERSENNE_PRIME = (1 << 31) - 1  # a * x < 2^63 för 32-bitars x, så uint64 räcker utan överspill
+NUM_PERM = 128
+BANDS = 16  # 16 band x 8 rader: kandidatkurvan brantast runt likhet ~0.7
+SHINGLE_SIZE = 5
+WORD = re.compile(r"\w+")
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> np.ndarray:
+    """Hashade ord-n-gram (uint64). Texter kortare än ett shingle ger en tom array."""
+    words = WORD.findall(text.lower())
+    grams = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+    return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.a = rng.randint(1, MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+        self.b = rng.randint(0, MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+
+    def signature(self, shingle_hashes: np.ndarray) -> np.ndarray:
+        """Minsta värdet av (a * x + b) mod p per permutation, som uint32."""
+        x = shingle_hashes & np.uint64(MERSENNE_PRIME)
+        hashed = (self.a[:, None] * x[None, :] + self.b[:, None]) % np.uint64(MERSENNE_PRIME)
+        return hashed.min(axis=1).astype(np.uint32)
+
+
+class _UnionFind:
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i: int, j: int):
+        ri, rj = self.find(i), self.find(j)
+        if ri != rj:
+            # Lägst index blir rot, så den första chunken i läsordning blir kanonisk.
+            self.parent[max(ri, rj)] = min(ri, rj)
+
+
+def find_duplicate_clusters(texts: List[str], threshold: float = DEFAULT_THRESHOLD, bands: int = BANDS,
+                            num_perm: int = NUM_PERM) -> Tuple[List[List[int]], int]:
+    """
+    Grupperar nästan identiska texter. Returnerar (kluster med minst två medlemmar,
+    antal jämförda kandidatpar). Varje kluster är sorterat; första index är kanoniskt
+    och alla medlemmar når tröskeln mot det.
+    """
+    if num_perm % bands:
+        raise ValueError("num_perm måste vara delbart med bands")
+    rows = num_perm // bands
+    hasher = MinHasher(num_perm)
+    signatures = np.zeros((len(texts), num_perm), dtype=np.uint32)
+    has_signature = np.zeros(len(texts), dtype=bool)
+    for i, text in enumerate(texts):
+        hashes = shingles(text)
+        if len(hashes):  # För korta texter (t.ex. rena rubriker) lämnas orörda
+            signatures[i] = hasher.signature(hashes)
+            has_signature[i] = True
+
+    def similarity(canonical: int, rows: List[int]) -> np.ndarray:
+        return np.mean(signatures[rows] == signatures[canonical], axis=1)
+
+    union_find = _UnionFind(len(texts))
+    cluster_members: Dict[int, List[int]] = {}  # Rot -> medlemmar, bara för kluster med fler än en
+    candidates = 0
+    for band in range(bands):
+        buckets: Dict[bytes, List[int]] = defaultdict(list)
+        band_rows = signatures[:, band * rows:(band + 1) * rows]
+        for i in np.flatnonzero(has_signature):
+            buckets[band_rows[i].tobytes()].append(int(i))
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            # Jämför mot hinkens första medlem i stället för alla par, så att stora
+            # hinkar (samma parametertabell hundra gånger) inte blir kvadratiska.
+            head = members[0]
+            for other in members[1:]:
+                root_head, root_other = union_find.find(head), union_find.find(other)
+                if root_head == root_other:
+                    continue
+                candidates += 1
+                # Det sammanslagna klustrets kanoniska chunk är den lägsta roten; hela det
+                # andra klustret måste nå tröskeln mot den, inte bara paret i hinken.
+                canonical, absorbed = min(root_head, root_other), max(root_head, root_other)
+                absorbed_members = cluster_members.get(absorbed, [absorbed])
+                if similarity(canonical, absorbed_members).min() >= threshold:
+                    union_find.union(canonical, absorbed)
+                    cluster_members[canonical] = cluster_members.get(canonical, [canonical]) + absorbed_members
+                    cluster_members.pop(absorbed, None)
+
+    clusters = []
+    for canonical, members in cluster_members.items():
+        members = sorted(members)
+        # Kontroll av invarianten: ingen medlem under tröskeln mot den kanoniska chunken.
+        kept = [i for i, score in zip(members, similarity(canonical, members)) if score >= threshold]
+        if len(kept) > 1:
+            clusters.append(kept)
+    return sorted(clusters), candidates
+
+
+def _alias(chunk: Dict) -> Dict:
+    alias = {"chunk_id": chunk.get("chunk_id"), "title": chunk.get("title")}
+    if chunk.get("page_start") is not None:
+        alias["page_start"] = chunk["page_start"]
+        alias["page_end"] = chunk.get("page_end")
+    return alias
+
+
+def dedup_chunks(chunks: List[Dict], threshold: float = DEFAULT_THRESHOLD) -> Tuple[List[Dict], Dict]:
+    """
+    Slår ihop nästan identiska chunks. Den kanoniska chunken behåller sin plats och
+    sitt innehåll och får "aliases"; övriga medlemmar tas bort. Returnerar (chunks, rapport).
+    """
+    clusters, candidates = find_duplicate_clusters([c.get("content", "") for c in chunks], threshold)
+    removed = set()
+    for members in clusters:
+        canonical = chunks[members[0]]
+        aliases = canonical.get("aliases", []) + [_alias(chunks[i]) for i in members[1:]]
+        canonical["aliases"] = aliases
+        removed.update(members[1:])
+
+    kept = [c for i, c in enumerate(chunks) if i not in removed]
+    chars_before = sum(len(c.get("content", "")) for c in chunks)
+    chars_after = sum(len(c.get("content", "")) for c in kept)
+    report = {
+        "threshold": threshold,
+        "chunks_before": len(chunks),
+        "chunks_after": len(kept),
+        "removed": len(removed),
+        "clusters": len(clusters),
+        "candidate_pairs": candidates,
+        "chars_before": chars_before,
+        "chars_after": chars_after,
+        "embedding_calls_saved": len(removed),
+        "largest_clusters": [
+            {
+                "canonical": chunks[members[0]].get("chunk_id"),
+                "size": len(members),
+                "aliases": [chunks[i].get("chunk_id") for i in members[1:]],
+            }
+            for members in sorted(clusters, key=len, reverse=True)[:20]
+        ],
+    }
+    return kept, report
+
+
+def print_report(report: Dict):
+    saved = report["chars_before"] - report["chars_after"]
+    share = saved / report["chars_before"] if report["chars_before"] else 0.0
+    print(f"{report['chunks_before']} chunks -> {report['chunks_after']} "
+          f"({report['removed']} dubbletter i {report['clusters']} kluster, "
+          f"{report['candidate_pairs']} kandidatpar jämförda).")
+    print(f"Text: {report['chars_before']} -> {report['chars_after']} tecken ({share:.1%} mindre); "
+          f"{report['embedding_calls_saved']} färre embedding-anrop.")
+    for cluster in report["largest_clusters"][:5]:
+        print(f"  {cluster['canonical']}: {cluster['size']} st ({', '.join(cluster['aliases'][:5])})")
+
+
+def dedup_stage(chunks: List[Dict], threshold: float = DEFAULT_THRESHOLD,
+                report_path: str = DEFAULT_REPORT_PATH) -> List[Dict]:
+    """Steget efter chunkningen: deduplicerar, skriver ut och sparar rapporten."""
+    kept, report = dedup_chunks(chunks, threshold)
+    print_report(report)
+    if report_path:
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+    return kept
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Slå ihop nästan identiska chunks före embedding.")
+    parser.add_argument("input_path", nargs="?", default=DEFAULT_CHUNKS_PATH)
+    parser.add_argument("output_path", nargs="?", default=None, help="Standard: <input_path>.dedup.jsonl")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Minsta uppskattade Jaccard-likhet")
+    parser.add_argument("--report", default=DEFAULT_REPORT_PATH)
+    parser.add_argument("--dry-run", action="store_true", help="Skriv bara rapporten")
+    args = parser.parse_args()
+
+    output_path = args.output_path or os.path.splitext(args.input_path)[0] + ".dedup.jsonl"
+    if os.path.abspath(output_path) == os.path.abspath(args.input_path):
+        parser.error("output_path får inte vara samma fil som input_path")
+
+    with open(args.input_path, "r", encoding="utf-8") as f:
+        chunks = [json.loads(line) for line in f if line.strip()]
+    kept = dedup_stage(chunks, args.threshold, args.report)
+    if args.dry_run:
+        return
+
+    with open(output_path, "w", encoding="utf-8") as out_file:
+        for chunk in kept:
+            json.dump(chunk, out_file, ensure_ascii=False)
+            out_file.write("\n")
+    print(f"{len(kept)} chunks sparade i '{output_path}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
+import argparse
 import re
 from pypdf import PdfReader
-from typing import List, Tuple
+from typing import List, Optional, Tuple
+
+from ingest_profile import add_profile_arguments, ingest_profiler
+from page_cache import DEFAULT_CACHE_PATH, PageCache, write_change_report
 
 def clean_line(line: str) -> str:
     """
@@ -101,68 +105,107 @@ def flush_paragraph(lines: List[str]) -> str:
     return re.sub(r'\s+', ' ', "".join(paragraph)).strip()
 
 
-def extract_full_text_from_pdf(pdf_path: str) -> str:
+def process_page_text(text: str) -> str:
+    """Rensar en sidas råtext och formaterar rubriker och stycken."""
+    page_output: List[str] = []
+    paragraph_lines: List[str] = []
+
+    # Bearbeta rader individuellt
+    for line in text.split('\n'):
+        cleaned_line = clean_line(line) # Först rensa raden
+
+        if not cleaned_line: # Hoppa över om raden blir tom efter rensning
+            continue
+
+        if is_heading(cleaned_line): # Kontrollera om det är en rubrik
+            if paragraph_lines: # Flusha eventuella ackumulerade styckesrader
+                page_output.append(flush_paragraph(paragraph_lines))
+                paragraph_lines = []
+
+            # Lägg till en tom rad före och efter rubriken för bättre läsbarhet och chunking
+            page_output.append("")
+            page_output.append(cleaned_line)
+            page_output.append("")
+        else:
+            paragraph_lines.append(cleaned_line) # Annars är det en del av ett stycke
+
+    # Flusha eventuella kvarvarande styckesrader från slutet av sidan
+    if paragraph_lines:
+        page_output.append(flush_paragraph(paragraph_lines))
+
+    return '\n'.join(page_output)
+
+
+def extract_full_text_from_pdf(pdf_path: str, cache: Optional[PageCache] = None) -> str:
     """
     Extraherar och rensar text från ALLA sidor i en PDF.
     Returnerar en sammanhängande sträng med formaterad text.
+    Med en PageCache extraheras bara sidor vars innehåll ändrats sedan tidigare körningar.
     """
     full_text: List[str] = []
     reader = PdfReader(pdf_path)
     num_pages = len(reader.pages)
+    page_hashes: List[str] = []
 
     print(f"Totala antalet sidor i PDF:en: {num_pages}")
 
     for i in range(num_pages):
-        try:
-            page = reader.pages[i]
-            text = page.extract_text()
-        except Exception as e:
-            print(f"Fel vid läsning av sida {i + 1}: {e}")
-            continue
-
-        if not text:
-            continue
-
-        page_output: List[str] = []
-        paragraph_lines: List[str] = []
-
-        # Bearbeta rader individuellt
-        for line in text.split('\n'):
-            cleaned_line = clean_line(line) # Först rensa raden
-
-            if not cleaned_line: # Hoppa över om raden blir tom efter rensning
+        with ingest_profiler.unit("pages", f"sida {i + 1}"):
+            try:
+                page = reader.pages[i]
+                key = cache.hash(page) if cache is not None else None
+                page_hashes.append(key)
+                cached_text = cache.get(key) if cache is not None else None
+                if cached_text is not None:
+                    if cached_text:
+                        full_text.append(cached_text)
+                    continue
+                text = page.extract_text()
+            except Exception as e:
+                print(f"Fel vid läsning av sida {i + 1}: {e}")
+                if len(page_hashes) <= i:
+                    page_hashes.append("")
                 continue
 
-            if is_heading(cleaned_line): # Kontrollera om det är en rubrik
-                if paragraph_lines: # Flusha eventuella ackumulerade styckesrader
-                    page_output.append(flush_paragraph(paragraph_lines))
-                    paragraph_lines = []
+            page_text = process_page_text(text) if text else ""
+            if cache is not None:
+                cache.put(key, page_text)
+            if page_text:
+                full_text.append(page_text)
+            if (i + 1) % 50 == 0: # Utskrifter för att se framsteg var 50:e sida
+                print(f"Bearbetat {i + 1}/{num_pages} sidor...")
 
-                # Lägg till en tom rad före och efter rubriken för bättre läsbarhet och chunking
-                page_output.append("")
-                page_output.append(cleaned_line)
-                page_output.append("")
-            else:
-                paragraph_lines.append(cleaned_line) # Annars är det en del av ett stycke
-
-        # Flusha eventuella kvarvarande styckesrader från slutet av sidan
-        if paragraph_lines:
-            page_output.append(flush_paragraph(paragraph_lines))
-
-        full_text.append('\n'.join(page_output))
-        if (i + 1) % 50 == 0: # Utskrifter för att se framsteg var 50:e sida
-            print(f"Bearbetat {i + 1}/{num_pages} sidor...")
+    if cache is not None:
+        cache.record_run(pdf_path, page_hashes)
 
     return '\n\n'.join(full_text).strip()
 
 if __name__ == "__main__":
-    pdf_file_path = r"C:\DS24\chatbot_ableton_live_full_manual\data\Ableton_12_manual.pdf" # Se till att denna fil finns
-    output_file_path = "full_manual_text.txt" # Ny utfil för hela manualtexten
-
-    print("Startar extraktion av hela manualen med förbättrad rensning och rubrikidentifiering...")
-    extracted_text = extract_full_text_from_pdf(pdf_file_path)
-
-    with open(output_file_path, "w", encoding="utf-8") as f:
-        f.write(extracted_text)
-
-    print(f"Hela manualtexten har extraherats och sparats till '{output_file_path}'.")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Extrahera hela manualens text från PDF:en.")
+    parser.add_argument("pdf_path", nargs="?", default=r"C:\DS24\chatbot_ableton_live_full_manual\data\Ableton_12_manual.pdf") # Se till att denna fil finns
+    parser.add_argument("output_path", nargs="?", default="full_manual_text.txt") # Ny utfil för hela manualtexten
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="Sidcache för inkrementell extraktion")
+    parser.add_argument("--no-cache", action="store_true", help="Extrahera alla sidor på nytt")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    with ingest_profiler.session("extract", args) as profiling:
+        if profiling:
+            # Namnen slås upp vid varje anrop, så tiden för rensningen skiljs från pypdf:s extract_text
+            clean_line = ingest_profiler.wrap(clean_line)
+            process_page_text = ingest_profiler.wrap(process_page_text)
+
+        print("Startar extraktion av hela manualen med förbättrad rensning och rubrikidentifiering...")
+        page_cache = None if args.no_cache else PageCache(args.cache)
+        with ingest_profiler.stage("extract"):
+            extracted_text = extract_full_text_from_pdf(args.pdf_path, cache=page_cache)
+
+        with ingest_profiler.stage("write"):
+            with open(args.output_path, "w", encoding="utf-8") as f:
+                f.write(extracted_text)
+
+            if page_cache is not None:
+                page_cache.save()
+                write_change_report(page_cache.changed_pages, page_cache.page_count)
+
+        print(f"Hela manualtexten har extraherats och sparats till '{args.output_path}'.")
@@ -0,0 +1,176 @@
+# faq_store.py
+"""
+Förberäknade svar på vanliga frågor som appen slår upp innan den live-genererar.
+
+Ett offline-jobb genererar svar och stödjande chunk-id:n för en kuraterad frågelista
+(båda Evaluation-listorna plus data/faq_questions.txt) och sparar:
+    data/faq_store.json   <- poster + indexversionen de byggdes mot
+    data/faq_store.npy    <- normaliserade frågeembeddings (float16) för närmaste granne
+
+Uppslag sker i två steg: exakt match på normaliserad fråga (ingen API-kostnad alls)
+och därefter närmaste granne på frågeembeddingen. Posterna används bara om deras
+indexversion matchar det aktiva indexet, och byggs om automatiskt när manualens
+chunks ändras (se generate_and_save_embeddings.py).
+
+    python faq_store.py build
+"""
+import argparse
+import json
+import os
+import re
+import time
+import unicodedata
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from generation_queue import GenerationRejected
+from predefined_qa import predefined_qa_en, predefined_qa_sv
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+DEFAULT_FAQ_PATH = os.path.join(DATA_DIR, "faq_store.json")
+DEFAULT_QUESTIONS_PATH = os.path.join(DATA_DIR, "faq_questions.txt")
+LANGUAGES = ("English", "Swedish")
+
+
+def normalize_question(question: str) -> str:
+    """Gemener, utan skiljetecken och med enkla mellanslag: "How do I  freeze a track?" -> "how do i freeze a track"."""
+    text = unicodedata.normalize("NFKC", question).lower()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def curated_questions(questions_path: str = DEFAULT_QUESTIONS_PATH) -> List[Tuple[str, str]]:
+    """
+    Frågelistan som (fråga, svarsspråk). Evaluation-frågorna besvaras på sitt eget språk;
+    frågor i faq_questions.txt (en per rad, # för kommentar) besvaras på båda språken.
+    """
+    questions = [(qa["question"], "English") for qa in predefined_qa_en]
+    questions += [(qa["question"], "Swedish") for qa in predefined_qa_sv]
+    if os.path.exists(questions_path):
+        with open(questions_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    questions += [(line, language) for language in LANGUAGES]
+    return questions
+
+
+class FaqStore:
+    def __init__(self, index_version: str, entries: List[Dict], embeddings: Optional[np.ndarray] = None):
+        self.index_version = index_version
+        self.entries = entries
+        self.embeddings = embeddings  # (n, dim), normaliserade; rad i hör till entries[i]
+        self._exact = {(e["normalized"], e["language"]): e for e in entries}
+
+    def lookup_exact(self, question: str, answer_language: str) -> Optional[Dict]:
+        return self._exact.get((normalize_question(question), answer_language))
+
+    def lookup_similar(self, query_embedding, answer_language: str, threshold: float = 0.92) -> Optional[Dict]:
+        """Närmaste kuraterade fråga på samma språk, om den är tillräckligt lik."""
+        if self.embeddings is None or not len(self.entries):
+            return None
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return None
+        scores = self.embeddings.astype(np.float32) @ (query / norm)
+        for i in np.argsort(-scores):
+            if scores[i] < threshold:
+                return None
+            if self.entries[i]["language"] == answer_language:
+                return self.entries[i]
+        return None
+
+    def save(self, path: str = DEFAULT_FAQ_PATH):
+        payload = {"index_version": self.index_version, "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                   "entries": self.entries}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=1)
+        if self.embeddings is not None:
+            np.save(os.path.splitext(path)[0] + ".npy", self.embeddings.astype(np.float16))
+        print(f"FAQ-store med {len(self.entries)} svar sparad till '{path}' (index {self.index_version}).")
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_FAQ_PATH, index_version: Optional[str] = None) -> Optional["FaqStore"]:
+        """Laddar storen, eller returnerar None om den saknas eller byggdes mot ett annat index."""
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        if index_version is not None and payload["index_version"] != index_version:
+            print(f"FAQ-store byggd mot index {payload['index_version']}, aktivt är {index_version}; ignoreras.")
+            return None
+        embeddings_path = os.path.splitext(path)[0] + ".npy"
+        embeddings = np.load(embeddings_path) if os.path.exists(embeddings_path) else None
+        return cls(payload["index_version"], payload["entries"], embeddings)
+
+
+def build_faq_store(questions: List[Tuple[str, str]], store, index_version: str,
+                    embed_fn: Callable, generate_fn: Callable, k: int = 15) -> FaqStore:
+    """Genererar svar och stödjande chunks för varje (fråga, språk) med samma pipeline som appen."""
+    entries = []
+    vectors = []
+    embedding_cache: Dict[str, List[float]] = {}
+    for i, (question, language) in enumerate(questions, start=1):
+        if question not in embedding_cache:
+            embedding_cache[question] = embed_fn([question])[0]
+        query_emb = embedding_cache[question]
+        hits = store.search(query_emb, k)
+        texts = [store.texts[idx] for idx, _ in hits]
+        try:
+            answer = generate_fn(question, texts, answer_language=language)
+        except GenerationRejected as e:
+            print(f"FAQ {i}/{len(questions)} hoppas över ({e.reason}): {question[:60]}")
+            continue
+        entries.append({
+            "question": question,
+            "normalized": normalize_question(question),
+            "language": language,
+            "answer": answer,
+            "chunk_rows": [idx for idx, _ in hits],
+            "chunk_ids": [store.metadata[idx].get("chunk_id") for idx, _ in hits],
+        })
+        vector = np.asarray(query_emb, dtype=np.float32)
+        vectors.append(vector / (np.linalg.norm(vector) or 1.0))
+        print(f"FAQ {i}/{len(questions)}: {question[:60]}")
+    embeddings = np.vstack(vectors) if vectors else None
+    return FaqStore(index_version, entries, embeddings)
+
+
+def ensure_faq_store(store, index_version: str, embed_fn: Callable, generate_fn: Callable,
+                     path: str = DEFAULT_FAQ_PATH, questions_path: str = DEFAULT_QUESTIONS_PATH) -> FaqStore:
+    """Returnerar en aktuell FAQ-store och bygger om den om indexversionen har ändrats."""
+    faq = FaqStore.load(path, index_version)
+    if faq is None:
+        faq = build_faq_store(curated_questions(questions_path), store, index_version, embed_fn, generate_fn)
+        faq.save(path)
+    return faq
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bygg FAQ-storen mot aktivt index.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build")
+    build.add_argument("--force", action="store_true", help="Bygg om även om storen är aktuell")
+    args = parser.parse_args()
+
+    # Gemini-klienten behövs bara när storen byggs, inte när appen läser den.
+    from dotenv import load_dotenv
+    from index_snapshots import IndexManager
+    from llm_utils import generate_response
+    from rag_utils import create_embeddings
+
+    load_dotenv()
+    manager = IndexManager(legacy_path=os.path.join(DATA_DIR, "full_embeddings.parquet"))
+    if not manager.load_initial():
+        print("Inget index hittades. Kör generate_and_save_embeddings.py först.")
+        return
+    index_version, store = manager.snapshot()
+    if args.force and os.path.exists(DEFAULT_FAQ_PATH):
+        os.remove(DEFAULT_FAQ_PATH)
+    ensure_faq_store(store, index_version, create_embeddings, generate_response)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,22 +2,56 @@
 from dotenv import load_dotenv
 from vector_store import VectorStore
 from rag_utils import create_embeddings, load_chunks
+from index_snapshots import EMBEDDINGS_FILE, publish_snapshot
+from related_sections import RELATED_FILE, RelatedSections
+from hierarchical_search import HIERARCHY_FILE, HierarchicalIndex
+from text_store import TEXTS_FILE, write_for_store
+from faq_store import ensure_faq_store
+from llm_utils import generate_response
+from page_cache import DEFAULT_CHANGES_PATH
+from ingest_profile import add_profile_arguments, ingest_profiler
+import argparse
+import json
 import os
 import time
 
 load_dotenv() # Ladda API-nycklar
 
-def main():
+def load_reusable_embeddings(parquet_path: str, changes_path: str = DEFAULT_CHANGES_PATH):
+    """
+    Embeddings från förra körningen, nycklade på (chunk_id, text). Sektioner som
+    sidcachen rapporterat som ändrade tas bort så att de alltid embeddas om.
+    """
+    previous = VectorStore()
+    if not previous.load(parquet_path):
+        return {}
+    changed = set()
+    if os.path.exists(changes_path):
+        with open(changes_path, "r", encoding="utf-8") as f:
+            changed = set(json.load(f).get("changed_sections", []))
+    reusable = {}
+    for text, emb, meta in zip(previous.texts, previous.vectors, previous.metadata):
+        chunk_id = meta.get("chunk_id")
+        if chunk_id not in changed:
+            reusable[(chunk_id, text)] = emb
+    return reusable
+
+def build_and_publish(incremental: bool):
     jsonl_path = os.path.join("data", "full_manual_chunks.jsonl")
     output_parquet_path = os.path.join("data", "full_embeddings.parquet")
 
-    if os.path.exists(output_parquet_path):
+    reusable = {}
+    if incremental:
+        with ingest_profiler.stage("load_previous"):
+            reusable = load_reusable_embeddings(output_parquet_path)
+    elif os.path.exists(output_parquet_path):
         print(f"Embeddingsfilen '{output_parquet_path}' finns redan. Hoppar över generering.")
         print("Om du vill generera om, radera filen först.")
         return
 
-    chunks = load_chunks(jsonl_path)
-    chunks = [c for c in chunks if c.get("content", "").strip()]
+    with ingest_profiler.stage("load_chunks"):
+        chunks = load_chunks(jsonl_path)
+        chunks = [c for c in chunks if c.get("content", "").strip()]
 
     if not chunks:
         print("Inga chunks hittades. Se till att 'full_manual_chunks.jsonl' är korrekt.")
@@ -25,26 +59,33 @@ def main():
 
     texts = [c["content"] for c in chunks]
 
-    print(f"Genererar embeddings för {len(texts)} chunks. Detta kan ta lång tid och kosta pengar...")
+    all_embeddings = [reusable.get((c.get("chunk_id"), text)) for c, text in zip(chunks, texts)]
+    missing = [i for i, emb in enumerate(all_embeddings) if emb is None]
+    if reusable:
+        print(f"Återanvänder {len(texts) - len(missing)} embeddings; {len(missing)} chunks är nya eller ändrade.")
+
+    print(f"Genererar embeddings för {len(missing)} chunks. Detta kan ta lång tid och kosta pengar...")
     start_time = time.time()
 
     # Generera embeddings i batchar för att undvika överbelastning av API:et och för bättre hantering
     batch_size = 100 # Justera detta baserat på API-limiteringar och minne
-    all_embeddings = []
-    for i in range(0, len(texts), batch_size):
-        batch_texts = texts[i:i + batch_size]
-        batch_embeddings = create_embeddings(batch_texts)
-        all_embeddings.extend(batch_embeddings)
-        print(f"Genererat embeddings för {min(i + batch_size, len(texts))}/{len(texts)} chunks. Tid: {time.time() - start_time:.2f} sekunder.")
+    for i in range(0, len(missing), batch_size):
+        batch_rows = missing[i:i + batch_size]
+        with ingest_profiler.unit("embed", f"batch {i // batch_size + 1} ({len(batch_rows)} chunks)"):
+            batch_embeddings = create_embeddings([texts[row] for row in batch_rows])
+            for row, emb in zip(batch_rows, batch_embeddings):
+                all_embeddings[row] = emb
+        print(f"Genererat embeddings för {min(i + batch_size, len(missing))}/{len(missing)} chunks. Tid: {time.time() - start_time:.2f} sekunder.")
         time.sleep(1) # Paus för att respektera API-rate limits
 
-    if len(all_embeddings) != len(texts):
+    if any(emb is None or len(emb) == 0 for emb in all_embeddings):
         print("Varning: Antalet genererade embeddings matchar inte antalet texter.")
         # Hantera felaktiga embeddings här om de tillåts (t.ex. tomma listor)
         # Filter out empty embeddings if create_embeddings returns them on error
-        filtered_embeddings = [emb for emb in all_embeddings if emb]
-        filtered_texts = [texts[i] for i, emb in enumerate(all_embeddings) if emb]
-        filtered_chunks = [chunks[i] for i, emb in enumerate(all_embeddings) if emb]
+        valid = [i for i, emb in enumerate(all_embeddings) if emb is not None and len(emb) > 0]
+        filtered_embeddings = [all_embeddings[i] for i in valid]
+        filtered_texts = [texts[i] for i in valid]
+        filtered_chunks = [chunks[i] for i in valid]
 
         if len(filtered_embeddings) != len(texts):
             print(f"Fortsätter med {len(filtered_embeddings)} giltiga embeddings.")
@@ -53,12 +94,48 @@ def main():
             chunks = filtered_chunks
 
 
-    store = VectorStore()
-    for text, emb, meta in zip(texts, all_embeddings, chunks):
-        store.add_item(text, emb, meta)
+    with ingest_profiler.stage("save"):
+        store = VectorStore()
+        for text, emb, meta in zip(texts, all_embeddings, chunks):
+            store.add_item(text, emb, meta)
 
-    store.save(output_parquet_path) # Din save-metod behöver nog en sökväg som parameter
+        store.save(output_parquet_path) # Din save-metod behöver nog en sökväg som parameter
     print(f"Embeddings sparade till '{output_parquet_path}'. Total tid: {time.time() - start_time:.2f} sekunder.")
 
+    # Grannar per chunk för "relaterade avsnitt" i appen, så de inte behöver sökas per fråga.
+    related_path = os.path.join("data", RELATED_FILE)
+    with ingest_profiler.stage("related"):
+        RelatedSections.build(store).save(related_path)
+    # Kapitel- och avsnittscentroider, så att sökningen bara skannar de bästa kapitlen.
+    hierarchy_path = os.path.join("data", HIERARCHY_FILE)
+    with ingest_profiler.stage("hierarchy"):
+        HierarchicalIndex.build(store).save(hierarchy_path)
+    # Texterna komprimerade med zstd, så att appen bara dekomprimerar träffarnas texter.
+    texts_path = os.path.join("data", TEXTS_FILE)
+    with ingest_profiler.stage("texts"):
+        write_for_store(store, texts_path)
+
+    # Publicera som ny snapshot-version så att en körande app byter index utan omstart.
+    with ingest_profiler.stage("publish"):
+        version = publish_snapshot(
+            {EMBEDDINGS_FILE: output_parquet_path, RELATED_FILE: related_path, TEXTS_FILE: texts_path,
+             HIERARCHY_FILE: hierarchy_path},
+            metadata={"embedding_model": "models/embedding-001", "n_items": len(texts)},
+        )
+    print(f"Publicerade indexversion {version}.")
+
+    # FAQ-svaren är knutna till indexversionen och genereras om mot det nya indexet.
+    with ingest_profiler.stage("faq"):
+        ensure_faq_store(store, version, create_embeddings, generate_response)
+
+def main():
+    parser = argparse.ArgumentParser(description="Generera embeddings för manualens chunks.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Återanvänd embeddings för oförändrade chunks och embedda bara resten")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    with ingest_profiler.session("embeddings", args):
+        build_and_publish(args.incremental)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
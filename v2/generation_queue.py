@@ -0,0 +1,167 @@
+# generation_queue.py
+"""
+Begränsad, prioriterad kö framför generate_response.
+
+Alla Streamlit-sessioner i processen delar samma kö. Högst `max_concurrency` anrop
+körs samtidigt (sätt den efter Gemini-kvoten) och övriga väntar i prioritetsordning:
+Chatbot-frågor (INTERACTIVE) före Evaluation-sidan (EVALUATION) före batchjobb (BATCH).
+När kön är full avvisas nya anrop direkt, eller så trängs en väntande batch-/
+Evaluation-fråga undan av en interaktiv. Anrop som väntat längre än `max_wait`
+avbryts. Avvisade anrop ger GenerationRejected, och anroparen svarar då med de
+mest relevanta chunks i stället (se prompts.build_retrieval_only_answer).
+
+Konfigureras med GENERATION_CONCURRENCY, GENERATION_QUEUE_SIZE och GENERATION_MAX_WAIT.
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+INTERACTIVE = 0
+EVALUATION = 1
+BATCH = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", EVALUATION: "evaluation", BATCH: "batch"}
+
+
+class GenerationRejected(Exception):
+    """
+    Inget genererat svar. Från kön: reason "full", "evicted" eller "timeout" (släpptes
+    aldrig fram). Från llm_utils: "timeout" (hård tidsgräns) eller "error" (alla försök misslyckades).
+    """
+
+    def __init__(self, reason: str):
+        super().__init__(f"Generation rejected ({reason})")
+        self.reason = reason
+
+
+class _Ticket:
+    __slots__ = ("priority", "state", "reason")
+
+    def __init__(self, priority: int):
+        self.priority = priority
+        self.state = "waiting"  # waiting -> admitted | rejected
+        self.reason = None
+
+
+class GenerationQueue:
+    def __init__(self, max_concurrency: int = 4, max_waiting: int = 16, max_wait: float = 15.0):
+        self.max_concurrency = max_concurrency
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._waiting = []  # heap av (prioritet, löpnummer, ticket)
+        self._seq = itertools.count()
+        self._active = 0
+        self._wait_ms = deque(maxlen=1000)  # Väntetid för släppta anrop, senaste först ut
+        self.stats = {
+            "admitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected_full": 0,
+            "rejected_evicted": 0,
+            "rejected_timeout": 0,
+            "max_depth": 0,
+        }
+        self.admitted_by_priority = {name: 0 for name in PRIORITY_NAMES.values()}
+
+    def _reject(self, ticket: _Ticket, reason: str):
+        ticket.state = "rejected"
+        ticket.reason = reason
+        self.stats[f"rejected_{reason}"] += 1
+
+    def _acquire(self, priority: int, max_wait: float):
+        start = time.monotonic()
+        ticket = _Ticket(priority)
+        with self._cond:
+            if self._active < self.max_concurrency and not self._waiting:
+                ticket.state = "admitted"
+            else:
+                if len(self._waiting) >= self.max_waiting:
+                    worst = max(self._waiting)
+                    if worst[0] <= priority:
+                        self._reject(ticket, "full")
+                        raise GenerationRejected("full")
+                    # En interaktiv fråga tränger undan den lägst prioriterade väntande.
+                    self._waiting.remove(worst)
+                    heapq.heapify(self._waiting)
+                    self._reject(worst[2], "evicted")
+                    self._cond.notify_all()
+                heapq.heappush(self._waiting, (priority, next(self._seq), ticket))
+                self.stats["max_depth"] = max(self.stats["max_depth"], len(self._waiting))
+
+                deadline = start + max_wait
+                while ticket.state == "waiting":
+                    if self._active < self.max_concurrency and self._waiting[0][2] is ticket:
+                        heapq.heappop(self._waiting)
+                        ticket.state = "admitted"
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._waiting = [entry for entry in self._waiting if entry[2] is not ticket]
+                        heapq.heapify(self._waiting)
+                        self._reject(ticket, "timeout")
+                        self._cond.notify_all()
+                        break
+                    self._cond.wait(remaining)
+
+                if ticket.state == "rejected":
+                    raise GenerationRejected(ticket.reason)
+
+            self._active += 1
+            self.stats["admitted"] += 1
+            self.admitted_by_priority[PRIORITY_NAMES.get(priority, str(priority))] += 1
+            self._wait_ms.append((time.monotonic() - start) * 1000)
+
+    def _release(self, ok: bool):
+        with self._cond:
+            self._active -= 1
+            self.stats["completed" if ok else "failed"] += 1
+            self._cond.notify_all()
+
+    def run(self, fn: Callable, *args, priority: int = INTERACTIVE, max_wait: Optional[float] = None, **kwargs):
+        """Kör fn(*args, **kwargs) i anroparens tråd när en plats är ledig."""
+        self._acquire(priority, self.max_wait if max_wait is None else max_wait)
+        ok = False
+        try:
+            result = fn(*args, **kwargs)
+            ok = True
+            return result
+        finally:
+            self._release(ok)
+
+    def wrap(self, fn: Callable, priority: int = INTERACTIVE) -> Callable:
+        """fn med samma signatur, men köad med given prioritet."""
+        def queued(*args, **kwargs):
+            return self.run(fn, *args, priority=priority, **kwargs)
+        return queued
+
+    @property
+    def depth(self) -> int:
+        return len(self._waiting)
+
+    def report(self) -> Dict:
+        waits = sorted(self._wait_ms)
+
+        def percentile(p):
+            return waits[min(int(p * len(waits)), len(waits) - 1)] if waits else 0.0
+
+        return {
+            **self.stats,
+            "active": self._active,
+            "depth": self.depth,
+            "max_concurrency": self.max_concurrency,
+            "wait_p50_ms": percentile(0.50),
+            "wait_p95_ms": percentile(0.95),
+            "wait_max_ms": waits[-1] if waits else 0.0,
+            "admitted_by_priority": dict(self.admitted_by_priority),
+        }
+
+
+generation_queue = GenerationQueue(
+    max_concurrency=int(os.environ.get("GENERATION_CONCURRENCY", "4")),
+    max_waiting=int(os.environ.get("GENERATION_QUEUE_SIZE", "16")),
+    max_wait=float(os.environ.get("GENERATION_MAX_WAIT", "15")),
+)
@@ -0,0 +1,342 @@
+# hierarchical_search.py
+"""
+Grov-till-fin-sökning via kapitel- och avsnittscentroider.
+
+Manualen är hierarkisk (kapitel -> avsnitt -> chunks), men VectorStore.search
+jämför frågan mot varje chunk. Här byggs vid indexeringen en centroid (normaliserat
+medel av chunkvektorerna) per kapitel och per avsnitt. Storens rader flyttas inte:
+`order` är en permutation av radindexen, sorterad så att varje kapitel och avsnitt är
+ett sammanhängande intervall i den, och kandidaterna hämtas med en gather
+(matrix[rows]) ur storens matris. En sökning:
+1. jämför frågan med kapitelcentroiderna (några dussin),
+2. väljer kapitlen inom HIERARCHY_MARGIN från det bästa (högst HIERARCHY_MAX_CHAPTERS),
+3. om de kapitlen har fler än HIERARCHY_MAX_ROWS chunks: väljer avsnitt inom dem på samma sätt,
+4. skannar bara chunkraderna i de valda kapitlen/avsnitten.
+Sökkostnaden växer då med storleken på de bästa kapitlen i stället för hela korpusen.
+
+Låg säkerhet ger full skanning: bästa kapitlet under HIERARCHY_MIN_SIMILARITY, fler
+kapitel än taket inom marginalen (frågan är spridd över manualen) eller färre
+kandidater än k.
+
+Kapitel är första delen av chunk_id. Avsnitt är chunk_id:s två första delar
+("10.2.1" -> "10.2") när sådana finns; i full_manual_chunks.jsonl, där chunk_id bara
+är kapitlet, börjar ett avsnitt vid varje numrerad rubrik på toppnivå ("9 Compressor").
+
+    python hierarchical_search.py publish
+    python hierarchical_search.py report --queries 500
+"""
+import argparse
+import os
+import re
+import shutil
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+HIERARCHY_FILE = "hierarchy.npz"
+TOP_LEVEL_NUMBER = re.compile(r"^\d+\s+\S")
+MAX_TITLE_CHARS = 100  # Rubriker som egentligen är brödtext kortas i rapporterna
+
+DEFAULT_MARGIN = float(os.environ.get("HIERARCHY_MARGIN", "0.05"))
+DEFAULT_MAX_CHAPTERS = int(os.environ.get("HIERARCHY_MAX_CHAPTERS", "4"))
+DEFAULT_MAX_ROWS = int(os.environ.get("HIERARCHY_MAX_ROWS", "4096"))
+DEFAULT_MIN_SIMILARITY = float(os.environ.get("HIERARCHY_MIN_SIMILARITY", "0.3"))
+HIERARCHICAL_SEARCH = os.environ.get("HIERARCHICAL_SEARCH", "1") != "0"
+
+
+def group_rows(chunk_ids: List[Optional[str]], titles: List[Optional[str]]) -> Tuple[np.ndarray, np.ndarray, List[str], List[str], np.ndarray]:
+    """
+    Kapitel och avsnitt per chunkrad, numrerade i den ordning de först förekommer.
+    Returnerar (kapitel per rad, avsnitt per rad, kapitelrubriker, avsnittsrubriker, kapitel per avsnitt).
+    """
+    chapter_ids: Dict[str, int] = {}
+    section_ids: Dict[Tuple[str, str], int] = {}
+    chapter_titles, section_titles, section_chapter = [], [], []
+    chapter_of = np.empty(len(chunk_ids), dtype=np.int32)
+    section_of = np.empty(len(chunk_ids), dtype=np.int32)
+    previous_chapter, section = None, None
+    for row, (chunk_id, title) in enumerate(zip(chunk_ids, titles)):
+        parts = str(chunk_id or "").split(".")
+        chapter, title = parts[0], (title or "").strip()[:MAX_TITLE_CHARS]
+        if len(parts) > 1:
+            section = ".".join(parts[:2])
+        elif chapter != previous_chapter or TOP_LEVEL_NUMBER.match(title):
+            # Innehållsförteckningen och texten ger samma rubrik två gånger; de blir samma avsnitt.
+            section = title
+        previous_chapter = chapter
+        if chapter not in chapter_ids:
+            chapter_ids[chapter] = len(chapter_titles)
+            chapter_titles.append(title)
+        key = (chapter, section)
+        if key not in section_ids:
+            section_ids[key] = len(section_titles)
+            section_titles.append(title)
+            section_chapter.append(chapter_ids[chapter])
+        chapter_of[row] = chapter_ids[chapter]
+        section_of[row] = section_ids[key]
+    return chapter_of, section_of, chapter_titles, section_titles, np.asarray(section_chapter, dtype=np.int32)
+
+
+def _centroids(matrix: np.ndarray, order: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Normaliserat medel av raderna order[start:end] per grupp; raderna i matrix ska vara enhetsvektorer."""
+    sums = np.add.reduceat(matrix[order], starts, axis=0) if len(starts) else np.zeros((0, matrix.shape[1]))
+    sums[ends == starts] = 0.0
+    norms = np.linalg.norm(sums, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (sums / norms).astype(np.float32)
+
+
+class HierarchicalIndex:
+    def __init__(self, chapter_of: np.ndarray, section_of: np.ndarray, section_chapter: np.ndarray,
+                 chapter_titles: List[str], section_titles: List[str], chapter_centroids: Optional[np.ndarray] = None,
+                 section_centroids: Optional[np.ndarray] = None, margin: float = DEFAULT_MARGIN,
+                 max_chapters: int = DEFAULT_MAX_CHAPTERS, max_rows: int = DEFAULT_MAX_ROWS,
+                 min_similarity: float = DEFAULT_MIN_SIMILARITY):
+        self.chapter_of = chapter_of
+        self.section_of = section_of
+        self.section_chapter = section_chapter
+        self.chapter_titles = list(chapter_titles)
+        self.section_titles = list(section_titles)
+        self.margin = margin
+        self.max_chapters = max_chapters
+        self.max_rows = max_rows
+        self.min_similarity = min_similarity
+        # Radindexen sorterade på (kapitel, avsnitt), så båda nivåerna är intervall i order
+        # (storens rader ligger kvar i sin ordning).
+        self.order = np.lexsort((np.arange(len(chapter_of)), section_of, chapter_of)).astype(np.int32)
+        sorted_chapters = chapter_of[self.order]
+        chapters = np.arange(len(self.chapter_titles))
+        self.chapter_starts = np.searchsorted(sorted_chapters, chapters, side="left")
+        self.chapter_ends = np.searchsorted(sorted_chapters, chapters, side="right")
+        sorted_sections = section_of[self.order]
+        boundaries = np.flatnonzero(np.diff(sorted_sections)) + 1
+        run_starts = np.concatenate([[0], boundaries]) if len(sorted_sections) else np.zeros(0, dtype=np.int64)
+        run_ends = np.concatenate([boundaries, [len(sorted_sections)]]) if len(sorted_sections) else run_starts
+        self.section_starts = np.zeros(len(self.section_titles), dtype=np.int64)
+        self.section_ends = np.zeros(len(self.section_titles), dtype=np.int64)
+        self.section_starts[sorted_sections[run_starts]] = run_starts
+        self.section_ends[sorted_sections[run_starts]] = run_ends
+        self.chapter_centroids = chapter_centroids
+        self.section_centroids = section_centroids
+        self._lock = threading.Lock()
+        self.stats = {"searches": 0, "hierarchical": 0, "section_stage": 0, "fallback": 0, "rows_scanned": 0,
+                      "rows_total": 0}
+
+    def __len__(self):
+        return len(self.chapter_of)
+
+    @classmethod
+    def from_store(cls, store, **kwargs) -> "HierarchicalIndex":
+        metadata = store.metadata
+        chunk_ids = [metadata.sections.ids[row] for row in metadata.rows]
+        titles = [metadata.sections.titles[row] for row in metadata.rows]
+        chapter_of, section_of, chapter_titles, section_titles, section_chapter = group_rows(chunk_ids, titles)
+        index = cls(chapter_of, section_of, section_chapter, chapter_titles, section_titles, **kwargs)
+        index.fit(store._normalized_matrix())
+        return index
+
+    def fit(self, matrix: np.ndarray):
+        """Beräknar centroiderna ur storens normaliserade (ev. projicerade) matris."""
+        self.chapter_centroids = _centroids(matrix, self.order, self.chapter_starts, self.chapter_ends)
+        section_rank = np.argsort(self.section_starts, kind="stable")
+        centroids = _centroids(matrix, self.order, self.section_starts[section_rank], self.section_ends[section_rank])
+        self.section_centroids = np.empty_like(centroids)
+        self.section_centroids[section_rank] = centroids
+
+    def fits(self, store) -> bool:
+        """Sant om indexet hör till storen: samma antal chunks och centroider i samma rum."""
+        return len(self) == len(store) and len(store) > 0 and self.chapter_centroids.shape[1] == len(store.vectors[0])
+
+    def _rows(self, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        """Storens radindex för intervallen i order; raderna ligger inte nödvändigtvis intill varandra."""
+        return np.concatenate([self.order[s:e] for s, e in zip(starts, ends)])
+
+    def _select(self, scores: np.ndarray) -> Optional[np.ndarray]:
+        """Grupperna inom marginalen från den bästa, bäst först; None om de är fler än taket."""
+        chosen = np.flatnonzero(scores >= scores.max() - self.margin)
+        if len(chosen) > self.max_chapters:
+            return None
+        return chosen[np.argsort(-scores[chosen], kind="stable")]
+
+    def candidates(self, query_unit: np.ndarray, k: int) -> Optional[np.ndarray]:
+        """
+        Chunkrader att skanna för en normaliserad fråga, eller None för full skanning
+        (låg säkerhet). Raderna är storens radindex.
+        """
+        chapter_scores = self.chapter_centroids @ query_unit
+        chapters = self._select(chapter_scores) if chapter_scores.max() >= self.min_similarity else None
+        rows = None
+        section_stage = False
+        if chapters is not None:
+            starts, ends = self.chapter_starts[chapters], self.chapter_ends[chapters]
+            if (ends - starts).sum() > self.max_rows:
+                # Stora kapitel: välj avsnitt inom dem med samma regel, tills radtaket nås.
+                sections = np.flatnonzero(np.isin(self.section_chapter, chapters))
+                section_scores = self.section_centroids[sections] @ query_unit
+                ranking = np.argsort(-section_scores, kind="stable")
+                ranked, ranked_scores = sections[ranking], section_scores[ranking]
+                keep = ranked[ranked_scores >= ranked_scores[0] - self.margin]
+                sizes = np.cumsum(self.section_ends[keep] - self.section_starts[keep])
+                keep = keep[: max(1, int(np.searchsorted(sizes, self.max_rows, side="right")))]
+                starts, ends = self.section_starts[keep], self.section_ends[keep]
+                section_stage = True
+            rows = self._rows(starts, ends)
+            if len(rows) < k:
+                rows = None
+        with self._lock:
+            self.stats["searches"] += 1
+            self.stats["rows_total"] += len(self)
+            if rows is None:
+                self.stats["fallback"] += 1
+                self.stats["rows_scanned"] += len(self)
+            else:
+                self.stats["hierarchical"] += 1
+                self.stats["section_stage"] += int(section_stage)
+                self.stats["rows_scanned"] += len(rows)
+        return rows
+
+    def report(self) -> Dict:
+        stats = dict(self.stats)
+        stats["chapters"] = len(self.chapter_titles)
+        stats["sections"] = len(self.section_titles)
+        stats["scanned_fraction"] = round(stats["rows_scanned"] / stats["rows_total"], 3) if stats["rows_total"] else None
+        return stats
+
+    def save(self, path: str):
+        np.savez(path, chapter_of=self.chapter_of, section_of=self.section_of, section_chapter=self.section_chapter,
+                 chapter_titles=np.asarray(self.chapter_titles, dtype=str),
+                 section_titles=np.asarray(self.section_titles, dtype=str),
+                 chapter_centroids=self.chapter_centroids, section_centroids=self.section_centroids)
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "HierarchicalIndex":
+        data = np.load(path)
+        return cls(data["chapter_of"], data["section_of"], data["section_chapter"], data["chapter_titles"].tolist(),
+                   data["section_titles"].tolist(), data["chapter_centroids"], data["section_centroids"], **kwargs)
+
+    @classmethod
+    def build(cls, store, **kwargs) -> "HierarchicalIndex":
+        return cls.from_store(store, **kwargs)
+
+
+def attach(store, path: str) -> bool:
+    """
+    Kopplar hierarkin i path till storen. Centroiderna räknas om om storen projicerats
+    efter att filen skrevs; en fil för ett annat index ignoreras.
+    """
+    if not HIERARCHICAL_SEARCH or not os.path.exists(path):
+        return False
+    index = HierarchicalIndex.load(path)
+    if len(index) != len(store):
+        return False
+    if not index.fits(store):
+        index.fit(store._normalized_matrix())
+    store.hierarchy = index
+    return True
+
+
+def _pseudo_queries(store, n: int, noise: float, seed: int = 0) -> np.ndarray:
+    """Slumpade chunkvektorer med brus, som ersättning för riktiga frågor."""
+    rng = np.random.default_rng(seed)
+    matrix = store._normalized_matrix()
+    rows = rng.integers(0, len(matrix), size=n)
+    queries = matrix[rows] + noise * rng.standard_normal((n, matrix.shape[1])).astype(np.float32) / np.sqrt(matrix.shape[1])
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def evaluate(store, index: HierarchicalIndex, queries: np.ndarray, k: int = 10) -> Dict:
+    """recall@k mot full skanning, andel skannade rader och tid per fråga."""
+    matrix = store._normalized_matrix()
+    recalls, full_seconds, hier_seconds = [], 0.0, 0.0
+    for query in queries:
+        start = time.perf_counter()
+        exact = np.argpartition(-(matrix @ query), k - 1)[:k]
+        full_seconds += time.perf_counter() - start
+        start = time.perf_counter()
+        rows = index.candidates(query, k)
+        if rows is None:
+            found = np.argpartition(-(matrix @ query), k - 1)[:k]
+        else:
+            found = rows[np.argpartition(-(matrix[rows] @ query), k - 1)[:k]]
+        hier_seconds += time.perf_counter() - start
+        recalls.append(len(set(exact.tolist()) & set(found.tolist())) / k)
+    report = index.report()
+    return {
+        "queries": len(queries),
+        f"recall@{k}": round(float(np.mean(recalls)), 4),
+        "fallback_rate": round(report["fallback"] / max(report["searches"], 1), 3),
+        "scanned_fraction": report["scanned_fraction"],
+        "full_ms": round(full_seconds / len(queries) * 1000, 3),
+        "hierarchical_ms": round(hier_seconds / len(queries) * 1000, 3),
+    }
+
+
+def main():
+    from index_snapshots import (DEFAULT_INDEX_ROOT, EMBEDDINGS_FILE, MANIFEST_FILE, commit_snapshot,
+                                 read_current_version, read_manifest, stage_snapshot)
+    from vector_store import VectorStore
+
+    parser = argparse.ArgumentParser(description="Bygg och utvärdera kapitel-/avsnittscentroider för indexet.")
+    parser.add_argument("--root", default=DEFAULT_INDEX_ROOT)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("publish", help="Publicera aktivt snapshot på nytt med hierarkin")
+    report = sub.add_parser("report", help="recall@k och skannad andel mot full skanning")
+    report.add_argument("--queries", type=int, default=500)
+    report.add_argument("--noise", type=float, default=1.0, help="Brus i pseudofrågorna (0 = chunkvektorn själv)")
+    report.add_argument("--captures", nargs="*", help="Använd inspelade frågeembeddings (query_capture.py)")
+    report.add_argument("--k", type=int, default=10)
+    report.add_argument("--margin", type=float, default=DEFAULT_MARGIN)
+    report.add_argument("--max-chapters", type=int, default=DEFAULT_MAX_CHAPTERS)
+    report.add_argument("--max-rows", type=int, default=DEFAULT_MAX_ROWS)
+    report.add_argument("--min-similarity", type=float, default=DEFAULT_MIN_SIMILARITY)
+    args = parser.parse_args()
+
+    version = read_current_version(args.root)
+    if version is None:
+        raise SystemExit("Inget aktivt index; kör generate_and_save_embeddings.py först.")
+    version_dir = os.path.join(args.root, version)
+    store = VectorStore()
+    if not store.load(os.path.join(version_dir, EMBEDDINGS_FILE)):
+        raise SystemExit(f"Snapshot {version} saknar {EMBEDDINGS_FILE}")
+
+    if args.command == "report":
+        index = HierarchicalIndex.build(store, margin=args.margin, max_chapters=args.max_chapters,
+                                        max_rows=args.max_rows, min_similarity=args.min_similarity)
+        print(f"{len(index.chapter_titles)} kapitel, {len(index.section_titles)} avsnitt, {len(index)} chunks.")
+        if args.captures:
+            from query_capture import decode_embedding, load_capture
+
+            embeddings = [decode_embedding(r["embedding"]) for r in load_capture(args.captures) if "embedding" in r]
+            queries = np.asarray([store.project_query(e) for e in embeddings], dtype=np.float32)
+            queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        else:
+            queries = _pseudo_queries(store, args.queries, args.noise)
+        if not len(queries):
+            raise SystemExit("Inga frågor att utvärdera.")
+        for key, value in evaluate(store, index, queries, args.k).items():
+            print(f"  {key}: {value}")
+        return
+
+    start = time.perf_counter()
+    index = HierarchicalIndex.build(store)
+    print(f"{len(index.chapter_titles)} kapitel och {len(index.section_titles)} avsnitt på {time.perf_counter() - start:.2f} s.")
+    staging_dir = stage_snapshot(args.root)
+    try:
+        # Övriga filer (embeddings, ev. projektion och grannar) följer med oförändrade.
+        for name in os.listdir(version_dir):
+            if name not in (MANIFEST_FILE, HIERARCHY_FILE):
+                shutil.copy2(os.path.join(version_dir, name), os.path.join(staging_dir, name))
+        index.save(os.path.join(staging_dir, HIERARCHY_FILE))
+        manifest = read_manifest(args.root, version)
+        metadata = {key: value for key, value in manifest.items() if key not in ("version", "created_at", "files")}
+        new_version = commit_snapshot(staging_dir, {**metadata, "hierarchy": True})
+    except Exception:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+    print(f"Publicerade version {new_version} med kapitel- och avsnittscentroider.")
+
+
+if __name__ == "__main__":
+    main()
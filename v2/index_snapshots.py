@@ -0,0 +1,324 @@
+# index_snapshots.py
+"""
+Versionerade snapshots av vektorindexet, så att appen kan byta index utan omstart.
+
+Layout:
+    data/index/
+        CURRENT                      <- namnet på aktiv version (skrivs atomiskt)
+        20250528T101500-1a2b3c4d/
+            manifest.json
+            embeddings.parquet
+            projection.npz           <- valfri, se projection.py
+            related.npz              <- valfri, se related_sections.py
+            hierarchy.npz            <- valfri, se hierarchical_search.py
+            texts.zst                <- valfri, se text_store.py
+
+Ett nytt snapshot skrivs först till en temporär katalog och byter sedan namn
+(atomiskt på samma filsystem) innan CURRENT pekas om.
+
+    python index_snapshots.py publish data/full_embeddings.parquet
+    python index_snapshots.py list
+    python index_snapshots.py gc --keep 2
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from hierarchical_search import HIERARCHY_FILE, attach as attach_hierarchy
+from projection import PROJECTION_FILE, Projection
+from related_sections import RELATED_FILE, RelatedSections
+from text_store import TEXTS_FILE, mapped_paths
+from vector_store import VectorStore
+
+DEFAULT_INDEX_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "index")
+EMBEDDINGS_FILE = "embeddings.parquet"
+MANIFEST_FILE = "manifest.json"
+CURRENT_FILE = "CURRENT"
+TMP_PREFIX = ".tmp-"
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _write_atomic(path: str, content: str):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def legacy_version(parquet_path: str) -> str:
+    """Version för en ensam parquet-fil utan snapshot, härledd ur innehållet."""
+    return f"legacy-{_sha256(parquet_path)[:8]}"
+
+
+def stage_snapshot(root: str = DEFAULT_INDEX_ROOT) -> str:
+    """Skapar en temporär katalog där snapshotets filer kan skrivas innan commit_snapshot."""
+    os.makedirs(root, exist_ok=True)
+    staging_dir = os.path.join(root, f"{TMP_PREFIX}{os.getpid()}-{time.time_ns()}")
+    os.makedirs(staging_dir)
+    return staging_dir
+
+
+def commit_snapshot(staging_dir: str, metadata: Optional[Dict] = None, make_current: bool = True) -> str:
+    """
+    Skriver manifest för alla filer i staging_dir, flyttar katalogen till sin
+    slutliga versionskatalog och (valfritt) pekar om CURRENT. Returnerar versionen.
+    """
+    root = os.path.dirname(staging_dir)
+    files = {}
+    for name in sorted(os.listdir(staging_dir)):
+        path = os.path.join(staging_dir, name)
+        if os.path.isfile(path) and name != MANIFEST_FILE:
+            files[name] = {"sha256": _sha256(path), "size": os.path.getsize(path)}
+
+    content_hash = hashlib.sha256(json.dumps(files, sort_keys=True).encode("utf-8")).hexdigest()
+    version = f"{time.strftime('%Y%m%dT%H%M%S')}-{content_hash[:8]}"
+    manifest = {
+        "version": version,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "files": files,
+        **(metadata or {}),
+    }
+    _write_atomic(os.path.join(staging_dir, MANIFEST_FILE), json.dumps(manifest, indent=2, ensure_ascii=False))
+
+    final_dir = os.path.join(root, version)
+    if os.path.exists(final_dir):  # Samma innehåll publicerat samma sekund
+        shutil.rmtree(staging_dir)
+    else:
+        os.rename(staging_dir, final_dir)
+
+    if make_current:
+        _write_atomic(os.path.join(root, CURRENT_FILE), version)
+    return version
+
+
+def publish_snapshot(files: Dict[str, str], root: str = DEFAULT_INDEX_ROOT,
+                     metadata: Optional[Dict] = None) -> str:
+    """Kopierar filer ({namn i snapshot: källsökväg}) till ett nytt snapshot och aktiverar det."""
+    staging_dir = stage_snapshot(root)
+    try:
+        for name, source in files.items():
+            shutil.copy2(source, os.path.join(staging_dir, name))
+        return commit_snapshot(staging_dir, metadata)
+    except Exception:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+
+
+def read_current_version(root: str = DEFAULT_INDEX_ROOT) -> Optional[str]:
+    try:
+        with open(os.path.join(root, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def read_manifest(root: str, version: str) -> Dict:
+    with open(os.path.join(root, version, MANIFEST_FILE), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def list_snapshots(root: str = DEFAULT_INDEX_ROOT) -> List[str]:
+    """Alla färdiga versioner, äldst först (versionsnamnen sorteras kronologiskt)."""
+    if not os.path.isdir(root):
+        return []
+    return sorted(
+        name for name in os.listdir(root)
+        if not name.startswith(TMP_PREFIX) and os.path.isfile(os.path.join(root, name, MANIFEST_FILE))
+    )
+
+
+def load_snapshot(root: str, version: str) -> VectorStore:
+    store = VectorStore()
+    if not store.load(os.path.join(root, version, EMBEDDINGS_FILE), os.path.join(root, version, TEXTS_FILE)):
+        raise FileNotFoundError(f"Snapshot {version} saknar {EMBEDDINGS_FILE}")
+    projection_path = os.path.join(root, version, PROJECTION_FILE)
+    if os.path.exists(projection_path):
+        store.set_projection(Projection.load(projection_path))
+    related_path = os.path.join(root, version, RELATED_FILE)
+    if os.path.exists(related_path):
+        related = RelatedSections.load(related_path)
+        if len(related) == len(store):  # En graf för ett annat index ignoreras
+            store.related = related
+    attach_hierarchy(store, os.path.join(root, version, HIERARCHY_FILE))
+    return store
+
+
+def stale_snapshots(root: str = DEFAULT_INDEX_ROOT, keep: int = 2, protect: Tuple[str, ...] = ()) -> List[str]:
+    """Snapshots utöver de `keep` senaste, aktiv version och allt i `protect`."""
+    current = read_current_version(root)
+    versions = list_snapshots(root)
+    keep_set = set(versions[-keep:]) | {current} | set(protect)
+    return [version for version in versions if version not in keep_set]
+
+
+def _remove_snapshot(version_dir: str) -> bool:
+    """Tar bort katalogen med manifestet sist, så att en delvis borttagen snapshot fortfarande listas och tas vid nästa gc."""
+    try:
+        for name in os.listdir(version_dir):
+            if name != MANIFEST_FILE:
+                path = os.path.join(version_dir, name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+        shutil.rmtree(version_dir)
+    except OSError as e:
+        print(f"Kunde inte ta bort {version_dir} ännu: {e}")
+        return False
+    return True
+
+
+def gc_snapshots(root: str = DEFAULT_INDEX_ROOT, keep: int = 2, protect: Tuple[str, ...] = ()) -> List[str]:
+    """
+    Tar bort gamla snapshots. Behåller de `keep` senaste, aktiv version och allt i `protect`.
+    Vektorerna ligger i minnet, men texts.zst är mmappad: pågående frågor mot ett gammalt index
+    läser vidare ur den borttagna filen. På POSIX går det, eftersom mappningen lever tills den
+    stängs. På Windows kan en mappad fil inte tas bort, så där skjuts snapshots som någon vy i
+    processen fortfarande mappar upp till ett senare anrop (och filer som en annan process
+    mappar lämnas kvar med manifestet). Returnerar de versioner som togs bort.
+    """
+    mapped = mapped_paths() if os.name == "nt" else set()
+    removed = []
+    for version in stale_snapshots(root, keep, protect):
+        version_dir = os.path.join(root, version)
+        if os.path.abspath(os.path.join(version_dir, TEXTS_FILE)) in mapped:
+            continue
+        if _remove_snapshot(version_dir):
+            removed.append(version)
+    return removed
+
+
+class IndexManager:
+    """
+    Håller referensen till aktivt index och byter den atomiskt när en ny version publiceras.
+
+    Varje fråga hämtar `current()` en gång och använder den referensen hela vägen,
+    så pågående frågor avslutas mot det gamla indexet medan nya frågor ser det nya.
+    Med pinned_version laddas just den versionen och inga nya versioner bevakas.
+    """
+
+    def __init__(self, root: str = DEFAULT_INDEX_ROOT, legacy_path: Optional[str] = None,
+                 poll_interval: float = 30.0, keep: int = 2,
+                 loader: Callable[[str, str], VectorStore] = load_snapshot, pinned_version: Optional[str] = None):
+        self.root = root
+        self.legacy_path = legacy_path
+        self.pinned_version = pinned_version
+        self.poll_interval = poll_interval
+        self.keep = keep
+        self.loader = loader
+        self._lock = threading.Lock()
+        self._current: Tuple[Optional[str], Optional[VectorStore]] = (None, None)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.last_error: Optional[str] = None
+        self._gc_pending = False  # Gamla snapshots som inte gick att ta bort än (mappade på Windows)
+
+    @property
+    def version(self) -> Optional[str]:
+        return self._current[0]
+
+    def current(self) -> Optional[VectorStore]:
+        return self._current[1]
+
+    def snapshot(self) -> Tuple[Optional[str], Optional[VectorStore]]:
+        """(version, store) som ett par, så att de alltid hör ihop."""
+        return self._current
+
+    def load_initial(self) -> bool:
+        """Laddar aktiv version synkront, eller den gamla parquet-filen om inga snapshots finns."""
+        version = self.pinned_version or read_current_version(self.root)
+        if version is not None:
+            self._swap(version, self.loader(self.root, version))
+            return True
+        if self.legacy_path:
+            store = VectorStore()
+            if store.load(self.legacy_path):
+                self._swap(legacy_version(self.legacy_path), store)
+                return True
+        return False
+
+    def _swap(self, version: str, store: VectorStore):
+        with self._lock:
+            self._current = (version, store)
+        print(f"Aktivt index: {version}")
+
+    def check_for_update(self) -> bool:
+        """Laddar och aktiverar en ny version om CURRENT har ändrats. Returnerar True vid byte."""
+        version = read_current_version(self.root)
+        if self.pinned_version or version is None or version == self.version:
+            return False
+        try:
+            store = self.loader(self.root, version)
+        except Exception as e:
+            # Behåll det gamla indexet; nästa poll försöker igen.
+            self.last_error = f"Kunde inte ladda index {version}: {e}"
+            print(self.last_error)
+            return False
+        self._swap(version, store)
+        self.last_error = None
+        self.collect_garbage()
+        return True
+
+    def collect_garbage(self):
+        """Tar bort gamla snapshots; de som inte gick att ta bort försöker bevakaren igen vid nästa poll."""
+        gc_snapshots(self.root, keep=self.keep, protect=(self.version,))
+        self._gc_pending = bool(stale_snapshots(self.root, keep=self.keep, protect=(self.version,)))
+
+    def start_watcher(self):
+        if self._thread is not None or self.pinned_version:
+            return
+        self._thread = threading.Thread(target=self._watch, name="index-watcher", daemon=True)
+        self._thread.start()
+
+    def stop_watcher(self):
+        self._stop.set()
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            if not self.check_for_update() and self._gc_pending:
+                self.collect_garbage()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hantera versionerade snapshots av vektorindexet.")
+    parser.add_argument("--root", default=DEFAULT_INDEX_ROOT)
+    sub = parser.add_subparsers(dest="command", required=True)
+    publish = sub.add_parser("publish", help="Publicera en parquet-fil som ny aktiv version")
+    publish.add_argument("parquet_path")
+    sub.add_parser("list", help="Lista snapshots")
+    gc = sub.add_parser("gc", help="Ta bort gamla snapshots")
+    gc.add_argument("--keep", type=int, default=2)
+    args = parser.parse_args()
+
+    if args.command == "publish":
+        version = publish_snapshot({EMBEDDINGS_FILE: args.parquet_path}, root=args.root,
+                                   metadata={"embedding_model": "models/embedding-001"})
+        print(f"Publicerade version {version}")
+    elif args.command == "list":
+        current = read_current_version(args.root)
+        for version in list_snapshots(args.root):
+            print(f"{'*' if version == current else ' '} {version}")
+    elif args.command == "gc":
+        removed = gc_snapshots(args.root, keep=args.keep)
+        print(f"Tog bort {len(removed)} snapshots: {', '.join(removed) or '-'}")
+        remaining = stale_snapshots(args.root, keep=args.keep)
+        if remaining:
+            print(f"Kvar (används fortfarande): {', '.join(remaining)}")
+
+
+if __name__ == "__main__":
+    main()
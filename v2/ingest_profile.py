@@ -0,0 +1,342 @@
+# ingest_profile.py
+"""
+Profilering av indexeringen (extraktion, chunkning, embeddings).
+
+Ingångspunkterna (extract_selected_chapters.py, chunking.py, outline_chunking.py och
+generate_and_save_embeddings.py) tar --profile (och --profile-dir). Då mäts per steg och per
+enhet (sida eller batch):
+- väggtid och CPU-tid (process_time, alla trådar),
+- högsta Python-allokering under steget (tracemalloc) och nettoökningen efteråt.
+Små funktioner som anropas per rad (t.ex. clean_line) mäts i stället som summa och
+antal anrop. Med --profile-cprofile sparas även cProfile-statistik (.prof, öppnas med
+snakeviz eller pstats) och med --profile-stacks samplade stackar i collapsed-format
+(.collapsed, för flamegraph.pl eller speedscope).
+
+Rapporten skrivs som JSON och text till data/profiles/, även när körningen avbryts av
+ett fel (felet står då i rapporten). tracemalloc gör körningen långsammare; jämför
+därför bara profilerade körningar med varandra.
+
+    python generate_and_save_embeddings.py --incremental --profile
+    python ingest_profile.py show data/profiles/embeddings-20250601T101500.json
+    python ingest_profile.py compare data/profiles/a.json data/profiles/b.json
+"""
+import argparse
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+DEFAULT_PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "profiles")
+MAX_UNITS = 5000  # Per steg; fler enheter sammanfattas bara
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    """--profile-flaggorna, gemensamma för alla ingångspunkter."""
+    parser.add_argument("--profile", action="store_true", help="Mät tid, CPU och minne per steg och skriv en rapport")
+    parser.add_argument("--profile-dir", default=DEFAULT_PROFILE_DIR, help="Var rapporten sparas (standard: data/profiles)")
+    parser.add_argument("--profile-cprofile", action="store_true", help="Spara även cProfile-statistik")
+    parser.add_argument("--profile-stacks", action="store_true", help="Spara samplade stackar för flamegraphs")
+
+
+class _Measure:
+    __slots__ = ("name", "wall", "cpu", "peak", "net", "_wall0", "_cpu0", "_mem0")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.peak = 0
+
+    def as_dict(self) -> Dict:
+        return {"name": self.name, "wall_s": round(self.wall, 4), "cpu_s": round(self.cpu, 4),
+                "peak_mb": round(self.peak / 1e6, 2), "net_mb": round(self.net / 1e6, 2)}
+
+
+class StackSampler:
+    """Samplar huvudtrådens stack med jämna mellanrum och räknar identiska stackar."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.counts: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._target = threading.main_thread().ident
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def write(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class IngestProfiler:
+    """
+    Avstängd som standard: stage/unit blir då tomma kontexter och wrap returnerar
+    funktionen oförändrad, så instrumenteringen kostar inget i vanliga körningar.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.stages: List[Dict] = []
+        self.units: Dict[str, List[Dict]] = {}
+        self.calls: Dict[str, Dict] = {}
+        self._stack: List[_Measure] = []
+        self._lock = threading.Lock()
+        self._cprofile: Optional[cProfile.Profile] = None
+        self._sampler: Optional[StackSampler] = None
+        self._started = None
+        self.name = None
+        self.output_dir = None
+
+    def start(self, name: str, output_dir: str = DEFAULT_PROFILE_DIR, cprofile: bool = False, stacks: bool = False):
+        self.reset()
+        self.enabled = True
+        self.name = name
+        self.output_dir = output_dir
+        self._started = (time.strftime("%Y%m%dT%H%M%S"), time.perf_counter(), time.process_time())
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if cprofile:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        if stacks:
+            self._sampler = StackSampler()
+            self._sampler.start()
+
+    def start_from_args(self, name: str, args) -> bool:
+        if not getattr(args, "profile", False):
+            return False
+        self.start(name, args.profile_dir, cprofile=args.profile_cprofile, stacks=args.profile_stacks)
+        return True
+
+    @contextmanager
+    def session(self, name: str, args):
+        """Profilerar blocket om --profile angavs; rapporten skrivs även om blocket kastar."""
+        error = None
+        try:
+            yield self.start_from_args(name, args)
+        except BaseException as exc:
+            error = f"{type(exc).__name__}: {exc}"
+            raise
+        finally:
+            self.finish(error)
+
+    def _enter(self, name: str) -> _Measure:
+        measure = _Measure(name)
+        current, peak = tracemalloc.get_traced_memory()
+        for parent in self._stack:  # Föräldrarnas topp hittills sparas innan toppen nollställs
+            parent.peak = max(parent.peak, peak)
+        tracemalloc.reset_peak()
+        measure._mem0 = current
+        measure._wall0, measure._cpu0 = time.perf_counter(), time.process_time()
+        self._stack.append(measure)
+        return measure
+
+    def _exit(self, measure: _Measure):
+        measure.wall = time.perf_counter() - measure._wall0
+        measure.cpu = time.process_time() - measure._cpu0
+        current, peak = tracemalloc.get_traced_memory()
+        measure.peak = max(measure.peak, peak) - measure._mem0
+        measure.net = current - measure._mem0
+        self._stack.pop()
+        for parent in self._stack:
+            parent.peak = max(parent.peak, peak)
+
+    @contextmanager
+    def stage(self, name: str):
+        """Ett steg i körningen, t.ex. "extract" eller "embed"."""
+        if not self.enabled:
+            yield
+            return
+        measure = self._enter(name)
+        try:
+            yield
+        finally:
+            self._exit(measure)
+            self.stages.append(measure.as_dict())
+
+    @contextmanager
+    def unit(self, stage: str, label: str):
+        """En enhet inom ett steg, t.ex. en sida eller en batch."""
+        if not self.enabled:
+            yield
+            return
+        measure = self._enter(label)
+        try:
+            yield
+        finally:
+            self._exit(measure)
+            units = self.units.setdefault(stage, [])
+            if len(units) < MAX_UNITS:
+                units.append(measure.as_dict())
+
+    def wrap(self, fn: Callable, name: Optional[str] = None) -> Callable:
+        """fn med summerad tid och antal anrop; för funktioner som anropas för ofta för stage/unit."""
+        if not self.enabled:
+            return fn
+        name = name or fn.__name__
+        totals = self.calls.setdefault(name, {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0})
+
+        def timed(*args, **kwargs):
+            wall0, cpu0 = time.perf_counter(), time.thread_time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                totals["calls"] += 1
+                totals["wall_s"] += time.perf_counter() - wall0
+                totals["cpu_s"] += time.thread_time() - cpu0
+        return timed
+
+    def report(self) -> Dict:
+        stamp, wall0, cpu0 = self._started
+        units = {}
+        for stage, rows in self.units.items():
+            walls = sorted(row["wall_s"] for row in rows)
+            slowest = sorted(rows, key=lambda row: -row["wall_s"])[:10]
+            units[stage] = {
+                "count": len(rows),
+                "wall_s_total": round(sum(walls), 4),
+                "wall_s_p50": walls[len(walls) // 2],
+                "wall_s_max": walls[-1],
+                "peak_mb_max": max(row["peak_mb"] for row in rows),
+                "slowest": slowest,
+            }
+        return {
+            "name": self.name,
+            "started": stamp,
+            "wall_s": round(time.perf_counter() - wall0, 4),
+            "cpu_s": round(time.process_time() - cpu0, 4),
+            "peak_mb": round(tracemalloc.get_traced_memory()[1] / 1e6, 2),
+            "stages": self.stages,
+            "units": units,
+            "calls": {name: {**totals, "wall_s": round(totals["wall_s"], 4), "cpu_s": round(totals["cpu_s"], 4)}
+                      for name, totals in self.calls.items()},
+        }
+
+    def finish(self, error: Optional[str] = None) -> Optional[str]:
+        """Stoppar mätningen och skriver rapporten (och ev. .prof/.collapsed). Returnerar JSON-sökvägen."""
+        if not self.enabled:
+            return None
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        if self._sampler is not None:
+            self._sampler.stop()
+        report = self.report()
+        if error:
+            report["error"] = error
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, f"{self.name}-{report['started']}")
+        if self._cprofile is not None:
+            self._cprofile.dump_stats(f"{base}.prof")
+            stream = io.StringIO()
+            pstats.Stats(self._cprofile, stream=stream).sort_stats("cumulative").print_stats(25)
+            report["cprofile_top"] = stream.getvalue().splitlines()
+            report["files"] = [f"{base}.prof"]
+        if self._sampler is not None:
+            self._sampler.write(f"{base}.collapsed")
+            report.setdefault("files", []).append(f"{base}.collapsed")
+        with open(f"{base}.json", "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1, ensure_ascii=False)
+        with open(f"{base}.txt", "w", encoding="utf-8") as f:
+            f.write(format_report(report))
+        print(format_report(report))
+        print(f"Profilrapport sparad till '{base}.json'.")
+        self.enabled = False
+        tracemalloc.stop()
+        return f"{base}.json"
+
+
+def format_report(report: Dict) -> str:
+    lines = [f"Profil {report['name']} ({report['started']}): {report['wall_s']:.2f} s vägg, "
+             f"{report['cpu_s']:.2f} s CPU, topp {report['peak_mb']:.1f} MB (Python-allokeringar)",
+             f"  {'steg':<28}{'vägg s':>10}{'CPU s':>10}{'topp MB':>10}{'netto MB':>10}"]
+    if report.get("error"):
+        lines.insert(1, f"  Avbruten: {report['error']}")
+    for stage in report["stages"]:
+        lines.append(f"  {stage['name']:<28}{stage['wall_s']:>10.3f}{stage['cpu_s']:>10.3f}"
+                     f"{stage['peak_mb']:>10.1f}{stage['net_mb']:>10.1f}")
+    for stage, summary in report["units"].items():
+        lines.append(f"  {stage}: {summary['count']} enheter, p50 {summary['wall_s_p50'] * 1000:.1f} ms, "
+                     f"max {summary['wall_s_max'] * 1000:.1f} ms, topp {summary['peak_mb_max']:.1f} MB")
+        for row in summary["slowest"][:3]:
+            lines.append(f"      långsammast: {row['name']} {row['wall_s'] * 1000:.1f} ms")
+    for name, totals in report["calls"].items():
+        lines.append(f"  {name}(): {totals['calls']} anrop, {totals['wall_s']:.3f} s vägg, {totals['cpu_s']:.3f} s CPU")
+    return "\n".join(lines) + "\n"
+
+
+def compare_reports(before: Dict, after: Dict, threshold: float = 0.2) -> List[str]:
+    """Skillnad per steg; steg som blivit mer än threshold långsammare eller större markeras."""
+    lines = [f"{'steg':<28}{'vägg s':>18}{'CPU s':>18}{'topp MB':>18}"]
+    old = {stage["name"]: stage for stage in before["stages"]}
+    new = {stage["name"]: stage for stage in after["stages"]}
+    rows = [("totalt", {"wall_s": before["wall_s"], "cpu_s": before["cpu_s"], "peak_mb": before["peak_mb"]},
+             {"wall_s": after["wall_s"], "cpu_s": after["cpu_s"], "peak_mb": after["peak_mb"]})]
+    rows += [(name, old.get(name), new.get(name)) for name in dict.fromkeys([*old, *new])]
+    for name, a, b in rows:
+        if a is None or b is None:
+            lines.append(f"{name:<28}{'(bara i ' + ('efter' if a is None else 'före') + ')':>18}")
+            continue
+        cells, flagged = [], False
+        for key in ("wall_s", "cpu_s", "peak_mb"):
+            change = (b[key] - a[key]) / a[key] if a[key] else 0.0
+            flagged |= change > threshold and b[key] - a[key] > (0.05 if key != "peak_mb" else 1.0)
+            cells.append(f"{a[key]:.2f}->{b[key]:.2f} {change:+.0%}")
+        lines.append(f"{name:<28}" + "".join(f"{cell:>18}" for cell in cells) + ("  <-- regression" if flagged else ""))
+    return lines
+
+
+ingest_profiler = IngestProfiler()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Visa och jämför profilrapporter från indexeringen.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    show = sub.add_parser("show", help="Visa en rapport")
+    show.add_argument("report")
+    compare = sub.add_parser("compare", help="Jämför två rapporter steg för steg")
+    compare.add_argument("before")
+    compare.add_argument("after")
+    compare.add_argument("--threshold", type=float, default=0.2, help="Relativ försämring som markeras")
+    args = parser.parse_args()
+
+    def load(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    if args.command == "show":
+        print(format_report(load(args.report)), end="")
+    else:
+        print("\n".join(compare_reports(load(args.before), load(args.after), args.threshold)))
+
+
+if __name__ == "__main__":
+    main()
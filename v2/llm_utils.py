@@ -1,36 +1,337 @@
-import google.generativeai as genai
-import streamlit as st
+import collections
+import datetime
+import os
+import random
+import threading
+import time
 
-genai.configure(api_key=st.secrets["API_KEY"])
+from generation_queue import GenerationRejected, generation_queue
+from prompts import build_system_prompt, no_answer_phrase
 
-def generate_response(query, context, model_name="gemini-2.0-flash", answer_language="English"):
+_genai = None
+_genai_lock = threading.Lock()
 
-    if isinstance(context, list):
-        context_text = "\n\n".join(context)
-    else:
-        context_text = context
 
-    model = genai.GenerativeModel(model_name=model_name)
+def get_genai():
+    """
+    Importerar och konfigurerar google.generativeai vid första användning i stället
+    för vid import, så att appens första rendering inte väntar på klienten.
+    """
+    global _genai
+    if _genai is None:
+        with _genai_lock:
+            if _genai is None:
+                import google.generativeai as genai
+                import streamlit as st
 
-    if answer_language == "English":
-        language_instruction = "You always respond in English, regardless of the language of the question."
-    else:
-        language_instruction = "You always respond in Swedish, regardless of the language of the question."
+                genai.configure(api_key=st.secrets["API_KEY"])
+                _genai = genai
+    return _genai
 
-    system_prompt = (
-        f"You are a friendly, helpful, and knowledgeable assistant who specializes in Ableton Live 12 and MIDI. "
-        f"{language_instruction} "
-        "Base your answers on the provided context. "
-        "If the context contains relevant information, use it to answer the question as accurately and concisely as possible. "
-        "If the context does not contain a direct answer, but includes related information, use that to guide the user — suggest search terms, refer to relevant sections of the manual, or explain related concepts. "
-        "If the context is completely irrelevant to the question, respond: 'I found no relevant information in my sources. Try rephrasing your question or consult the Ableton Live 12 manual.'" # Denna är viktig!
-    )
 
-    prompt = f"{system_prompt}\n\nContext:\n{context_text}\n\nQuestion:\n{query}"
+def use_endpoint(api_endpoint, api_key="stub"):
+    """
+    Pekar klienten mot en annan server med Gemini REST-formatet, t.ex. stub_servers.py,
+    så att loadtest.py kör samma generate_response-, kö- och hedging-kod som appen.
+    """
+    global _genai
+    import google.generativeai as genai
 
-    response = model.generate_content(
-        prompt,
-        generation_config=genai.types.GenerationConfig(max_output_tokens=1000),
-    )
+    with _genai_lock:
+        genai.configure(api_key=api_key, transport="rest", client_options={"api_endpoint": api_endpoint})
+        _genai = genai
+    prefix_cache.clear()
 
-    return response.text
\ No newline at end of file
+
+class GeminiPrefixCache:
+    """
+    Håller den konstanta delen av prompten (systeminstruktioner och ev. "het" kontext,
+    t.ex. ofta hämtade chunks) som ett cachat prefix, och återanvänder modellobjekten
+    mellan anrop i stället för att bygga om dem varje gång.
+
+    Prefixet cachas med Gemini context caching (CachedContent). Om cachen inte kan skapas,
+    t.ex. för att prefixet är under API:ts minsta tokenantal, används i stället en
+    återanvänd modell med system_instruction.
+    """
+
+    def __init__(self, ttl_minutes=60):
+        self.ttl = datetime.timedelta(minutes=ttl_minutes)
+        self.hot_context = []
+        self._hot_set = frozenset()
+        self._models = {}  # (model_name, answer_language) -> (modell, cachad?, utgångstid)
+        self._lock = threading.Lock()
+        self.stats = {
+            "requests": 0,
+            "cache_hits": 0,  # Anrop som använde ett cachat prefix
+            "model_builds": 0,
+            "prompt_tokens": 0,
+            "cached_tokens": 0,  # Prompt-tokens som kom från cachen i stället för att skickas
+            "skipped_hot_chunks": 0,  # Hämtade chunks som inte behövde skickas (fanns i prefixet)
+        }
+
+    def set_hot_context(self, texts):
+        """Byter den heta kontexten; befintliga modeller byggs om vid nästa anrop."""
+        with self._lock:
+            self.hot_context = list(texts)
+            self._hot_set = frozenset(self.hot_context)
+            self._models.clear()
+
+    def clear(self):
+        """Glömmer byggda modeller, t.ex. efter att klienten konfigurerats om."""
+        with self._lock:
+            self._models.clear()
+
+    def _build_model(self, model_name, system_prompt):
+        genai = get_genai()
+        try:
+            cached_content = genai.caching.CachedContent.create(
+                model=f"models/{model_name}",
+                display_name=f"ableton-rag-{model_name}",
+                system_instruction=system_prompt,
+                contents=["\n\n".join(self.hot_context)] if self.hot_context else None,
+                ttl=self.ttl,
+            )
+            return genai.GenerativeModel.from_cached_content(cached_content=cached_content), True
+        except Exception as e:
+            print(f"Context caching ej tillgänglig för {model_name} ({e}); använder system_instruction.")
+            return genai.GenerativeModel(model_name=model_name, system_instruction=system_prompt), False
+
+    def get_model(self, model_name, answer_language):
+        """Returnerar (modell, cachad?) för kombinationen, bygger den bara vid behov."""
+        key = (model_name, answer_language)
+        now = datetime.datetime.now()
+        with self._lock:
+            entry = self._models.get(key)
+            if entry is None or (entry[2] is not None and entry[2] <= now):
+                model, cached = self._build_model(model_name, build_system_prompt(answer_language))
+                expires = now + self.ttl - datetime.timedelta(minutes=1) if cached else None
+                entry = (model, cached, expires)
+                self._models[key] = entry
+                self.stats["model_builds"] += 1
+            return entry[0], entry[1]
+
+    def split_context(self, context, cached):
+        """Tar bort chunks som redan ingår i det cachade prefixet ur kontexten."""
+        if not isinstance(context, list):
+            return context
+        if not cached:
+            return "\n\n".join(context)
+        remaining = [text for text in context if text not in self._hot_set]
+        self.stats["skipped_hot_chunks"] += len(context) - len(remaining)
+        return "\n\n".join(remaining)
+
+    def record_usage(self, response, cached):
+        self.stats["requests"] += 1
+        if cached:
+            self.stats["cache_hits"] += 1
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            self.stats["prompt_tokens"] += getattr(usage, "prompt_token_count", 0) or 0
+            self.stats["cached_tokens"] += getattr(usage, "cached_content_token_count", 0) or 0
+
+    def report(self):
+        requests = max(self.stats["requests"], 1)
+        return {
+            **self.stats,
+            "hit_rate": self.stats["cache_hits"] / requests,
+            "saved_tokens_per_request": self.stats["cached_tokens"] / requests,
+        }
+
+
+prefix_cache = GeminiPrefixCache()
+
+
+def _is_transient(error):
+    """Fel som är värda ett nytt försök: rate limits, överlast, tillfälliga nätverksfel."""
+    transient_names = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+                       "DeadlineExceeded", "GatewayTimeout", "BadGateway"}
+    return type(error).__name__ in transient_names or isinstance(error, (ConnectionError, TimeoutError))
+
+
+class _Race:
+    """Delat tillstånd för ett anrops försök: vem som svarade först och hur många som gett upp."""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.done = threading.Event()  # Satt när ett försök vunnit eller anropet gett upp; övriga avbryter
+        self.first_token = False
+        self.started = 0
+        self.failed = 0
+        self.winner = None  # "primary" eller "hedge"
+        self.text = None
+        self.errors = []
+
+    def finish(self, role, text):
+        with self.cond:
+            if self.winner is None:
+                self.winner, self.text = role, text
+                self.done.set()
+            self.cond.notify_all()
+
+    def fail(self, error):
+        with self.cond:
+            self.failed += 1
+            self.errors.append(error)
+            self.cond.notify_all()
+
+    def wait(self, timeout, until_first_token=False):
+        deadline = time.monotonic() + max(timeout, 0)
+        with self.cond:
+            while self.winner is None and self.failed < self.started:
+                if until_first_token and self.first_token:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+
+
+class HedgedGenerator:
+    """
+    Genererar med hedging för att korta svanslatensen.
+
+    Första försöket går till huvudmodellen. Har ingen första token kommit inom
+    hedge-tiden (en percentil av uppmätt tid till första token) startas ett andra
+    försök, som standard mot en lättare modell; det som svarar först vinner och det
+    andra slutar läsa sin ström. Tillfälliga fel försöks om med exponentiell backoff.
+    Efter hard_timeout ges upp med GenerationRejected, så att anroparen kan svara
+    med de hämtade chunks i stället (samma väg som när generationskön är full).
+    """
+
+    def __init__(self, hedge_model="gemini-2.0-flash-lite", hedge_percentile=0.95, default_hedge_delay=2.5,
+                 min_samples=20, hard_timeout=30.0, max_retries=2, backoff=0.5):
+        self.hedge_model = hedge_model
+        self.hedge_percentile = hedge_percentile
+        self.default_hedge_delay = default_hedge_delay
+        self.min_samples = min_samples
+        self.hard_timeout = hard_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._first_token_s = collections.deque(maxlen=500)  # Huvudmodellens tid till första token
+        self._latency_s = collections.deque(maxlen=500)  # Total tid per lyckat anrop
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "hedges": 0, "hedge_wins": 0, "retries": 0, "timeouts": 0, "errors": 0}
+
+    def hedge_delay(self):
+        with self._lock:
+            samples = sorted(self._first_token_s)
+        if len(samples) < self.min_samples:
+            return self.default_hedge_delay
+        return samples[min(int(self.hedge_percentile * len(samples)), len(samples) - 1)]
+
+    def _attempt(self, race, model_name, primary, query, context, answer_language, history, deadline):
+        retries = 0
+        while not race.done.is_set():
+            try:
+                model, cached = prefix_cache.get_model(model_name, answer_language)
+                prompt = build_prompt(query, prefix_cache.split_context(context, cached), history)
+                start = time.monotonic()
+                response = model.generate_content(
+                    prompt,
+                    generation_config=get_genai().types.GenerationConfig(max_output_tokens=1000),
+                    stream=True,
+                )
+                parts = []
+                for chunk in response:
+                    if not parts:
+                        with race.cond:
+                            race.first_token = True
+                            race.cond.notify_all()
+                        if primary:
+                            with self._lock:
+                                self._first_token_s.append(time.monotonic() - start)
+                    parts.append(chunk.text)
+                    if race.done.is_set():
+                        return  # Ett annat försök vann; sluta läsa strömmen
+                prefix_cache.record_usage(response, cached)
+                race.finish("primary" if primary else "hedge", "".join(parts))
+                return
+            except Exception as e:
+                delay = self.backoff * (2 ** retries) * random.uniform(0.5, 1.5)
+                if not _is_transient(e) or retries >= self.max_retries or time.monotonic() + delay >= deadline:
+                    print(f"Generering med {model_name} misslyckades: {e}")
+                    race.fail(e)
+                    return
+                retries += 1
+                with self._lock:
+                    self.stats["retries"] += 1
+                if race.done.wait(delay):
+                    return
+
+    def _start(self, race, model_name, primary, *args):
+        with race.cond:
+            race.started += 1
+        threading.Thread(target=self._attempt, args=(race, model_name, primary) + args,
+                         name=f"generate-{model_name}", daemon=True).start()
+
+    def generate(self, query, context, model_name, answer_language, history, allow_hedge=True):
+        start = time.monotonic()
+        deadline = start + self.hard_timeout
+        race = _Race()
+        args = (query, context, answer_language, history, deadline)
+        with self._lock:
+            self.stats["requests"] += 1
+
+        self._start(race, model_name, True, *args)
+        race.wait(self.hedge_delay(), until_first_token=True)
+        # Hedga om huvudmodellen är tyst eller redan har gett upp (då blir det en ren fallback).
+        if race.winner is None and (not race.first_token or race.failed == race.started) and allow_hedge:
+            with self._lock:
+                self.stats["hedges"] += 1
+            self._start(race, self.hedge_model or model_name, False, *args)
+        race.wait(deadline - time.monotonic())
+        race.done.set()
+
+        with self._lock:
+            if race.winner is None:
+                self.stats["timeouts" if race.failed < race.started else "errors"] += 1
+            else:
+                self._latency_s.append(time.monotonic() - start)
+                if race.winner == "hedge":
+                    self.stats["hedge_wins"] += 1
+        if race.winner is None:
+            raise GenerationRejected("timeout" if race.failed < race.started else "error")
+        return race.text
+
+    def report(self):
+        with self._lock:
+            latencies = sorted(self._latency_s)
+            stats = dict(self.stats)
+
+        def percentile(p):
+            return latencies[min(int(p * len(latencies)), len(latencies) - 1)] if latencies else 0.0
+
+        return {
+            **stats,
+            "hedge_delay_s": round(self.hedge_delay(), 3),
+            "latency_p50_s": round(percentile(0.50), 3),
+            "latency_p95_s": round(percentile(0.95), 3),
+            "latency_p99_s": round(percentile(0.99), 3),
+        }
+
+
+hedged_generator = HedgedGenerator(
+    hedge_model=os.environ.get("GEMINI_HEDGE_MODEL", "gemini-2.0-flash-lite"),
+    hedge_percentile=float(os.environ.get("HEDGE_PERCENTILE", "0.95")),
+    hard_timeout=float(os.environ.get("GENERATION_TIMEOUT", "30")),
+)
+
+
+def build_prompt(query, context_text, history=None):
+    # Tidigare turer i konversationen, så att följdfrågor kan tolkas (history=[{"role", "content"}, ...])
+    history_text = ""
+    if history:
+        turns = "\n".join(f"{'User' if m['role'] == 'user' else 'Assistant'}: {m['content']}" for m in history)
+        history_text = f"Conversation so far:\n{turns}\n\n"
+
+    # Systemprompten ligger i modellens (cachade) prefix, så bara den varierande delen skickas här.
+    return f"{history_text}Context:\n{context_text}\n\nQuestion:\n{query}"
+
+
+def generate_response(query, context, model_name="gemini-2.0-flash", answer_language="English", history=None):
+    if not context:
+        # Ingen chunk klarade likhetsgolvet (vector_store.AdaptiveK): svara direkt utan LLM-anrop.
+        return no_answer_phrase(answer_language)
+    # Hedga inte när andra anrop redan väntar i kön; då skulle dubbletten bara förlänga kön.
+    return hedged_generator.generate(query, context, model_name, answer_language, history,
+                                     allow_hedge=generation_queue.depth == 0)
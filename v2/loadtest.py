@@ -0,0 +1,269 @@
+# loadtest.py
+"""
+Lastgenerator för RAG-pipelinen (embedding -> sökning -> generering).
+
+Simulerar N samtidiga användare som trådar i en och samma process, precis som
+Streamlit kör varje session i en egen tråd i en app.py-instans. Varje fråga går
+samma väg som på Chatbot-sidan: ChatSession.ask med create_embeddings,
+generation_queue, generate_response (hedging och timeout), query_router och
+adaptive_k. Klienten (google.generativeai med REST-transport) pekas mot en lokal
+stub-server (se stub_servers.py) med llm_utils.use_endpoint, så testet går helt
+utan nätverk men fångar regressioner i den riktiga genereringsvägen. Varje
+användare för konversationer om --turns frågor, så historiken kommer med i prompten.
+
+Exempel:
+    python loadtest.py --users 1,2,4,8,16,32 --duration 10
+    python loadtest.py --users 8 --gen-latency lognormal:800:0.6 --gen-rate-limit-rps 10 --json-out data/loadtest.json
+    python loadtest.py --users 8 --gen-latency const:200 --chunk-latency lognormal:40:0.8 --output-tokens 300
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import traceback
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from predefined_qa import predefined_qa_en, predefined_qa_sv
+from rag_utils import load_chunks
+from stub_servers import StubConfig, start_stub_server, stub_embedding
+from vector_store import AdaptiveK, VectorStore, adaptive_k
+
+STAGES = ["embed", "search", "generate", "total"]
+HEDGE_COUNTERS = ("requests", "hedges", "hedge_wins", "retries", "timeouts", "errors")
+
+
+def build_store(parquet_path: str, chunks_path: str) -> VectorStore:
+    """Laddar riktiga embeddings om de finns, annars byggs ett syntetiskt index av chunkarna."""
+    store = VectorStore()
+    if os.path.exists(parquet_path) and store.load(parquet_path):
+        return store
+    chunks = [c for c in load_chunks(chunks_path) if c.get("content", "").strip()]
+    print(f"Bygger syntetiskt index av {len(chunks)} chunks (stub-embeddings)...")
+    for chunk in chunks:
+        store.add_item(chunk["content"], stub_embedding(chunk["content"]), chunk)
+    return store
+
+
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else float("nan")
+
+
+class LoadStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+        self.sources: Dict[str, int] = {}
+        self.completed = 0
+        self.errors = 0
+        self.error_types: Dict[str, int] = {}
+
+    def record(self, trace: Dict):
+        with self.lock:
+            for stage, seconds in trace["timings"].items():
+                self.timings[stage].append(seconds)
+            self.sources[trace["source"]] = self.sources.get(trace["source"], 0) + 1
+            self.completed += 1
+
+    def record_error(self, error: Exception):
+        """Räknar felet per typ; första tracebacken skrivs ut, så att ett kopplingsfel syns direkt."""
+        with self.lock:
+            first = self.errors == 0
+            self.errors += 1
+            name = type(error).__name__
+            self.error_types[name] = self.error_types.get(name, 0) + 1
+        if first:
+            traceback.print_exception(type(error), error, error.__traceback__)
+
+    def summary(self, elapsed: float, counters: Dict[str, int]) -> Dict:
+        degraded = self.sources.get("degraded", 0)  # Kön full, timeout eller fel: inget genererat svar
+        requests = max(counters.get("cache_requests", 0), 1)
+        result = {
+            "completed": self.completed,
+            "errors": self.errors,
+            "error_types": dict(self.error_types),
+            "degraded": degraded,
+            "sources": dict(self.sources),
+            "retries": counters.get("retries", 0),
+            "hedges": counters.get("hedges", 0),
+            "hedge_wins": counters.get("hedge_wins", 0),
+            "throughput_rps": self.completed / elapsed if elapsed > 0 else 0.0,
+            "error_rate": (self.errors + degraded) / max(self.completed + self.errors, 1),
+            "prompt_tokens_per_request": counters.get("prompt_tokens", 0) / requests,
+            "cached_tokens_per_request": counters.get("cached_tokens", 0) / requests,
+        }
+        for stage in STAGES:
+            values = self.timings[stage]
+            result[stage] = {f"p{q}_ms": percentile(values, q) * 1000 for q in (50, 95, 99)}
+        return result
+
+
+def _counters() -> Dict[str, int]:
+    """Räknarna i genereringsvägen (hedging, prefixcache) just nu; skillnaden per nivå rapporteras."""
+    from llm_utils import hedged_generator, prefix_cache
+
+    counters = {key: value for key, value in hedged_generator.report().items() if key in HEDGE_COUNTERS}
+    counters.update({key: prefix_cache.stats[key] for key in ("prompt_tokens", "cached_tokens")})
+    counters["cache_requests"] = prefix_cache.stats["requests"]
+    return counters
+
+
+def run_level(users: int, duration: float, questions: List[str], store: VectorStore, k: int, think_time: float,
+              turns: int, adaptive: AdaptiveK, router, answer_language: str = "English") -> Dict:
+    """Kör `users` samtidiga användare under `duration` sekunder och returnerar statistik."""
+    from chat_session import ChatSession
+    from generation_queue import INTERACTIVE, generation_queue
+    from llm_utils import generate_response
+    from rag_utils import create_embeddings
+
+    generate = generation_queue.wrap(generate_response, INTERACTIVE)
+    stats = LoadStats()
+    before = _counters()
+    deadline = time.monotonic() + duration
+
+    def user_loop(seed: int):
+        rng = random.Random(seed)
+        chat = ChatSession()
+        while time.monotonic() < deadline:
+            if len(chat.messages) >= 2 * turns:
+                chat = ChatSession()  # Ny användare: tomma cachar och ingen historik
+            try:
+                # Som Chatbot-sidan i app.py (som dessutom cachar frågeembeddings över sessioner).
+                chat.ask(rng.choice(questions), answer_language, store, create_embeddings, generate, k=k,
+                         router=router, adaptive=adaptive)
+                stats.record(chat.last_trace)
+            except Exception as e:
+                stats.record_error(e)
+            if think_time > 0:
+                time.sleep(rng.expovariate(1.0 / think_time))
+
+    threads = [threading.Thread(target=user_loop, args=(i,), daemon=True) for i in range(users)]
+    start = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    after = _counters()
+    counters = {key: after[key] - before[key] for key in after}
+    summary = stats.summary(time.monotonic() - start, counters)
+    summary["users"] = users
+    return summary
+
+
+def find_saturation(levels: List[Dict], min_gain: float = 0.1, max_error_rate: float = 0.05) -> Optional[Dict]:
+    """
+    Mättnadspunkten är den sista nivån där fler användare fortfarande gav mer genomströmning.
+    Därefter ökar genomströmningen mindre än `min_gain` (relativt), eller felandelen blir för hög.
+    """
+    best = None
+    for prev, level in zip([None] + levels[:-1], levels):
+        if level["error_rate"] > max_error_rate:
+            break
+        if prev is not None and level["throughput_rps"] < prev["throughput_rps"] * (1 + min_gain):
+            break
+        best = level
+    return best
+
+
+def print_level(level: Dict):
+    stages = "  ".join(
+        f"{stage}: {level[stage]['p50_ms']:.0f}/{level[stage]['p95_ms']:.0f}/{level[stage]['p99_ms']:.0f}"
+        for stage in STAGES
+    )
+    print(
+        f"users={level['users']:>3}  rps={level['throughput_rps']:6.2f}  ok={level['completed']:>5}  "
+        f"err={level['errors']:>3}  degr={level['degraded']:>3}  retries={level['retries']:>3}  "
+        f"hedges={level['hedges']:>3}  p50/p95/p99 ms -> {stages}  "
+        f"tokens/req={level['prompt_tokens_per_request']:.0f} (cachade {level['cached_tokens_per_request']:.0f})"
+    )
+    if level["error_types"]:
+        print("    fel: " + ", ".join(f"{name}={count}" for name, count in sorted(level["error_types"].items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lasttest av retrieval + generering mot lokala stub-servrar.")
+    parser.add_argument("--users", default="1,2,4,8,16", help="Kommaseparerade nivåer av samtidiga användare")
+    parser.add_argument("--duration", type=float, default=10.0, help="Sekunder per nivå")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Medeltid (s) mellan frågor per användare")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--turns", type=int, default=3, help="Frågor per konversation innan en ny användare börjar")
+    parser.add_argument("--language", default="English", choices=["English", "Swedish"])
+    parser.add_argument("--routing-log", help="Logga routningsbesluten hit (standard: ingen logg, så att "
+                                              "data/routing_log.jsonl bara innehåller riktig trafik)")
+    parser.add_argument("--min-similarity", type=float, default=-1.0,
+                        help="Golv för adaptive_k; stub-embeddings saknar semantik, så standard är att behålla alla träffar")
+    parser.add_argument("--embeddings", default=os.path.join("data", "full_embeddings.parquet"))
+    parser.add_argument("--chunks", default=os.path.join("data", "full_manual_chunks.jsonl"))
+    parser.add_argument("--questions", help="Textfil med en fråga per rad (standard: Evaluation-frågorna)")
+    parser.add_argument("--api-url", help="Använd en redan startad stub-server i stället för en lokal")
+    parser.add_argument("--embed-latency", default="lognormal:40:0.4")
+    parser.add_argument("--gen-latency", default="lognormal:600:0.5")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--embed-rate-limit-rps", type=float, default=0.0)
+    parser.add_argument("--gen-rate-limit-rps", type=float, default=0.0)
+    parser.add_argument("--ms-per-prompt-token", type=float, default=0.0,
+                        help="Extra generate-latens per icke-cachad prompt-token")
+    parser.add_argument("--output-tokens", type=int, default=200)
+    parser.add_argument("--ms-per-output-token", type=float, default=0.0)
+    parser.add_argument("--chunk-latency", default="const:0", help="Latens mellan strömmade delar av svaret")
+    parser.add_argument("--json-out", help="Skriv fullständig rapport som JSON hit")
+    args = parser.parse_args()
+
+    if args.questions:
+        with open(args.questions, "r", encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+    else:
+        questions = [qa["question"] for qa in predefined_qa_en + predefined_qa_sv]
+
+    from llm_utils import use_endpoint
+    from query_router import QueryRouter, query_router
+
+    servers = []
+    if not args.api_url:
+        # En server spelar både embedding- och generate-API:t, eftersom klienten har en endpoint.
+        servers.append(start_stub_server(StubConfig(
+            latency=args.gen_latency, embed_latency=args.embed_latency, error_rate=args.error_rate,
+            rate_limit_rate=args.rate_limit_rate, rate_limit_rps=args.gen_rate_limit_rps,
+            embed_rate_limit_rps=args.embed_rate_limit_rps, ms_per_prompt_token=args.ms_per_prompt_token,
+            output_tokens=args.output_tokens, ms_per_output_token=args.ms_per_output_token,
+            chunk_latency=args.chunk_latency,
+        )))
+        args.api_url = servers[-1].base_url
+    use_endpoint(args.api_url)
+
+    store = build_store(args.embeddings, args.chunks)
+    # Samma inställningar som appens router, men egen logg (eller ingen).
+    router = QueryRouter(simple_model=query_router.simple_model, full_model=query_router.full_model,
+                         simple_k=query_router.simple_k, threshold=query_router.threshold, log_path=args.routing_log)
+    adaptive = AdaptiveK(min_similarity=args.min_similarity, min_gap=adaptive_k.min_gap, min_k=adaptive_k.min_k)
+
+    levels = []
+    for users in [int(u) for u in args.users.split(",") if u.strip()]:
+        level = run_level(users, args.duration, questions, store, args.k, args.think_time, args.turns,
+                          adaptive, router, args.language)
+        print_level(level)
+        levels.append(level)
+
+    saturation = find_saturation(levels)
+    if saturation is None:
+        print("Ingen stabil nivå hittades (för hög felandel redan vid första nivån).")
+    else:
+        print(f"Mättnadspunkt: ca {saturation['users']} samtidiga användare, "
+              f"{saturation['throughput_rps']:.2f} frågor/s, p95 total {saturation['total']['p95_ms']:.0f} ms.")
+
+    if args.json_out:
+        report = {"config": vars(args), "levels": levels, "saturation": saturation}
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Rapport sparad till '{args.json_out}'.")
+
+    for server in servers:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+# outline_chunking.py
+"""
+Chunkning utifrån PDF:ens bokmärken (outline) i stället för att gissa rubriker ur radtext.
+
+Ableton-manualen har en komplett bokmärkesstruktur. Den läses en gång med pypdf
+och blir ett index rubrik -> sidintervall. Därefter extraheras bara sidorna som
+behövs, parallellt, och varje sektion får texten mellan sin egen rubrik och nästa.
+Sidnummer sparas i chunkens metadata (page_start/page_end, 1-baserade) för billiga
+källhänvisningar.
+
+    python outline_chunking.py data/ableton_12_manual.pdf data/full_manual_chunks.jsonl
+"""
+import argparse
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from pypdf import PdfReader
+
+from chunking import Chunk, determine_level
+from dedup import DEFAULT_THRESHOLD, dedup_stage
+from extract_selected_chapters import flush_paragraph
+from ingest_profile import add_profile_arguments, ingest_profiler
+from page_cache import DEFAULT_CACHE_PATH, PageCache, write_change_report
+
+NUMBERED_TITLE = re.compile(r"^(\d+(?:\.\d+)*)\.?\s+(.+)$")
+PAGE_NUMBER_LINE = re.compile(r"^\d{1,4}$")
+
+_worker_reader: Optional[PdfReader] = None
+
+
+class OutlineEntry:
+    def __init__(self, chunk_id: str, title: str, depth: int, page: int, parent: Optional[int]):
+        self.chunk_id = chunk_id
+        self.title = title
+        self.depth = depth
+        self.page = page  # 0-baserat sidindex där sektionen börjar
+        self.parent = parent  # Index i den platta listan, eller None för kapitel
+        self.page_end = page  # 0-baserat, inklusive; sätts av build_outline_index
+
+    def to_dict(self) -> Dict:
+        return {
+            "chunk_id": self.chunk_id,
+            "title": self.title,
+            "level": determine_level(self.chunk_id),
+            "page_start": self.page + 1,
+            "page_end": self.page_end + 1,
+            "parent": self.parent,
+        }
+
+
+def build_outline_index(reader: PdfReader) -> List[OutlineEntry]:
+    """
+    Plattar ut bokmärkesträdet i läsordning. chunk_id tas från rubrikens numrering
+    ("10.2.1 Editing Notes") och annars från positionen i trädet.
+    """
+    entries: List[OutlineEntry] = []
+
+    def walk(items, depth: int, parent: Optional[int], prefix: List[int]):
+        position = 0
+        last_index = parent
+        for item in items:
+            if isinstance(item, list):
+                # En lista efter ett bokmärke innehåller dess barn.
+                walk(item, depth + 1, last_index, prefix + [position])
+                continue
+            position += 1
+            title = str(item.title).strip()
+            match = NUMBERED_TITLE.match(title)
+            if match:
+                chunk_id, title = match.group(1), match.group(2)
+            else:
+                chunk_id = ".".join(str(p) for p in prefix + [position])
+            page = reader.get_destination_page_number(item)
+            entries.append(OutlineEntry(chunk_id, title, depth, page, parent))
+            last_index = len(entries) - 1
+
+    walk(reader.outline, 0, None, [])
+
+    # En sektion slutar på sidan där nästa bokmärke börjar (det kan dela sida med nästa sektion).
+    for i, entry in enumerate(entries):
+        next_page = entries[i + 1].page if i + 1 < len(entries) else len(reader.pages) - 1
+        entry.page_end = max(entry.page, next_page)
+    return entries
+
+
+def _init_worker(pdf_path: str):
+    global _worker_reader
+    _worker_reader = PdfReader(pdf_path)
+
+
+def _page_lines(page_number: int) -> Tuple[int, List[str]]:
+    """Extraherar en sida och tar bara bort tomma rader och rena sidnummer (ingen rubrikgissning)."""
+    try:
+        text = _worker_reader.pages[page_number].extract_text() or ""
+    except Exception as e:
+        print(f"Fel vid läsning av sida {page_number + 1}: {e}")
+        text = ""
+    lines = []
+    for line in text.split("\n"):
+        line = line.strip()
+        if line and not PAGE_NUMBER_LINE.match(line):
+            lines.append(line)
+    return page_number, lines
+
+
+def extract_pages(pdf_path: str, page_numbers: List[int], workers: Optional[int] = None,
+                  reader: Optional[PdfReader] = None, cache: Optional[PageCache] = None) -> Dict[int, List[str]]:
+    """
+    Extraherar de angivna sidorna parallellt; varje process öppnar PDF:en en gång.
+    Med en PageCache skickas bara sidor med ändrat innehåll till processerna.
+    """
+    pages: Dict[int, List[str]] = {}
+    hashes: Dict[int, str] = {}
+    to_extract = page_numbers
+    if cache is not None:
+        reader = reader or PdfReader(pdf_path)
+        to_extract = []
+        for page_number in page_numbers:
+            hashes[page_number] = cache.hash(reader.pages[page_number])
+            cached = cache.get(hashes[page_number])
+            if cached is None:
+                to_extract.append(page_number)
+            else:
+                pages[page_number] = cached.split("\n") if cached else []
+
+    if to_extract:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(pdf_path,)) as pool:
+            pages.update(pool.map(_page_lines, to_extract, chunksize=16))
+
+    if cache is not None:
+        for page_number in to_extract:
+            cache.put(hashes[page_number], "\n".join(pages[page_number]))
+        cache.record_run(pdf_path, [hashes.get(i, "") for i in range(len(reader.pages))])
+    return pages
+
+
+def _title_key(text: str) -> str:
+    return re.sub(r"[^a-z0-9]", "", text.lower())
+
+
+def _find_title(lines: List[str], entry: OutlineEntry, start: int = 0) -> Optional[int]:
+    """Radindex där sektionens rubrik står på dess första sida, om den hittas."""
+    key = _title_key(entry.title)
+    if not key:
+        return None
+    for i in range(start, len(lines)):
+        line_key = _title_key(lines[i])
+        if line_key.endswith(key) and len(line_key) - len(key) <= len(entry.chunk_id) + 1:
+            return i
+    return None
+
+
+def build_chunks(entries: List[OutlineEntry], pages: Dict[int, List[str]]) -> List[Chunk]:
+    chunks: List[Chunk] = []
+    for i, entry in enumerate(entries):
+        next_entry = entries[i + 1] if i + 1 < len(entries) else None
+        lines: List[str] = []
+        last_page = entry.page  # Sista sidan som faktiskt bidrog med text
+        for page_number in range(entry.page, entry.page_end + 1):
+            page_lines = pages.get(page_number, [])
+            begin, end = 0, len(page_lines)
+            if page_number == entry.page:
+                title_at = _find_title(page_lines, entry)
+                begin = title_at + 1 if title_at is not None else 0
+            if next_entry is not None and page_number == next_entry.page:
+                next_at = _find_title(page_lines, next_entry, begin)
+                if next_at is not None:
+                    end = next_at
+                elif page_number != entry.page:
+                    end = 0  # Nästa sektion börjar högst upp på sidan
+            if end > begin:
+                lines.extend(page_lines[begin:end])
+                last_page = page_number
+
+        parent_chain = []
+        parent = entry.parent
+        while parent is not None:
+            parent_chain.insert(0, {"chunk_id": entries[parent].chunk_id, "title": entries[parent].title})
+            parent = entries[parent].parent
+
+        chunks.append(
+            Chunk(
+                chunk_id=entry.chunk_id,
+                title=entry.title,
+                content=flush_paragraph(lines),
+                level=determine_level(entry.chunk_id),
+                parent_chain=parent_chain,
+                page_start=entry.page + 1,
+                page_end=last_page + 1,
+            )
+        )
+    return chunks
+
+
+def chunk_pdf_by_outline(pdf_path: str, output_path: str, index_path: Optional[str] = None,
+                         workers: Optional[int] = None, cache: Optional[PageCache] = None,
+                         dedup_threshold: Optional[float] = DEFAULT_THRESHOLD) -> List[Dict]:
+    with ingest_profiler.stage("outline"):
+        reader = PdfReader(pdf_path)
+        entries = build_outline_index(reader)
+    if not entries:
+        raise ValueError(f"'{pdf_path}' saknar bokmärken; använd chunking.py i stället.")
+    print(f"{len(entries)} bokmärken hittades i {len(reader.pages)} sidor.")
+
+    needed_pages = sorted({p for e in entries for p in range(e.page, e.page_end + 1)})
+    # Sidorna extraheras i andra processer; profilen visar därför bara stegets totala tid,
+    # och CPU-tiden räknar inte med processerna.
+    with ingest_profiler.stage("extract"):
+        pages = extract_pages(pdf_path, needed_pages, workers, reader=reader, cache=cache)
+    with ingest_profiler.stage("build"):
+        chunks = [chunk.to_dict() for chunk in build_chunks(entries, pages)]
+    if dedup_threshold is not None:
+        with ingest_profiler.stage("dedup"):
+            chunks = dedup_stage(chunks, dedup_threshold, os.path.join(os.path.dirname(output_path), "dedup_report.json"))
+
+    with ingest_profiler.stage("write"):
+        with open(output_path, "w", encoding="utf-8") as out_file:
+            for chunk in chunks:
+                json.dump(chunk, out_file, ensure_ascii=False)
+                out_file.write("\n")
+
+        if index_path:
+            with open(index_path, "w", encoding="utf-8") as f:
+                json.dump([e.to_dict() for e in entries], f, ensure_ascii=False, indent=1)
+
+    if cache is not None:
+        cache.save()
+        if index_path:
+            write_change_report(cache.changed_pages, cache.page_count, outline_index_path=index_path)
+
+    print(f"Chunkning klar! {len(chunks)} chunks sparade i '{output_path}'.")
+    return chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chunka manualen utifrån PDF:ens bokmärken.")
+    parser.add_argument("pdf_path", nargs="?", default=os.path.join("data", "ableton_12_manual.pdf"))
+    parser.add_argument("output_path", nargs="?", default=os.path.join("data", "full_manual_chunks.jsonl"))
+    parser.add_argument("--index-path", default=os.path.join("data", "outline_index.json"),
+                        help="Var rubrik -> sidintervall-indexet sparas")
+    parser.add_argument("--workers", type=int, default=None, help="Antal processer (standard: antal kärnor)")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="Sidcache för inkrementell extraktion")
+    parser.add_argument("--no-cache", action="store_true", help="Extrahera alla sidor på nytt")
+    parser.add_argument("--dedup-threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Minsta Jaccard-likhet för att slå ihop chunks (se dedup.py)")
+    parser.add_argument("--no-dedup", action="store_true", help="Spara chunks utan deduplicering")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    cache = None if args.no_cache else PageCache(args.cache, namespace="outline")
+    with ingest_profiler.session("outline_chunking", args):
+        chunk_pdf_by_outline(args.pdf_path, args.output_path, args.index_path, args.workers, cache,
+                             None if args.no_dedup else args.dedup_threshold)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# page_cache.py
+"""
+Cache för extraherad sidtext, nycklad på en hash av sidans råa content stream.
+
+Vid en ny manualversion är de flesta sidor oförändrade. Bara sidor vars hash
+saknas i cachen extraheras och rensas om. Cachen minns också vilka hashar förra
+körningen hade per sidnummer, så att ändrade sidor (och via outline-indexet
+ändrade sektioner) kan rapporteras vidare till chunkning och embeddings.
+"""
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional
+
+# Höj när rensningen (clean_line m.fl.) ändras, så att gamla cachade texter inte återanvänds.
+CLEANING_VERSION = "1"
+DEFAULT_CACHE_PATH = os.path.join("data", "page_cache.json")
+DEFAULT_CHANGES_PATH = os.path.join("data", "changed_sections.json")
+
+
+def page_hash(page, namespace: str) -> str:
+    """Hash av sidans content stream (plus namnrymd och rensningsversion)."""
+    contents = page.get_contents()
+    data = contents.get_data() if contents is not None else b""
+    h = hashlib.sha256(f"{namespace}:{CLEANING_VERSION}:".encode("utf-8"))
+    h.update(data)
+    return h.hexdigest()
+
+
+class PageCache:
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, namespace: str = "full_text"):
+        self.path = path
+        self.namespace = namespace  # Olika extraktionssätt (full_text, outline) cachas separat
+        self.entries: Dict[str, str] = {}
+        self.last_runs: Dict[str, List[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.changed_pages: List[int] = []  # 0-baserade sidor som skiljer sig från förra körningen
+        self.page_count = 0
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+            self.entries = payload.get("entries", {})
+            self.last_runs = payload.get("last_runs", {})
+
+    def hash(self, page) -> str:
+        return page_hash(page, self.namespace)
+
+    def get(self, key: str) -> Optional[str]:
+        text = self.entries.get(key)
+        if text is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return text
+
+    def put(self, key: str, text: str):
+        self.entries[key] = text
+
+    def record_run(self, source: str, hashes: List[str]) -> List[int]:
+        """Sparar sidornas hashar för källan och returnerar sidorna som ändrats sedan förra körningen."""
+        run_key = f"{self.namespace}:{os.path.basename(source)}"
+        previous = self.last_runs.get(run_key, [])
+        self.changed_pages = [
+            i for i, h in enumerate(hashes) if i >= len(previous) or previous[i] != h
+        ]
+        self.last_runs[run_key] = hashes
+        self.page_count = len(hashes)
+        return self.changed_pages
+
+    def save(self):
+        # Behåll bara texter som någon av de senaste körningarna refererar till.
+        referenced = {h for hashes in self.last_runs.values() for h in hashes}
+        self.entries = {k: v for k, v in self.entries.items() if k in referenced}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"entries": self.entries, "last_runs": self.last_runs}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        print(f"Sidcache: {self.hits} träffar, {self.misses} extraherade, {len(self.changed_pages)} ändrade sidor.")
+
+
+def changed_sections(changed_pages: List[int], outline_index_path: str) -> List[str]:
+    """chunk_id för sektioner vars sidintervall (från outline_chunking) innehåller en ändrad sida."""
+    if not os.path.exists(outline_index_path):
+        return []
+    with open(outline_index_path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    pages = {p + 1 for p in changed_pages}  # outline-indexet är 1-baserat
+    return [
+        e["chunk_id"] for e in entries
+        if any(e["page_start"] <= p <= e["page_end"] for p in pages)
+    ]
+
+
+def write_change_report(changed_pages: List[int], total_pages: int,
+                        outline_index_path: str = os.path.join("data", "outline_index.json"),
+                        path: str = DEFAULT_CHANGES_PATH) -> Dict:
+    """
+    Skriver vilka sidor och sektioner som ändrats, så att chunkning och
+    generate_and_save_embeddings.py --incremental bara behöver göra om dem.
+    """
+    report = {
+        "total_pages": total_pages,
+        "changed_pages": [p + 1 for p in changed_pages],
+        "changed_sections": changed_sections(changed_pages, outline_index_path),
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    print(f"{len(changed_pages)}/{total_pages} sidor och {len(report['changed_sections'])} sektioner ändrade; "
+          f"rapport sparad till '{path}'.")
+    return report
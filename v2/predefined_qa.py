@@ -0,0 +1,29 @@
+"""Fördefinierade frågor och idealsvar som används på Evaluation-sidan."""
+
+# Frågor och svar på engelska (utökad för hela manualen)
+predefined_qa_en = [
+    {"question": "How do I use automation in Ableton Live to change a parameter over time?", "ideal_answer": "Automation is drawn directly in tracks using breakpoint envelopes. Select the parameter you want to automate, and then draw its curve using the pen tool or by clicking and dragging breakpoints."},
+    {"question": "What is the purpose of the Arrangement View in Ableton Live?", "ideal_answer": "The Arrangement View is a linear timeline for recording, arranging, and editing MIDI and audio clips in a traditional song structure."},
+    {"question": "Explain the function of Sends and Returns in Ableton Live.", "ideal_answer": "Sends route a portion of a track's signal to a Return track, where effects can be applied. This allows multiple tracks to share the same effect processing, saving CPU and providing a consistent sound."},
+    {"question": "How can I create a custom drum rack in Ableton Live?", "ideal_answer": "Drag individual samples or instruments into the pads of an empty Drum Rack. You can then configure each pad's settings and effects independently."},
+    {"question": "What is the difference between hot-swapping and replacing a device?", "ideal_answer": "Hot-swapping allows you to audition different devices while keeping their current settings intact. Replacing a device permanently swaps it with a new one, discarding the old device's settings."},
+    {"question": "How do I consolidate tracks or clips in Ableton Live?", "ideal_answer": "Select the desired clips or a range of time across multiple tracks, then go to the Edit menu and choose 'Consolidate Time to New Track' or 'Consolidate' (Cmd/Ctrl+J)."},
+    {"question": "What are Scenes in the Session View and how are they used?", "ideal_answer": "Scenes in Session View are horizontal rows that contain a collection of clips, typically representing a section of a song. Launching a scene plays all clips within that row simultaneously, useful for live performance and improvisation."},
+    {"question": "How can I reduce CPU usage in Ableton Live when my project is complex?", "ideal_answer": "To reduce CPU usage, you can freeze tracks, flatten tracks, reduce buffer size, disable unused devices, or use fewer CPU-intensive effects."},
+    {"question": "Describe the function of the Follow Actions feature for MIDI and audio clips.", "ideal_answer": "Follow Actions allow you to define what happens after a clip finishes playing, such as playing another clip, stopping, retriggering itself, or launching a different scene. This is useful for creating dynamic arrangements and generative music."},
+    {"question": "How do I set up an external MIDI controller in Ableton Live 12?", "ideal_answer": "Go to Live's Preferences, then 'Link/Tempo/MIDI'. Select your controller from the 'Control Surface' dropdown, enable its 'Track' and 'Remote' switches in the 'MIDI Ports' section, and ensure its MIDI input is active."}
+]
+
+# Frågor och svar på svenska (utökad för hela manualen)
+predefined_qa_sv = [
+    {"question": "Hur använder jag automation i Ableton Live för att ändra en parameter över tid?", "ideal_answer": "Automation ritas direkt i spåren med hjälp av brytpunktskuvert. Välj den parameter du vill automatisera och rita sedan dess kurva med pennverktyget eller genom att klicka och dra brytpunkter."},
+    {"question": "Vad är syftet med Arrangement View i Ableton Live?", "ideal_answer": "Arrangement View är en linjär tidslinje för inspelning, arrangering och redigering av MIDI- och ljudklipp i en traditionell låtstruktur."},
+    {"question": "Förklara funktionen av Sends och Returns i Ableton Live.", "ideal_answer": "Sends dirigerar en del av ett spårs signal till ett Return-spår, där effekter kan appliceras. Detta gör att flera spår kan dela samma effektprocessering, vilket sparar CPU och ger ett konsekvent ljud."},
+    {"question": "Hur kan jag skapa ett anpassat Drum Rack i Ableton Live?", "ideal_answer": "Dra individuella samplingar eller instrument till padsen i ett tomt Drum Rack. Du kan sedan konfigurera varje pads inställningar och effekter oberoende av varandra."},
+    {"question": "Vad är skillnaden mellan hot-swapping och att ersätta en enhet?", "ideal_answer": "Hot-swapping låter dig provlyssna olika enheter samtidigt som deras nuvarande inställningar behålls. Att ersätta en enhet byter ut den permanent mot en ny, vilket kasserar den gamla enhetens inställningar."},
+    {"question": "Hur konsoliderar jag spår eller klipp i Ableton Live?", "ideal_answer": "Markera önskade klipp eller ett tidsintervall över flera spår, gå sedan till menyn Redigera och välj 'Consolidate Time to New Track' eller 'Consolidate' (Cmd/Ctrl+J)."},
+    {"question": "Vad är Scener i Session View och hur används de?", "ideal_answer": "Scener i Session View är horisontella rader som innehåller en samling klipp, typiskt representerande en sektion av en låt. Att starta en scen spelar alla klipp inom den raden samtidigt, vilket är användbart för liveframträdanden och improvisation."},
+    {"question": "Hur kan jag minska CPU-användningen i Ableton Live när mitt projekt är komplext?", "ideal_answer": "För att minska CPU-användningen kan du frysa spår, 'flattena' spår, minska buffertstorleken, inaktivera oanvända enheter eller använda färre CPU-intensiva effekter."},
+    {"question": "Beskriv funktionen 'Follow Actions' för MIDI- och ljudklipp.", "ideal_answer": "Follow Actions låter dig definiera vad som händer efter att ett klipp spelats klart, till exempel att spela ett annat klipp, stoppa, återstarta sig själv, eller starta en annan scen. Detta är användbart för att skapa dynamiska arrangemang och generativ musik."},
+    {"question": "Hur ställer jag in en extern MIDI-kontroller i Ableton Live 12?", "ideal_answer": "Gå till Lives inställningar, sedan 'Link/Tempo/MIDI'. Välj din kontroller från rullgardinsmenyn 'Control Surface', aktivera dess 'Track' och 'Remote' omkopplare i sektionen 'MIDI Ports', och se till att dess MIDI-ingång är aktiv."}
+]
@@ -0,0 +1,246 @@
+# projection.py
+"""
+Dimensionsreduktion av lagrade embeddings med en anpassad projektion.
+
+För en enda manual räcker oftast en bråkdel av embedding-001:s 768 dimensioner.
+Projektionen anpassas offline på korpusens embeddings, antingen med PCA eller
+genom att bara behålla de första dimensionerna (Matryoshka-liknande trunkering),
+och sparas som projection.npz i indexets snapshot. VectorStore projicerar både
+korpus och frågor, så minnet och skanningskostnaden minskar med d/768.
+
+    python projection.py report --dims 64 128 256 384 --k 5 10
+    python projection.py publish --dim 256
+"""
+import argparse
+import os
+import shutil
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+PROJECTION_FILE = "projection.npz"
+METHODS = ("pca", "truncate")
+
+
+class Projection:
+    def __init__(self, mean: np.ndarray, components: np.ndarray, method: str = "pca",
+                 explained_variance: Optional[float] = None):
+        self.mean = mean.astype(np.float32)  # (D,)
+        self.components = components.astype(np.float32)  # (d, D), rader är basvektorer
+        self.method = method
+        self.explained_variance = explained_variance
+
+    @property
+    def dim(self) -> int:
+        return self.components.shape[0]
+
+    @property
+    def input_dim(self) -> int:
+        return self.components.shape[1]
+
+    def project(self, vectors) -> np.ndarray:
+        """(D,) -> (d,) eller (n, D) -> (n, d), som float32."""
+        return (np.asarray(vectors, dtype=np.float32) - self.mean) @ self.components.T
+
+    def save(self, path: str):
+        np.savez(path, mean=self.mean, components=self.components, method=self.method,
+                 explained_variance=np.float32(self.explained_variance if self.explained_variance is not None else np.nan))
+
+    @classmethod
+    def load(cls, path: str) -> "Projection":
+        data = np.load(path)
+        explained = float(data["explained_variance"])
+        return cls(data["mean"], data["components"], str(data["method"]),
+                   None if np.isnan(explained) else explained)
+
+
+def fit_pca(matrix: np.ndarray, dim: int) -> Projection:
+    """PCA via egenuppdelning av kovariansmatrisen (D x D), billig även för många chunks."""
+    matrix = np.asarray(matrix, dtype=np.float64)
+    mean = matrix.mean(axis=0)
+    centered = matrix - mean
+    covariance = centered.T @ centered / max(len(matrix) - 1, 1)
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+    order = np.argsort(eigenvalues)[::-1][:dim]
+    total = eigenvalues.sum()
+    explained = float(eigenvalues[order].sum() / total) if total > 0 else 1.0
+    return Projection(mean, eigenvectors[:, order].T, "pca", explained)
+
+
+def fit_truncation(matrix: np.ndarray, dim: int) -> Projection:
+    """Behåller de första `dim` dimensionerna (ingen centrering)."""
+    input_dim = np.asarray(matrix).shape[1]
+    return Projection(np.zeros(input_dim), np.eye(dim, input_dim), "truncate")
+
+
+def fit_projection(matrix: np.ndarray, dim: int, method: str = "pca") -> Projection:
+    if method not in METHODS:
+        raise ValueError(f"Okänd metod '{method}', välj en av {', '.join(METHODS)}")
+    if dim >= np.asarray(matrix).shape[1]:
+        raise ValueError(f"Måldimensionen {dim} måste vara mindre än {np.asarray(matrix).shape[1]}")
+    return fit_pca(matrix, dim) if method == "pca" else fit_truncation(matrix, dim)
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _top_k(corpus: np.ndarray, queries: np.ndarray, k: int, exclude: Optional[np.ndarray]) -> np.ndarray:
+    scores = queries @ corpus.T
+    if exclude is not None:
+        # Frågor hämtade ur korpusen ska inte hitta sig själva.
+        valid = exclude >= 0
+        scores[np.flatnonzero(valid), exclude[valid]] = -np.inf
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return top
+
+
+def recall_at_k(corpus: np.ndarray, queries: np.ndarray, projection: Projection,
+                ks: Sequence[int], exclude: Optional[np.ndarray] = None) -> Dict[int, float]:
+    """Andel av fulldimensionens top-k som också hamnar i den projicerade top-k, per k."""
+    full_corpus = _normalize(corpus.astype(np.float32))
+    full_queries = _normalize(queries.astype(np.float32))
+    reduced_corpus = _normalize(projection.project(corpus))
+    reduced_queries = _normalize(projection.project(queries))
+    recalls = {}
+    for k in ks:
+        k = min(k, len(corpus) - 1)
+        truth = _top_k(full_corpus, full_queries, k, exclude)
+        found = _top_k(reduced_corpus, reduced_queries, k, exclude)
+        hits = sum(len(set(t) & set(f)) for t, f in zip(truth, found))
+        recalls[k] = hits / (k * len(queries))
+    return recalls
+
+
+def sample_queries(corpus: np.ndarray, n: int, extra_queries: Optional[np.ndarray] = None, seed: int = 0):
+    """
+    Frågor för utvärderingen: riktiga frågeembeddings (t.ex. FAQ-storens) om de finns,
+    plus ett urval korpusvektorer. Returnerar (queries, exclude) där exclude är
+    korpusraden frågan kommer ifrån, eller -1.
+    """
+    rng = np.random.RandomState(seed)
+    rows = rng.choice(len(corpus), size=min(n, len(corpus)), replace=False)
+    queries = [corpus[rows]]
+    exclude = [rows]
+    if extra_queries is not None and len(extra_queries):
+        queries.insert(0, np.asarray(extra_queries, dtype=np.float32))
+        exclude.insert(0, np.full(len(extra_queries), -1))
+    return np.vstack(queries).astype(np.float32), np.concatenate(exclude)
+
+
+def evaluate(corpus: np.ndarray, dims: Sequence[int], ks: Sequence[int], methods: Sequence[str] = METHODS,
+             n_queries: int = 200, extra_queries: Optional[np.ndarray] = None) -> List[Dict]:
+    """recall@k, minne per vektor och skanningstid per fråga för varje (metod, dimension)."""
+    queries, exclude = sample_queries(corpus, n_queries, extra_queries)
+    rows = []
+    full_matrix = _normalize(corpus.astype(np.float32))
+    start = time.perf_counter()
+    full_matrix @ _normalize(queries).T
+    full_scan_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    rows.append({"method": "full", "dim": corpus.shape[1], "bytes_per_vector": corpus.shape[1] * 4,
+                 "scan_ms": full_scan_ms, "recall": {k: 1.0 for k in ks}, "explained_variance": 1.0})
+    for method in methods:
+        for dim in dims:
+            projection = fit_projection(corpus, dim, method)
+            reduced = _normalize(projection.project(corpus))
+            reduced_queries = _normalize(projection.project(queries))
+            start = time.perf_counter()
+            reduced @ reduced_queries.T
+            scan_ms = (time.perf_counter() - start) * 1000 / len(queries)
+            rows.append({
+                "method": method,
+                "dim": dim,
+                "bytes_per_vector": dim * 4,
+                "scan_ms": scan_ms,
+                "recall": recall_at_k(corpus, queries, projection, ks, exclude),
+                "explained_variance": projection.explained_variance,
+            })
+    return rows
+
+
+def print_evaluation(rows: List[Dict]):
+    ks = list(rows[0]["recall"])
+    header = f"{'metod':<9} {'dim':>5} {'byte/vek':>9} {'ms/fråga':>9} {'varians':>8} " + \
+        " ".join(f"{'recall@' + str(k):>10}" for k in ks)
+    print(header)
+    for row in rows:
+        variance = f"{row['explained_variance']:.1%}" if row["explained_variance"] is not None else "-"
+        recalls = " ".join(f"{row['recall'].get(k, float('nan')):>10.3f}" for k in ks)
+        print(f"{row['method']:<9} {row['dim']:>5} {row['bytes_per_vector']:>9} {row['scan_ms']:>9.3f} "
+              f"{variance:>8} {recalls}")
+
+
+def _load_corpus(root: str, parquet_path: Optional[str]):
+    from index_snapshots import EMBEDDINGS_FILE, read_current_version
+    from vector_store import VectorStore
+
+    if parquet_path is None:
+        version = read_current_version(root)
+        if version is None:
+            raise FileNotFoundError("Inget aktivt index; ange --parquet eller kör generate_and_save_embeddings.py")
+        parquet_path = os.path.join(root, version, EMBEDDINGS_FILE)
+    store = VectorStore()
+    if not store.load(parquet_path):
+        raise FileNotFoundError(parquet_path)
+    return parquet_path, np.vstack(store.vectors).astype(np.float32)
+
+
+def main():
+    from faq_store import DEFAULT_FAQ_PATH
+    from index_snapshots import DEFAULT_INDEX_ROOT, EMBEDDINGS_FILE, commit_snapshot, stage_snapshot
+    from hierarchical_search import HIERARCHY_FILE
+    from related_sections import RELATED_FILE
+    from text_store import TEXTS_FILE
+
+    parser = argparse.ArgumentParser(description="Anpassa och utvärdera en projektion av indexets embeddings.")
+    parser.add_argument("--root", default=DEFAULT_INDEX_ROOT)
+    parser.add_argument("--parquet", default=None, help="Standard: aktivt snapshots embeddings")
+    sub = parser.add_subparsers(dest="command", required=True)
+    report = sub.add_parser("report", help="recall@k per måldimension")
+    report.add_argument("--dims", type=int, nargs="+", default=[64, 128, 256, 384])
+    report.add_argument("--k", type=int, nargs="+", default=[5, 10, 15])
+    report.add_argument("--methods", nargs="+", choices=METHODS, default=list(METHODS))
+    report.add_argument("--queries", type=int, default=200, help="Antal korpusvektorer som används som frågor")
+    publish = sub.add_parser("publish", help="Publicera ett snapshot med projektionen")
+    publish.add_argument("--dim", type=int, required=True)
+    publish.add_argument("--method", choices=METHODS, default="pca")
+    args = parser.parse_args()
+
+    parquet_path, corpus = _load_corpus(args.root, args.parquet)
+    faq_embeddings_path = os.path.splitext(DEFAULT_FAQ_PATH)[0] + ".npy"
+    faq_queries = np.load(faq_embeddings_path).astype(np.float32) if os.path.exists(faq_embeddings_path) else None
+    if faq_queries is not None and faq_queries.shape[1] != corpus.shape[1]:
+        faq_queries = None
+
+    if args.command == "report":
+        print(f"{len(corpus)} vektorer x {corpus.shape[1]} dimensioner från '{parquet_path}'.")
+        print_evaluation(evaluate(corpus, args.dims, args.k, args.methods, args.queries, faq_queries))
+    elif args.command == "publish":
+        projection = fit_projection(corpus, args.dim, args.method)
+        queries, exclude = sample_queries(corpus, 200, faq_queries)
+        recall = recall_at_k(corpus, queries, projection, [10], exclude)
+        staging_dir = stage_snapshot(args.root)
+        try:
+            shutil.copy2(parquet_path, os.path.join(staging_dir, EMBEDDINGS_FILE))
+            projection.save(os.path.join(staging_dir, PROJECTION_FILE))
+            for name in (RELATED_FILE, TEXTS_FILE, HIERARCHY_FILE):  # Gäller samma chunks och följer med
+                sidecar_path = os.path.join(os.path.dirname(parquet_path), name)
+                if os.path.exists(sidecar_path):
+                    shutil.copy2(sidecar_path, os.path.join(staging_dir, name))
+            version = commit_snapshot(staging_dir, {
+                "embedding_model": "models/embedding-001",
+                "n_items": len(corpus),
+                "projection": {"method": args.method, "dim": args.dim, "recall_at_10": list(recall.values())[0]},
+            })
+        except Exception:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+        print(f"Publicerade version {version} med {args.method}-projektion till {args.dim} dimensioner "
+              f"(recall@10 {list(recall.values())[0]:.3f}).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""Promptar som delas av llm_utils och verktyg som inte ska behöva Gemini-klienten (t.ex. loadtest.py)."""
+
+NO_ANSWER_PHRASE = "I found no relevant information in my sources. Try rephrasing your question or consult the Ableton Live 12 manual."
+NO_ANSWER_PHRASES = {
+    "English": NO_ANSWER_PHRASE,
+    "Swedish": "Jag hittade ingen relevant information i mina källor. Försök att omformulera din fråga eller konsultera Ableton Live 12 manualen.",
+}
+
+RETRIEVAL_ONLY_INTRO = {
+    "English": "The assistant is busy right now, so here are the most relevant passages from the manual instead:",
+    "Swedish": "Assistenten är upptagen just nu, så här är de mest relevanta avsnitten ur manualen i stället:",
+}
+
+
+def no_answer_phrase(answer_language="English"):
+    return NO_ANSWER_PHRASES.get(answer_language, NO_ANSWER_PHRASE)
+
+
+def build_retrieval_only_answer(context_texts, answer_language="English", max_chunks=3, max_chars=600):
+    """Svar utan LLM när generationskön är full: de främsta chunks, förkortade."""
+    intro = RETRIEVAL_ONLY_INTRO.get(answer_language, RETRIEVAL_ONLY_INTRO["English"])
+    passages = []
+    for text in context_texts[:max_chunks]:
+        text = text.strip()
+        if len(text) > max_chars:
+            text = text[:max_chars].rsplit(" ", 1)[0] + " ..."
+        passages.append(f"> {text}")
+    return "\n\n".join([intro] + passages)
+
+
+def build_system_prompt(answer_language="English"):
+    if answer_language == "English":
+        language_instruction = "You always respond in English, regardless of the language of the question."
+    else:
+        language_instruction = "You always respond in Swedish, regardless of the language of the question."
+
+    return (
+        f"You are a friendly, helpful, and knowledgeable assistant who specializes in Ableton Live 12 and MIDI. "
+        f"{language_instruction} "
+        "Base your answers on the provided context. "
+        "If the context contains relevant information, use it to answer the question as accurately and concisely as possible. "
+        "If the context does not contain a direct answer, but includes related information, use that to guide the user — suggest search terms, refer to relevant sections of the manual, or explain related concepts. "
+        f"If the context is completely irrelevant to the question, respond: '{NO_ANSWER_PHRASE}'" # Denna är viktig!
+    )
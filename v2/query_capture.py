@@ -0,0 +1,372 @@
+# query_capture.py
+"""
+Anonymiserad insamling av produktionsfrågor och deterministisk replay av dem.
+
+Insamlingen är avstängd som standard och slås på med QUERY_CAPTURE=1. Varje fråga
+på Chatbot-sidan sparas med språk, hur den besvarades (memo, FAQ, live), vilka chunks
+som hämtades (som korta texthashar) och tid per steg. Frågetexten tvättas från
+e-postadresser, länkar och långa nummer, sessionen ersätts av en pseudonym som byts
+vid varje omstart och tidsstämpeln avrundas till minuten. Frågans embedding sparas
+(float16, base64) bara om tvättningen inte ändrade texten. Poster buffras och läggs
+till som gzip-medlemmar i data/captures/queries-<datum>.jsonl.gz, en fil per dag.
+
+Replay kör en insamlad logg mot valfritt index och pipelinekonfiguration, med
+inspelade eller stubbade LLM-svar, och jämför två körningar:
+
+    python query_capture.py replay data/captures/*.jsonl.gz --out data/replay-a.json
+    python query_capture.py replay data/captures/*.jsonl.gz --version 20250601T120000-1a2b3c4d --k 8 --router --out data/replay-b.json
+    python query_capture.py diff data/replay-a.json data/replay-b.json
+"""
+import argparse
+import atexit
+import base64
+import glob
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from prompts import no_answer_phrase
+from text_store import text_id
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+DEFAULT_CAPTURE_DIR = os.environ.get("QUERY_CAPTURE_DIR", os.path.join(DATA_DIR, "captures"))
+STAGES = ["embed", "search", "generate", "total"]
+SOURCES = ["live", "memo", "faq", "degraded", "no_context"]
+
+SCRUB_PATTERNS = [
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+"), "<email>"),
+    (re.compile(r"https?://\S+|www\.\S+"), "<url>"),
+    (re.compile(r"\b\d{1,3}(\.\d{1,3}){3}\b"), "<ip>"),
+    (re.compile(r"\+?\d[\d\s-]{6,}\d"), "<number>"),  # Telefon-, kort- och ordernummer; "120 bpm" behålls
+]
+
+
+def scrub(text: str) -> Tuple[str, bool]:
+    """Tvättad text och om något byttes ut."""
+    scrubbed = text.strip()
+    for pattern, placeholder in SCRUB_PATTERNS:
+        scrubbed = pattern.sub(placeholder, scrubbed)
+    return scrubbed, scrubbed != text.strip()
+
+
+def encode_embedding(embedding) -> str:
+    return base64.b64encode(np.asarray(embedding, dtype=np.float16).tobytes()).decode("ascii")
+
+
+def decode_embedding(encoded: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(encoded), dtype=np.float16).astype(np.float32)
+
+
+class QueryCapture:
+    def __init__(self, directory: str = DEFAULT_CAPTURE_DIR, enabled: bool = False, flush_every: int = 20,
+                 flush_seconds: float = 30.0, store_embeddings: bool = True):
+        self.directory = directory
+        self.enabled = enabled
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self.store_embeddings = store_embeddings
+        self._salt = os.urandom(16)  # Ny per process: pseudonymer kan inte kopplas ihop mellan omstarter
+        self._buffer: List[Dict] = []
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self.stats = {"captured": 0, "scrubbed": 0, "flushed": 0}
+        atexit.register(self.flush)
+
+    def _pseudonym(self, session_id: Optional[str]) -> Optional[str]:
+        if session_id is None:
+            return None
+        return hmac.new(self._salt, session_id.encode("utf-8"), hashlib.sha256).hexdigest()[:10]
+
+    def record(self, query: str, answer_language: str, trace: Dict, answer: str, session_id: Optional[str] = None,
+               embedding=None, index_version: Optional[str] = None):
+        """Sparar en besvarad fråga; trace är ChatSession.last_trace."""
+        if not self.enabled:
+            return
+        scrubbed, changed = scrub(query)
+        entry = {
+            "ts": int(time.time()) // 60 * 60,
+            "session": self._pseudonym(session_id),
+            "lang": answer_language,
+            "query": scrubbed,
+            "index": index_version,
+            "source": trace.get("source"),
+            "route": trace.get("route"),
+            "model": trace.get("model"),
+            "embedding_cached": trace.get("embedding_cached", False),
+            "timings_ms": {stage: round(seconds * 1000, 2) for stage, seconds in trace.get("timings", {}).items()},
+            "context": [text_id(text) for text in trace.get("context", [])],
+        }
+        if trace.get("source") == "live":
+            entry["answer"] = scrub(answer)[0]  # Inspelat LLM-svar för replay; kan citera frågan
+        if embedding is not None and self.store_embeddings and not changed:
+            entry["embedding"] = encode_embedding(embedding)
+        with self._lock:
+            self._buffer.append(entry)
+            self.stats["captured"] += 1
+            self.stats["scrubbed"] += int(changed)
+            due = len(self._buffer) >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_seconds
+        if due:
+            self.flush()
+
+    def path_for(self, timestamp: float) -> str:
+        return os.path.join(self.directory, f"queries-{time.strftime('%Y%m%d', time.localtime(timestamp))}.jsonl.gz")
+
+    def flush(self):
+        """Lägger till buffrade poster som en ny gzip-medlem; gzip läser flera medlemmar i följd som en fil."""
+        with self._lock:
+            entries, self._buffer = self._buffer, []
+            self._last_flush = time.monotonic()
+            if not entries:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            lines = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries)
+            with gzip.open(self.path_for(entries[0]["ts"]), "at", encoding="utf-8") as f:
+                f.write(lines)
+            self.stats["flushed"] += len(entries)
+
+    def report(self) -> Dict:
+        return {"enabled": self.enabled, "buffered": len(self._buffer), **self.stats}
+
+
+query_capture = QueryCapture(enabled=os.environ.get("QUERY_CAPTURE") == "1")
+
+
+def load_capture(paths: List[str]) -> List[Dict]:
+    records = []
+    for pattern in paths:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                records.extend(json.loads(line) for line in f if line.strip())
+    return records
+
+
+def capture_fingerprint(records: List[Dict]) -> str:
+    raw = "\n".join(f"{r.get('session')}\x00{r['lang']}\x00{r['query']}" for r in records)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:12]
+
+
+def overlap(a: List[str], b: List[str]) -> Optional[float]:
+    """Andel gemensamma chunks mellan två kontexter (1.0 = samma mängd)."""
+    if not a and not b:
+        return None
+    return len(set(a) & set(b)) / max(len(set(a)), len(set(b)))
+
+
+def replay(records: List[Dict], store, embed_fn: Optional[Callable], llm: str = "recorded",
+           llm_latency: Optional[str] = None, k: int = 5, router=None, faq=None, adaptive=None) -> Dict:
+    """
+    Kör de insamlade frågorna i ordning, med en ChatSession per insamlad session så att
+    historik, memo och cachar beter sig som i produktion. embed_fn används för frågor
+    utan inspelad embedding (None = hoppa över dem). llm är "recorded" (inspelade svar,
+    stubbsvar där inget finns) eller "stub". llm_latency är "recorded", en
+    stub_servers.LatencyModel-specifikation eller None (ingen fördröjning). adaptive är en
+    vector_store.AdaptiveK, som i appen.
+    """
+    from chat_session import ChatSession
+    from stub_servers import LatencyModel
+
+    latency_model = LatencyModel(llm_latency) if llm_latency and llm_latency != "recorded" else None
+    sessions: Dict[Optional[str], ChatSession] = {}
+    current: Dict = {}
+    results = []
+    skipped = 0
+
+    def embed(texts):
+        record = current["record"]
+        if "embedding" in record:
+            return [decode_embedding(record["embedding"])]
+        return embed_fn(texts)
+
+    def generate(query, context, answer_language="English", history=None, model_name=None):
+        record = current["record"]
+        if not context:  # Som generate_response: inget LLM-anrop utan kontext
+            return no_answer_phrase(answer_language)
+        if llm_latency == "recorded":
+            time.sleep(record.get("timings_ms", {}).get("generate", 0.0) / 1000)
+        elif latency_model is not None:
+            time.sleep(latency_model.sample())
+        if llm == "recorded" and record.get("answer"):
+            return record["answer"]
+        return f"[stub] {len(context)} chunks, model {model_name or 'default'}."
+
+    for i, record in enumerate(records):
+        if "embedding" not in record and embed_fn is None:
+            skipped += 1
+            continue
+        current["record"] = record
+        session = sessions.setdefault(record.get("session"), ChatSession())
+        session.ask(record["query"], record["lang"], store, embed, generate, k=k, faq=faq, router=router,
+                    adaptive=adaptive)
+        trace = session.last_trace
+        context = [text_id(text) for text in trace["context"]]
+        results.append({
+            "query_id": i,
+            "source": trace["source"],
+            "embedding_cached": trace["embedding_cached"],
+            "timings_ms": {stage: seconds * 1000 for stage, seconds in trace["timings"].items()},
+            "context": context,
+            "overlap_with_capture": overlap(context, record.get("context", [])) if record.get("context") else None,
+        })
+    return {"fingerprint": capture_fingerprint(records), "skipped": skipped, "results": results,
+            "summary": summarize(results)}
+
+
+def summarize(results: List[Dict]) -> Dict:
+    summary = {"queries": len(results)}
+    for stage in STAGES:
+        values = [r["timings_ms"][stage] for r in results if stage in r["timings_ms"]]
+        summary[stage] = {f"p{q}_ms": float(np.percentile(values, q)) if values else None for q in (50, 95, 99)}
+    for source in SOURCES:
+        summary[f"{source}_rate"] = sum(r["source"] == source for r in results) / max(len(results), 1)
+    summary["embedding_cache_rate"] = sum(r["embedding_cached"] for r in results) / max(len(results), 1)
+    overlaps = [r["overlap_with_capture"] for r in results if r["overlap_with_capture"] is not None]
+    summary["overlap_with_capture"] = float(np.mean(overlaps)) if overlaps else None
+    return summary
+
+
+def diff_runs(a: Dict, b: Dict) -> Dict:
+    """Skillnader mellan två replay-körningar av samma logg."""
+    if a["fingerprint"] != b["fingerprint"]:
+        print("Varning: körningarna kommer från olika loggar; överlappet per fråga är inte jämförbart.")
+    latency = {}
+    for stage in STAGES:
+        latency[stage] = {}
+        for q in ("p50_ms", "p95_ms", "p99_ms"):
+            before, after = a["summary"][stage][q], b["summary"][stage][q]
+            latency[stage][q] = (before, after, (after - before) / before if before and after is not None else None)
+    rates = {key: (a["summary"][key], b["summary"][key])
+             for key in [f"{source}_rate" for source in SOURCES] + ["embedding_cache_rate", "overlap_with_capture"]}
+    by_query = {r["query_id"]: r["context"] for r in b["results"]}
+    overlaps = [overlap(r["context"], by_query[r["query_id"]]) for r in a["results"] if r["query_id"] in by_query]
+    overlaps = [o for o in overlaps if o is not None]
+    return {
+        "latency": latency,
+        "rates": rates,
+        "retrieval_overlap": float(np.mean(overlaps)) if overlaps else None,
+        "identical_context_rate": sum(o == 1.0 for o in overlaps) / len(overlaps) if overlaps else None,
+    }
+
+
+def print_summary(summary: Dict):
+    for stage in STAGES:
+        values = summary[stage]
+        if values["p50_ms"] is not None:
+            print(f"  {stage:<9} p50 {values['p50_ms']:8.2f} ms  p95 {values['p95_ms']:8.2f} ms  p99 {values['p99_ms']:8.2f} ms")
+    rates = "  ".join(f"{source} {summary[f'{source}_rate']:.0%}" for source in SOURCES)
+    print(f"  källa: {rates}  embedding-cache {summary['embedding_cache_rate']:.0%}")
+    if summary["overlap_with_capture"] is not None:
+        print(f"  överlapp med insamlad kontext: {summary['overlap_with_capture']:.3f}")
+
+
+def print_diff(result: Dict):
+    print(f"{'steg':<9} {'kvantil':<7} {'före':>10} {'efter':>10} {'ändring':>8}")
+    for stage, quantiles in result["latency"].items():
+        for q, (before, after, change) in quantiles.items():
+            if before is None or after is None:
+                continue
+            change_text = f"{change:+.0%}" if change is not None else "-"
+            print(f"{stage:<9} {q[:-3]:<7} {before:>8.2f}ms {after:>8.2f}ms {change_text:>8}")
+    for key, (before, after) in result["rates"].items():
+        if before is not None and after is not None:
+            print(f"{key:<22} {before:>8.3f} -> {after:.3f}")
+    if result["retrieval_overlap"] is not None:
+        print(f"Retrieval-överlapp per fråga: {result['retrieval_overlap']:.3f} "
+              f"(identisk kontext för {result['identical_context_rate']:.0%} av frågorna)")
+
+
+def _load_store(args):
+    if args.parquet:
+        from loadtest import build_store  # Syntetiskt index med stub-embeddings om filen saknas
+
+        return build_store(args.parquet, args.chunks), None
+    from index_snapshots import DEFAULT_INDEX_ROOT, load_snapshot, read_current_version
+
+    root = args.index_root or DEFAULT_INDEX_ROOT
+    version = args.version or read_current_version(root)
+    if version is None:
+        raise SystemExit("Inget aktivt index; ange --version eller --parquet.")
+    return load_snapshot(root, version), version
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay av insamlade frågor och jämförelse mellan körningar.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("replay", help="Kör en insamlad logg mot ett index")
+    run.add_argument("captures", nargs="+", help="Loggfiler eller glob-mönster")
+    run.add_argument("--index-root", help="Snapshot-katalog (standard: data/index)")
+    run.add_argument("--version", help="Snapshot-version (standard: aktiv)")
+    run.add_argument("--parquet", help="Använd en parquet-fil i stället för ett snapshot")
+    run.add_argument("--chunks", default=os.path.join(DATA_DIR, "full_manual_chunks.jsonl"))
+    run.add_argument("--k", type=int, default=5)
+    run.add_argument("--router", action="store_true", help="Routa frågor med query_router")
+    run.add_argument("--faq", action="store_true", help="Använd FAQ-storen för indexversionen")
+    run.add_argument("--adaptive", action="store_true", help="Adaptivt k (vector_store.adaptive_k), med --k som tak")
+    run.add_argument("--embed", choices=["recorded", "live", "stub"], default="recorded",
+                     help="Frågor utan inspelad embedding: hoppa över, embedda via Gemini eller stub")
+    run.add_argument("--llm", choices=["recorded", "stub"], default="recorded")
+    run.add_argument("--llm-latency", default=None, help='"recorded" eller t.ex. "lognormal:600:0.5"')
+    run.add_argument("--out", help="Spara körningen som JSON (för diff)")
+    compare = sub.add_parser("diff", help="Jämför två sparade körningar")
+    compare.add_argument("before")
+    compare.add_argument("after")
+    args = parser.parse_args()
+
+    if args.command == "diff":
+        runs = []
+        for path in (args.before, args.after):
+            with open(path, "r", encoding="utf-8") as f:
+                runs.append(json.load(f))
+        print_diff(diff_runs(*runs))
+        return
+
+    records = load_capture(args.captures)
+    store, version = _load_store(args)
+    embed_fn = None
+    if args.embed == "live":
+        from rag_utils import create_embeddings
+
+        embed_fn = create_embeddings
+    elif args.embed == "stub":
+        from stub_servers import stub_embedding
+
+        embed_fn = lambda texts: [stub_embedding(text) for text in texts]
+    router = None
+    if args.router:
+        from query_router import QueryRouter
+
+        router = QueryRouter(log_path=None)
+    faq = None
+    if args.faq and version is not None:
+        from faq_store import DEFAULT_FAQ_PATH, FaqStore
+
+        faq = FaqStore.load(DEFAULT_FAQ_PATH, version)
+
+    adaptive = None
+    if args.adaptive:
+        from vector_store import adaptive_k
+
+        adaptive = adaptive_k
+
+    start = time.perf_counter()
+    run_result = replay(records, store, embed_fn, args.llm, args.llm_latency, args.k, router, faq, adaptive)
+    print(f"Spelade upp {len(run_result['results'])} av {len(records)} frågor "
+          f"({run_result['skipped']} utan embedding) på {time.perf_counter() - start:.1f} s.")
+    print_summary(run_result["summary"])
+    if args.out:
+        run_result["config"] = {key: value for key, value in vars(args).items() if key != "captures"}
+        run_result["config"]["index_version"] = version
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(run_result, f)
+        print(f"Körningen sparad till '{args.out}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+# query_router.py
+"""
+Styr frågor mellan en billig, snabb modell och den fulla modellen.
+
+Klassificeringen använder bara lokala, billiga signaler som redan finns efter
+retrieval:
+- frågans längd i ord,
+- marginalen mellan bästa och näst bästa träffens likhet (en tydlig vinnare
+  tyder på en enkel uppslagsfråga),
+- hur många olika kapitel de främsta träffarna kommer från,
+- lexikala ledtrådar ("what is", "difference between", "step by step" ...),
+- om frågan är en följdfråga i en konversation.
+
+Enkla frågor går till den lätta modellen med mindre k; svåra får den fulla
+modellen och hela kontexten. Varje beslut loggas med signalerna, latensen och en
+kostnadsuppskattning till data/routing_log.jsonl (buffrat, som query_capture.py:
+skrivs var flush_every:e rad, efter flush_seconds och vid avslut), så att trösklarna
+kan justeras:
+
+    python query_router.py report
+"""
+import argparse
+import atexit
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+DEFAULT_LOG_PATH = os.environ.get("ROUTING_LOG_PATH", os.path.join(DATA_DIR, "routing_log.jsonl"))
+
+# Uppskattat pris i USD per miljon tokens (in, ut). Justera efter aktuell prislista.
+MODEL_PRICES = {
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gemini-2.0-flash-lite": (0.075, 0.30),
+}
+
+SIMPLE_CUES = re.compile(
+    r"^(what is|what are|what does|where is|where can i find|which|is there|vad är|vad betyder|var finns)\b",
+    re.IGNORECASE,
+)
+COMPLEX_CUES = re.compile(
+    r"\b(difference between|compare|versus|vs\.?|why|step by step|steps|route|routing|sidechain|while|"
+    r"at the same time|multiple|both|combine|troubleshoot|doesn't work|not working|"
+    r"skillnaden mellan|jämför|varför|steg för steg|samtidigt|flera|fungerar inte)\b",
+    re.IGNORECASE,
+)
+
+
+def estimate_tokens(text_or_chars) -> int:
+    """Grov uppskattning: ungefär fyra tecken per token."""
+    chars = text_or_chars if isinstance(text_or_chars, int) else len(text_or_chars)
+    return max(1, chars // 4)
+
+
+def estimate_cost(model_name: str, prompt_chars: int, answer_chars: int) -> float:
+    price_in, price_out = MODEL_PRICES.get(model_name, MODEL_PRICES["gemini-2.0-flash"])
+    return (estimate_tokens(prompt_chars) * price_in + estimate_tokens(answer_chars) * price_out) / 1_000_000
+
+
+def extract_features(query: str, scores: Sequence[float], metadata: Sequence[Dict], has_history: bool = False) -> Dict:
+    top = list(scores[:5])
+    chapters = {str(m.get("chunk_id", "")).split(".")[0] for m in metadata[:5] if m.get("chunk_id")}
+    return {
+        "words": len(query.split()),
+        "top_score": round(top[0], 4) if top else 0.0,
+        "margin": round(top[0] - top[1], 4) if len(top) > 1 else 1.0,
+        "sections": len(chapters),
+        "simple_cue": bool(SIMPLE_CUES.search(query.strip())),
+        "complex_cue": bool(COMPLEX_CUES.search(query)),
+        "follow_up": has_history,
+    }
+
+
+class RouteDecision:
+    __slots__ = ("route", "model_name", "k", "score", "features")
+
+    def __init__(self, route: str, model_name: str, k: int, score: int, features: Dict):
+        self.route = route
+        self.model_name = model_name
+        self.k = k
+        self.score = score
+        self.features = features
+
+
+class QueryRouter:
+    def __init__(self, simple_model: str = "gemini-2.0-flash-lite", full_model: str = "gemini-2.0-flash",
+                 simple_k: int = 3, long_query_words: int = 18, short_query_words: int = 8,
+                 clear_margin: float = 0.06, flat_margin: float = 0.02, threshold: int = 0,
+                 log_path: Optional[str] = DEFAULT_LOG_PATH, flush_every: int = 50, flush_seconds: float = 30.0):
+        self.simple_model = simple_model
+        self.full_model = full_model
+        self.simple_k = simple_k
+        self.long_query_words = long_query_words
+        self.short_query_words = short_query_words
+        self.clear_margin = clear_margin
+        self.flat_margin = flat_margin
+        self.threshold = threshold  # Poäng <= threshold räknas som enkel fråga
+        self.log_path = log_path
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._buffer: List[str] = []  # Loggrader som inte skrivits än, se flush
+        self._write_lock = threading.Lock()  # Håller raderna i ordning mellan samtidiga flushar
+        self._last_flush = time.monotonic()
+        if log_path:
+            atexit.register(self.flush)
+        self.stats: Dict[str, Dict] = defaultdict(lambda: {"requests": 0, "seconds": 0.0, "cost_usd": 0.0})
+
+    def complexity(self, features: Dict) -> int:
+        """Komplexitetspoäng; varje signal flyttar frågan ett steg mot enkel (-) eller svår (+)."""
+        score = 0
+        if features["words"] >= self.long_query_words:
+            score += 1
+        elif features["words"] <= self.short_query_words:
+            score -= 1
+        if features["margin"] >= self.clear_margin:
+            score -= 1
+        elif features["margin"] <= self.flat_margin:
+            score += 1
+        if features["sections"] >= 3:
+            score += 1
+        elif features["sections"] <= 1:
+            score -= 1
+        if features["complex_cue"]:
+            score += 2
+        if features["simple_cue"]:
+            score -= 1
+        if features["follow_up"]:
+            score += 1
+        return score
+
+    def route(self, query: str, scores: Sequence[float], metadata: Sequence[Dict], has_history: bool = False,
+              full_k: Optional[int] = None) -> RouteDecision:
+        features = extract_features(query, scores, metadata, has_history)
+        score = self.complexity(features)
+        if score <= self.threshold:
+            return RouteDecision("simple", self.simple_model, self.simple_k, score, features)
+        return RouteDecision("full", self.full_model, full_k or len(scores), score, features)
+
+    def record(self, decision: RouteDecision, seconds: float, prompt_chars: int, answer_chars: int,
+               outcome: str = "ok"):
+        """Loggar beslutet med latens och kostnadsuppskattning (frågetexten loggas inte)."""
+        cost = estimate_cost(decision.model_name, prompt_chars, answer_chars) if outcome == "ok" else 0.0
+        with self._lock:
+            stats = self.stats[decision.route]
+            stats["requests"] += 1
+            stats["seconds"] += seconds
+            stats["cost_usd"] += cost
+        if not self.log_path:
+            return
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "route": decision.route,
+            "model": decision.model_name,
+            "k": decision.k,
+            "score": decision.score,
+            "features": decision.features,
+            "seconds": round(seconds, 3),
+            "prompt_chars": prompt_chars,
+            "answer_chars": answer_chars,
+            "cost_usd": cost,
+            "outcome": outcome,
+        }
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            self._buffer.append(line)
+            due = len(self._buffer) >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_seconds
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Skriver buffrade loggrader; frågorna väntar bara på listan, inte på filen."""
+        with self._write_lock:
+            with self._lock:
+                lines, self._buffer = self._buffer, []
+                self._last_flush = time.monotonic()
+            if lines and self.log_path:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write("".join(lines))
+
+    def report(self) -> Dict:
+        with self._lock:
+            return {
+                route: {**stats, "avg_seconds": stats["seconds"] / stats["requests"] if stats["requests"] else 0.0}
+                for route, stats in self.stats.items()
+            }
+
+
+query_router = QueryRouter(
+    simple_model=os.environ.get("ROUTER_SIMPLE_MODEL", "gemini-2.0-flash-lite"),
+    full_model=os.environ.get("ROUTER_FULL_MODEL", "gemini-2.0-flash"),
+    simple_k=int(os.environ.get("ROUTER_SIMPLE_K", "3")),
+)
+
+
+def summarize_log(path: str = DEFAULT_LOG_PATH) -> Dict[str, Dict]:
+    """Per route: antal, latens (p50/p95), genomsnittlig kostnad och hur ofta varje signal förekom."""
+    routes: Dict[str, List[Dict]] = defaultdict(list)
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                routes[entry["route"]].append(entry)
+    summary = {}
+    for route, entries in routes.items():
+        seconds = sorted(e["seconds"] for e in entries if e["outcome"] == "ok")
+
+        def percentile(p):
+            return seconds[min(int(p * len(seconds)), len(seconds) - 1)] if seconds else 0.0
+
+        summary[route] = {
+            "requests": len(entries),
+            "failed": sum(1 for e in entries if e["outcome"] != "ok"),
+            "p50_s": percentile(0.50),
+            "p95_s": percentile(0.95),
+            "avg_cost_usd": sum(e["cost_usd"] for e in entries) / len(entries),
+            "avg_words": sum(e["features"]["words"] for e in entries) / len(entries),
+            "avg_margin": sum(e["features"]["margin"] for e in entries) / len(entries),
+            "complex_cue_share": sum(e["features"]["complex_cue"] for e in entries) / len(entries),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sammanfatta routningsloggen.")
+    parser.add_argument("command", choices=["report"])
+    parser.add_argument("--log", default=DEFAULT_LOG_PATH)
+    args = parser.parse_args()
+    if not os.path.exists(args.log):
+        print(f"Ingen logg i '{args.log}' än.")
+        return
+    for route, stats in summarize_log(args.log).items():
+        print(f"{route:<7} {stats['requests']:>5} frågor ({stats['failed']} utan svar)  "
+              f"p50 {stats['p50_s']:.2f} s  p95 {stats['p95_s']:.2f} s  "
+              f"{stats['avg_cost_usd'] * 1000:.4f} USD/1000 frågor  "
+              f"ord {stats['avg_words']:.1f}  marginal {stats['avg_margin']:.3f}  "
+              f"ledtråd {stats['complex_cue_share']:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,10 @@
-import streamlit as st
 from typing import List, Dict
 import json
-import google.generativeai as genai
+from llm_utils import get_genai
 
 def create_embeddings(texts: List[str]) -> List[List[float]]:
     """Skapar embeddings för en lista av texter."""
-    genai.configure(api_key=st.secrets["API_KEY"])
+    genai = get_genai() # Klienten importeras och konfigureras först här
 
     embeddings = []
     for text in texts:
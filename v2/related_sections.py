@@ -0,0 +1,180 @@
+# related_sections.py
+"""
+Förberäknad kNN-graf "relaterade avsnitt" över alla chunks.
+
+För varje chunk sparas de M närmaste grannarna (cosinuslikhet) som int32-id och
+float16-likhet i related.npz bredvid embeddings.parquet i snapshotet. Appen slår
+sedan upp relaterade avsnitt för svarets träffar med en radindexering, utan extra
+sökningar per fråga.
+
+Grafen byggs med en blockad matrismultiplikation: ett block rader multipliceras
+mot ett block kolumner i taget och bara de M bästa per rad behålls mellan blocken,
+så minnet är begränsat till row_block x col_block likheter oavsett antalet chunks.
+Ett första, mindre kolumnblock ger varje rad en tröskel (dess M:e bästa likhet);
+i följande block slås bara likheter över tröskeln ihop, vilket är en liten andel.
+
+    python related_sections.py publish --m 8
+    python related_sections.py show 42
+"""
+import argparse
+import os
+import shutil
+import time
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+RELATED_FILE = "related.npz"
+DEFAULT_NEIGHBORS = 8
+
+
+def _normalized(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def build_neighbors(matrix: np.ndarray, m: int = DEFAULT_NEIGHBORS, row_block: int = 1024,
+                    col_block: int = 16384, normalized: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    De m närmaste grannarna till varje rad (raden själv utesluten), bäst först.
+    Returnerar (ids int32 (n, m), likheter float16 (n, m)). Används normalized=True
+    måste raderna redan vara enhetsvektorer (t.ex. VectorStore._normalized_matrix()).
+    """
+    matrix = matrix if normalized else _normalized(matrix)
+    n = len(matrix)
+    m = max(0, min(m, n - 1))
+    ids = np.empty((n, m), dtype=np.int32)
+    scores = np.empty((n, m), dtype=np.float16)
+    if m == 0:
+        return ids, scores
+
+    seed = min(n, max(col_block // 16, m + 1))
+    column_ranges = [(0, seed)] + [(c0, min(c0 + col_block, n)) for c0 in range(seed, n, col_block)]
+    for r0 in range(0, n, row_block):
+        rows = matrix[r0:r0 + row_block]
+        local = np.arange(len(rows))
+        best_scores = best_ids = None  # (rader, m), sorterade bäst först
+        for c0, c1 in column_ranges:
+            sims = rows @ matrix[c0:c1].T
+            own = r0 + local - c0  # Radens egen kolumn i blocket, om den finns där
+            inside = (own >= 0) & (own < sims.shape[1])
+            sims[local[inside], own[inside]] = -np.inf
+            if best_scores is None:
+                top = np.argpartition(sims, sims.shape[1] - m, axis=1)[:, -m:]
+                top_scores = np.take_along_axis(sims, top, axis=1)
+                order = np.argsort(-top_scores, axis=1, kind="stable")
+                best_scores = np.take_along_axis(top_scores, order, axis=1)
+                best_ids = np.take_along_axis(top, order, axis=1) + c0
+                continue
+            hit_rows, hit_cols = np.nonzero(sims > best_scores[:, -1:])
+            if not len(hit_rows):
+                continue
+            # Slå ihop nuvarande bästa med kandidaterna och behåll de m bästa per rad.
+            candidate_rows = np.concatenate([np.repeat(local, m), hit_rows])
+            candidate_scores = np.concatenate([best_scores.ravel(), sims[hit_rows, hit_cols]])
+            candidate_ids = np.concatenate([best_ids.ravel(), hit_cols + c0])
+            order = np.lexsort((-candidate_scores, candidate_rows))
+            take = np.searchsorted(candidate_rows[order], local)[:, None] + np.arange(m)
+            best_scores = candidate_scores[order][take]
+            best_ids = candidate_ids[order][take]
+        ids[r0:r0 + len(rows)] = best_ids
+        scores[r0:r0 + len(rows)] = best_scores
+    return ids, scores
+
+
+class RelatedSections:
+    def __init__(self, ids: np.ndarray, scores: np.ndarray):
+        self.ids = ids
+        self.scores = scores
+
+    def __len__(self):
+        return len(self.ids)
+
+    def neighbors(self, idx: int, limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        """[(radindex, likhet), ...] för en chunk, bäst först."""
+        ids, scores = self.ids[idx], self.scores[idx]
+        if limit is not None:
+            ids, scores = ids[:limit], scores[:limit]
+        return [(int(i), float(s)) for i, s in zip(ids, scores)]
+
+    def related_to(self, rows: Iterable[int], limit: int = 5, exclude: Iterable[int] = ()) -> List[Tuple[int, float]]:
+        """
+        Relaterade chunks till flera träffar (t.ex. ett svars kontext): grannarna slås ihop,
+        den högsta likheten per chunk behålls och chunks i exclude hoppas över.
+        """
+        excluded = set(exclude)
+        best = {}
+        for row in rows:
+            for neighbor, score in self.neighbors(row):
+                if neighbor not in excluded and score > best.get(neighbor, -1.0):
+                    best[neighbor] = score
+        return sorted(best.items(), key=lambda item: -item[1])[:limit]
+
+    def save(self, path: str):
+        np.savez(path, ids=self.ids, scores=self.scores)
+
+    @classmethod
+    def load(cls, path: str) -> "RelatedSections":
+        data = np.load(path)
+        return cls(data["ids"], data["scores"])
+
+    @classmethod
+    def build(cls, store, m: int = DEFAULT_NEIGHBORS, **kwargs) -> "RelatedSections":
+        return cls(*build_neighbors(store._normalized_matrix(), m, normalized=True, **kwargs))
+
+
+def main():
+    from index_snapshots import (DEFAULT_INDEX_ROOT, EMBEDDINGS_FILE, MANIFEST_FILE, commit_snapshot,
+                                 read_current_version, read_manifest, stage_snapshot)
+    from vector_store import VectorStore
+
+    parser = argparse.ArgumentParser(description="Bygg grafen över relaterade avsnitt för indexet.")
+    parser.add_argument("--root", default=DEFAULT_INDEX_ROOT)
+    sub = parser.add_subparsers(dest="command", required=True)
+    publish = sub.add_parser("publish", help="Publicera aktivt snapshot på nytt med grafen")
+    publish.add_argument("--m", type=int, default=DEFAULT_NEIGHBORS, help="Antal grannar per chunk")
+    publish.add_argument("--row-block", type=int, default=1024)
+    publish.add_argument("--col-block", type=int, default=16384)
+    show = sub.add_parser("show", help="Visa grannarna för en chunk i aktivt snapshot")
+    show.add_argument("idx", type=int)
+    args = parser.parse_args()
+
+    version = read_current_version(args.root)
+    if version is None:
+        raise SystemExit("Inget aktivt index; kör generate_and_save_embeddings.py först.")
+    version_dir = os.path.join(args.root, version)
+    store = VectorStore()
+    if not store.load(os.path.join(version_dir, EMBEDDINGS_FILE)):
+        raise SystemExit(f"Snapshot {version} saknar {EMBEDDINGS_FILE}")
+
+    if args.command == "show":
+        related = RelatedSections.load(os.path.join(version_dir, RELATED_FILE))
+        print(f"{store.metadata[args.idx].get('title')}:")
+        for neighbor, score in related.neighbors(args.idx):
+            print(f"  {score:.3f}  {store.metadata[neighbor].get('title')}")
+        return
+
+    start = time.perf_counter()
+    related = RelatedSections.build(store, args.m, row_block=args.row_block, col_block=args.col_block)
+    print(f"{len(related)} chunks x {args.m} grannar på {time.perf_counter() - start:.1f} s "
+          f"({(related.ids.nbytes + related.scores.nbytes) / 1024:.0f} kB).")
+    staging_dir = stage_snapshot(args.root)
+    try:
+        # Övriga filer (embeddings, ev. projektion) följer med oförändrade.
+        for name in os.listdir(version_dir):
+            if name not in (MANIFEST_FILE, RELATED_FILE):
+                shutil.copy2(os.path.join(version_dir, name), os.path.join(staging_dir, name))
+        related.save(os.path.join(staging_dir, RELATED_FILE))
+        manifest = read_manifest(args.root, version)
+        metadata = {key: value for key, value in manifest.items() if key not in ("version", "created_at", "files")}
+        new_version = commit_snapshot(staging_dir, {**metadata, "related_neighbors": args.m})
+    except Exception:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+    print(f"Publicerade version {new_version} med relaterade avsnitt.")
+
+
+if __name__ == "__main__":
+    main()
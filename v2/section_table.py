@@ -0,0 +1,236 @@
+# section_table.py
+"""
+Kompakt metadata för vektorindexet.
+
+Varje chunk i parquet-filen bär en hel parent_chain med {"chunk_id", "title"}-dictar,
+och samma kapitel och avsnitt upprepas i tusentals chunks. Här lagras i stället en
+gemensam sektionstabell (id, titel, förälder) där varje unik sektion finns en gång,
+och per chunk bara heltal i array-kolumner (sektionsrad, nivå, sidor). Dictar som
+ser ut som den ursprungliga metadatan byggs först när en chunk faktiskt efterfrågas,
+t.ex. för de k träffar som returneras.
+
+Filformatet är oförändrat; normaliseringen sker när indexet laddas.
+"""
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple
+
+CORE_FIELDS = ("chunk_id", "title", "level", "content", "parent_chain", "page_start", "page_end")
+
+
+class SectionTable:
+    """Unika sektioner som (id, titel, föräldrarad). Samma sektion under samma förälder lagras en gång."""
+
+    def __init__(self):
+        self.ids: List[Optional[str]] = []
+        self.titles: List[Optional[str]] = []
+        self.parents = array("i")  # -1 för sektioner utan förälder
+        self._rows: Dict[Tuple[Optional[str], Optional[str], int], int] = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def intern(self, chunk_id: Optional[str], title: Optional[str], parent: int = -1) -> int:
+        key = (chunk_id, title, parent)
+        row = self._rows.get(key)
+        if row is None:
+            row = len(self.ids)
+            self.ids.append(chunk_id)
+            self.titles.append(title)
+            self.parents.append(parent)
+            self._rows[key] = row
+        return row
+
+    def intern_chain(self, chain) -> int:
+        """Internerar en parent_chain (rot först) och returnerar raden för sista länken, eller -1."""
+        parent = -1
+        for link in chain or ():
+            parent = self.intern(link.get("chunk_id"), link.get("title"), parent)
+        return parent
+
+    def chain(self, row: int) -> List[Dict[str, str]]:
+        """parent_chain för en sektionsrad, rot först (raden själv ingår)."""
+        links = []
+        while row >= 0:
+            links.append({"chunk_id": self.ids[row], "title": self.titles[row]})
+            row = self.parents[row]
+        links.reverse()
+        return links
+
+
+class ChunkMetadata:
+    """
+    Listliknande behållare för chunk-metadata. Indexering ger en dict i samma format
+    som tidigare (chunk_id, title, level, content, parent_chain, ev. sidor och övriga
+    fält), men den byggs vid anropet i stället för att hållas i minnet för varje chunk.
+    """
+
+    def __init__(self, sections: Optional[SectionTable] = None, texts: Optional[List[str]] = None):
+        self.sections = sections or SectionTable()
+        self.texts = texts if texts is not None else []  # content lagras inte om den är lika med texten
+        self.fields: List[str] = []  # Fält som förekommer, i ursprunglig ordning
+        self.rows = array("i")  # Chunkens egen sektionsrad (id + titel + föräldrakedja)
+        self.levels: List[str] = []  # Internerade nivånamn
+        self.level_codes = array("b")
+        self.content_flags = array("b")  # 1 = content är lika med texten, 0 = inget content-fält
+        self.page_starts = array("i")  # -1 = saknas
+        self.page_ends = array("i")
+        self.extras: Dict[int, Dict] = {}  # Sällsynta fält (aliases, avvikande content ...) per chunk
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _add_field(self, name: str):
+        if name not in self.fields:
+            self.fields.append(name)
+
+    def _level_code(self, level: Optional[str]) -> int:
+        if level is None:
+            return -1
+        if level not in self.levels:
+            self.levels.append(level)
+        return self.levels.index(level)
+
+    def _append_row(self, chunk_id, title, level, parent_row, content_flag, page_start, page_end, extra):
+        self.rows.append(self.sections.intern(chunk_id, title, parent_row))
+        self.level_codes.append(self._level_code(level))
+        self.content_flags.append(content_flag)
+        self.page_starts.append(-1 if page_start is None else page_start)
+        self.page_ends.append(-1 if page_end is None else page_end)
+        if extra:
+            self.extras[len(self.rows) - 1] = extra
+
+    def append(self, metadata: Dict, text: Optional[str] = None):
+        """Lägger till en chunk från en metadata-dict (som Chunk.to_dict ger)."""
+        metadata = metadata or {}
+        for name in metadata:
+            self._add_field(name)
+        extra = {k: v for k, v in metadata.items() if k not in CORE_FIELDS and v is not None}
+        content = metadata.get("content")
+        content_flag = 0
+        if content is not None:
+            if content == text:
+                content_flag = 1
+            else:
+                extra["content"] = content
+        parent_row = self.sections.intern_chain(metadata.get("parent_chain"))
+        self._append_row(metadata.get("chunk_id"), metadata.get("title"), metadata.get("level"), parent_row,
+                         content_flag, metadata.get("page_start"), metadata.get("page_end"), extra)
+
+    @classmethod
+    def from_polars(cls, column, texts: List[str], content_is_text: bool = False) -> "ChunkMetadata":
+        """
+        Bygger metadatan direkt ur parquet-filens struct-kolumn, fält för fält, så att
+        ingen dict per chunk (eller per länk i parent_chain) skapas under laddningen.
+        Med content_is_text (komprimerade texter, se text_store.py) jämförs inte content
+        mot texterna; fältet pekar då alltid på texten.
+        """
+        import polars as pl
+
+        metadata = cls(texts=texts)
+        fields = [f.name for f in column.dtype.fields]
+        for name in fields:
+            metadata._add_field(name)
+
+        def field(name):
+            return column.struct.field(name).to_list() if name in fields else [None] * len(column)
+
+        chunk_ids, titles, levels = field("chunk_id"), field("title"), field("level")
+        page_starts, page_ends = field("page_start"), field("page_end")
+        content_equal = [False] * len(column)
+        content_present = [False] * len(column)
+        if "content" in fields and content_is_text:
+            content_present = content_equal = [True] * len(column)
+        elif "content" in fields:
+            content = column.struct.field("content")
+            content_present = content.is_not_null().to_list()
+            content_equal = (content == pl.Series(texts, dtype=pl.Utf8)).fill_null(False).to_list()
+
+        chain_ends = [-1] * len(column)
+        if "parent_chain" in fields:
+            links = (
+                pl.DataFrame({"chain": column.struct.field("parent_chain")})
+                .with_row_index("row")
+                .explode("chain")
+                .drop_nulls("chain")
+            )
+            link_fields = [f.name for f in links["chain"].dtype.fields] if isinstance(links["chain"].dtype, pl.Struct) else []
+
+            def link_field(name):
+                return links["chain"].struct.field(name).to_list() if name in link_fields else [None] * len(links)
+
+            # Om alla kedjor är tomma är kolumnen list[null] och inga länkar finns.
+            link_rows = links["row"].to_list() if link_fields else []
+            link_ids, link_titles = link_field("chunk_id"), link_field("title")
+            previous_row, parent = -1, -1
+            for row, link_id, link_title in zip(link_rows, link_ids, link_titles):
+                if row != previous_row:
+                    parent, previous_row = -1, row
+                parent = metadata.sections.intern(link_id, link_title, parent)
+                chain_ends[row] = parent
+
+        extra_fields = [name for name in fields if name not in CORE_FIELDS]
+        extra_columns = {name: column.struct.field(name).to_list() for name in extra_fields}
+        for i in range(len(column)):
+            extra = {}
+            for name, values in extra_columns.items():
+                if values[i] is not None:  # Bara sällsynta fält, t.ex. aliases från dedup.py
+                    extra[name] = values[i]
+            content_flag = 1 if content_equal[i] else 0
+            if content_present[i] and not content_equal[i]:
+                extra["content"] = column[i]["content"]
+            metadata._append_row(chunk_ids[i], titles[i], levels[i], chain_ends[i], content_flag,
+                                 page_starts[i], page_ends[i], extra)
+        return metadata
+
+    def decode(self, i: int) -> Dict:
+        row = self.rows[i]
+        decoded = {}
+        for name in self.fields:
+            if name == "chunk_id":
+                decoded[name] = self.sections.ids[row]
+            elif name == "title":
+                decoded[name] = self.sections.titles[row]
+            elif name == "level":
+                code = self.level_codes[i]
+                decoded[name] = self.levels[code] if code >= 0 else None
+            elif name == "content":
+                if self.content_flags[i]:
+                    decoded[name] = self.texts[i]
+                elif "content" in self.extras.get(i, {}):
+                    decoded[name] = self.extras[i]["content"]
+            elif name == "parent_chain":
+                decoded[name] = self.sections.chain(self.sections.parents[row])
+            elif name in ("page_start", "page_end"):
+                value = (self.page_starts if name == "page_start" else self.page_ends)[i]
+                if value >= 0:
+                    decoded[name] = value
+            elif name in self.extras.get(i, {}):
+                decoded[name] = self.extras[i][name]
+        return decoded
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._slice(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.decode(index)
+
+    def __iter__(self) -> Iterator[Dict]:
+        for i in range(len(self)):
+            yield self.decode(i)
+
+    def _slice(self, index: slice) -> "ChunkMetadata":
+        """Delmängd som delar sektionstabellen (används av sharded_store)."""
+        positions = range(len(self))[index]
+        part = ChunkMetadata(self.sections, self.texts[index])  # Komprimerade texter ger en vy, inte en kopia
+        part.fields = list(self.fields)
+        part.levels = list(self.levels)
+        part.rows = array("i", (self.rows[i] for i in positions))
+        part.level_codes = array("b", (self.level_codes[i] for i in positions))
+        part.content_flags = array("b", (self.content_flags[i] for i in positions))
+        part.page_starts = array("i", (self.page_starts[i] for i in positions))
+        part.page_ends = array("i", (self.page_ends[i] for i in positions))
+        part.extras = {new: self.extras[old] for new, old in enumerate(positions) if old in self.extras}
+        return part
@@ -0,0 +1,349 @@
+# sharded_store.py
+"""
+Shardat vektorindex med scatter-gather.
+
+Korpusen delas i N sammanhängande shards. Varje shard betjänas av en egen
+arbetsprocess (lokalt eller på en annan maskin) som lyssnar via
+multiprocessing.connection. Koordinatorn skickar frågan till alla shards,
+varje shard returnerar sina lokala top-k och koordinatorn heap-mergar dem till
+globala top-k. Resultatet har samma format som VectorStore.semantic_search.
+
+Shards laddar aktiv snapshot (CURRENT i index_snapshots.py) med texter och
+projektion från samma versionskatalog; den ensamma data/full_embeddings.parquet
+används bara om inga snapshots finns. Versionen bestäms när shards startar, så
+ett nytt index börjar användas först när shards startas om.
+
+Lokalt (en process per shard):
+    version, parquet_path = resolve_index()
+    store = ShardedVectorStore.launch_local(parquet_path, n_shards=4)
+
+Över flera maskiner, på varje nod:
+    python sharded_store.py serve --shard 0 --n-shards 4 --port 7000
+och i appen:
+    store = ShardedVectorStore([("nod-a", 7000), ("nod-b", 7000), ...])
+"""
+import argparse
+import heapq
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from multiprocessing.connection import Client, Listener, wait
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from index_snapshots import DEFAULT_INDEX_ROOT, EMBEDDINGS_FILE, legacy_version, read_current_version
+from projection import PROJECTION_FILE, Projection
+from text_store import TEXTS_FILE
+from vector_store import VectorStore, parquet_row_count
+
+DEFAULT_AUTHKEY = os.environ.get("VECTOR_SHARD_AUTHKEY", "ableton-rag").encode("utf-8")
+
+
+class SearchResults(list):
+    """
+    Vanlig resultatlista (samma format som VectorStore.semantic_search) med
+    flaggor för om svaret bygger på alla shards eller bara en del av dem.
+    """
+
+    def __init__(self, results=(), missing_shards: Sequence[int] = ()):
+        super().__init__(results)
+        self.missing_shards = list(missing_shards)
+
+    @property
+    def partial(self) -> bool:
+        return bool(self.missing_shards)
+
+
+def shard_bounds(n_items: int, n_shards: int, shard_index: int) -> Tuple[int, int]:
+    """Start- och slutindex (exklusivt) för en shard när n_items delas i n_shards sammanhängande delar."""
+    base, extra = divmod(n_items, n_shards)
+    start = shard_index * base + min(shard_index, extra)
+    return start, start + base + (1 if shard_index < extra else 0)
+
+
+def resolve_index(index_root: str = DEFAULT_INDEX_ROOT, legacy_path: Optional[str] = None,
+                  version: Optional[str] = None) -> Tuple[str, str]:
+    """
+    (version, parquet-sökväg) för indexet som shards ska ladda: angiven version, annars den
+    CURRENT pekar på, och legacy-filen bara om det inte finns någon snapshot (som IndexManager).
+    """
+    version = version or read_current_version(index_root)
+    if version:
+        return version, os.path.join(index_root, version, EMBEDDINGS_FILE)
+    if legacy_path and os.path.exists(legacy_path):
+        return legacy_version(legacy_path), legacy_path
+    raise FileNotFoundError(f"Inget aktivt index i '{index_root}' och ingen legacy-fil")
+
+
+def owns_rows(store: VectorStore) -> bool:
+    """Sant om storens vektorer inte pekar in i en större matris än storens egna rader."""
+    if not store.vectors:
+        return True
+    base = store.vectors[0]
+    while isinstance(base.base, np.ndarray):
+        base = base.base
+    return base.size <= len(store.vectors) * store.vectors[0].size
+
+
+def load_shard(parquet_path: str, shard_index: int, n_shards: int) -> Tuple[VectorStore, int]:
+    """
+    Laddar bara den här shardens rader ur indexet. Returnerar (store, globalt startindex).
+    Texter och projektion läses bredvid parquet-filen, dvs. ur samma snapshot.
+    """
+    if not os.path.exists(parquet_path):
+        raise FileNotFoundError(parquet_path)
+    start, end = shard_bounds(parquet_row_count(parquet_path), n_shards, shard_index)
+    text_store_path = os.path.join(os.path.dirname(os.path.abspath(parquet_path)), TEXTS_FILE)
+    shard = VectorStore()
+    if not shard.load(parquet_path, text_store_path, row_range=(start, end)):
+        raise FileNotFoundError(parquet_path)
+    if not owns_rows(shard):
+        # Vektorerna ska vara vyer i en matris med bara shardens rader, annars håller
+        # varje arbetsprocess hela korpusens embeddings i minnet.
+        shard.vectors = list(np.array(shard.vectors))
+    projection_path = os.path.join(os.path.dirname(os.path.abspath(parquet_path)), PROJECTION_FILE)
+    if os.path.exists(projection_path):
+        shard.set_projection(Projection.load(projection_path)) # Frågan projiceras i varje shard
+    shard._normalized_matrix() # Bygg matrisen direkt i stället för vid första frågan
+    return shard, start
+
+
+def _handle_connection(conn, store: VectorStore, offset: int):
+    """Besvarar frågor på en anslutning tills klienten stänger den."""
+    try:
+        while True:
+            message = conn.recv()
+            command, seq = message[0], message[1]
+            if command == "search":
+                query_embedding, k = message[2], message[3]
+                hits = [
+                    (score, offset + idx, store.texts[idx], store.metadata[idx])
+                    for idx, score in store.search(query_embedding, k)
+                ]
+                conn.send(("result", seq, hits))
+            elif command == "ping":
+                conn.send(("pong", seq, len(store)))
+    except (EOFError, OSError):
+        pass
+    finally:
+        conn.close()
+
+
+def serve_shard(parquet_path: str, shard_index: int, n_shards: int, address: Tuple[str, int],
+                authkey: bytes = DEFAULT_AUTHKEY, ready=None):
+    """Laddar en shard och betjänar frågor. Varje anslutning får en egen tråd (numpy släpper GIL)."""
+    store, offset = load_shard(parquet_path, shard_index, n_shards)
+    with Listener(address, authkey=authkey) as listener:
+        if ready is not None:
+            ready.send(listener.address)
+            ready.close()
+        print(f"Shard {shard_index}/{n_shards} ({len(store)} chunks) lyssnar på {listener.address}")
+        while True:
+            try:
+                conn = listener.accept()
+            except (EOFError, OSError):
+                continue  # T.ex. fel authkey; fortsätt lyssna
+            threading.Thread(target=_handle_connection, args=(conn, store, offset), daemon=True).start()
+
+
+class ShardedVectorStore:
+    """
+    Koordinator för scatter-gather-sökning över shards.
+
+    Långsamma shards hanteras med en tidsgräns per fråga och döda shards hoppas
+    över (med nytt anslutningsförsök efter `retry_interval`); en död lokal
+    arbetsprocess startas om i bakgrunden. I båda fallen returneras de resultat
+    som hann komma, och SearchResults.partial sätts.
+    """
+
+    def __init__(self, addresses: Sequence[Tuple[str, int]], authkey: bytes = DEFAULT_AUTHKEY,
+                 timeout: float = 2.0, retry_interval: float = 5.0):
+        self.addresses = list(addresses)
+        self.authkey = authkey
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self._local = threading.local()  # En anslutning per shard och tråd (Streamlit-session)
+        self._seq = itertools.count()
+        self._down_until: Dict[int, float] = {}
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * len(self.addresses)
+        self._launch_args: Optional[Tuple[str, str]] = None
+        self._restart_lock = threading.Lock()
+        self._restarting = set()  # Shards vars arbetsprocess startas om i bakgrunden
+
+    @classmethod
+    def launch_local(cls, parquet_path: str, n_shards: int = None, timeout: float = 2.0,
+                     authkey: bytes = DEFAULT_AUTHKEY) -> "ShardedVectorStore":
+        """Startar en arbetsprocess per shard på denna maskin (standard: en per kärna)."""
+        n_shards = n_shards or os.cpu_count() or 1
+        store = cls([None] * n_shards, authkey=authkey, timeout=timeout)
+        store._launch_args = (parquet_path, authkey)
+        for shard_index in range(n_shards):
+            store._start_local_worker(shard_index)
+        return store
+
+    @classmethod
+    def from_spec(cls, spec: str, parquet_path: Optional[str], timeout: float = 2.0) -> "ShardedVectorStore":
+        """Skapar en koordinator från t.ex. "local:4" eller "nod-a:7000,nod-b:7000"."""
+        if spec.startswith("local"):
+            _, _, count = spec.partition(":")
+            return cls.launch_local(parquet_path, int(count) if count else None, timeout=timeout)
+        addresses = []
+        for item in spec.split(","):
+            host, _, port = item.strip().rpartition(":")
+            addresses.append((host, int(port)))
+        return cls(addresses, timeout=timeout)
+
+    def _start_local_worker(self, shard_index: int):
+        parquet_path, authkey = self._launch_args
+        ctx = multiprocessing.get_context("spawn")
+        parent_conn, child_conn = ctx.Pipe(duplex=False)
+        process = ctx.Process(
+            target=serve_shard,
+            args=(parquet_path, shard_index, len(self.addresses), ("127.0.0.1", 0), authkey, child_conn),
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        self.addresses[shard_index] = parent_conn.recv()  # Väntar tills shardens data är laddad
+        self._processes[shard_index] = process
+
+    def close(self):
+        for process in self._processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+
+    def _connections(self) -> Dict[int, object]:
+        if not hasattr(self._local, "conns"):
+            self._local.conns = {}
+        return self._local.conns
+
+    def _connect(self, shard_index: int):
+        conns = self._connections()
+        if shard_index in conns:
+            return conns[shard_index]
+        if time.monotonic() < self._down_until.get(shard_index, 0.0):
+            return None
+        process = self._processes[shard_index]
+        if process is not None and not process.is_alive():
+            self._restart_in_background(shard_index)
+            return None
+        try:
+            conn = Client(self.addresses[shard_index], authkey=self.authkey)
+        except (OSError, EOFError) as e:
+            print(f"Kunde inte ansluta till shard {shard_index} på {self.addresses[shard_index]}: {e}")
+            self._down_until[shard_index] = time.monotonic() + self.retry_interval
+            return None
+        conns[shard_index] = conn
+        return conn
+
+    def _restart_in_background(self, shard_index: int):
+        """
+        Startar om en död lokal arbetsprocess i en egen tråd. Den nya processen laddar sin
+        shard innan den svarar, så frågorna under tiden får shardens träffar som saknade.
+        """
+        with self._restart_lock:
+            if shard_index in self._restarting:
+                return
+            self._restarting.add(shard_index)
+        print(f"Shard {shard_index} har dött, startar om arbetsprocessen...")
+
+        def restart():
+            try:
+                self._start_local_worker(shard_index)
+            except Exception as e:
+                print(f"Kunde inte starta om shard {shard_index}: {e}")
+                self._down_until[shard_index] = time.monotonic() + self.retry_interval
+            finally:
+                with self._restart_lock:
+                    self._restarting.discard(shard_index)
+
+        threading.Thread(target=restart, name=f"shard-{shard_index}-restart", daemon=True).start()
+
+    def _drop(self, shard_index: int):
+        conn = self._connections().pop(shard_index, None)
+        if conn is not None:
+            conn.close()
+        self._down_until[shard_index] = time.monotonic() + self.retry_interval
+
+    def semantic_search(self, query_embedding, k=15, adaptive=None) -> SearchResults:
+        seq = next(self._seq)
+        query = np.asarray(query_embedding, dtype=np.float32)
+        pending = {}
+        missing = []
+
+        # Scatter
+        for shard_index in range(len(self.addresses)):
+            conn = self._connect(shard_index)
+            if conn is None:
+                missing.append(shard_index)
+                continue
+            try:
+                conn.send(("search", seq, query, k))
+                pending[conn] = shard_index
+            except (OSError, EOFError):
+                self._drop(shard_index)
+                missing.append(shard_index)
+
+        # Gather
+        shard_hits = []
+        deadline = time.monotonic() + self.timeout
+        while pending:
+            remaining = deadline - time.monotonic()
+            ready = wait(list(pending), timeout=max(remaining, 0)) if remaining > 0 else []
+            if not ready:
+                break
+            for conn in ready:
+                shard_index = pending[conn]
+                try:
+                    _, reply_seq, hits = conn.recv()
+                except (OSError, EOFError):
+                    self._drop(shard_index)
+                    missing.append(shard_index)
+                    del pending[conn]
+                    continue
+                if reply_seq != seq:
+                    continue  # Sent svar på en tidigare fråga som tog för lång tid
+                shard_hits.append(hits)
+                del pending[conn]
+
+        # Shards som inte hann svara behåller anslutningen; deras sena svar kastas vid nästa fråga.
+        missing.extend(pending.values())
+
+        merged = heapq.merge(*shard_hits, key=lambda hit: hit[0], reverse=True)
+        results = [
+            {"text": text, "metadata": metadata, "similarity": score}
+            for score, _, text, metadata in itertools.islice(merged, k)
+        ]
+        if adaptive is not None:  # Samma urval som VectorStore.search, på den sammanslagna listan
+            results = results[: adaptive.select([r["similarity"] for r in results])]
+        return SearchResults(results, missing_shards=sorted(missing))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kör en shard-arbetsprocess för ShardedVectorStore.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve")
+    serve.add_argument("--index-root", default=DEFAULT_INDEX_ROOT)
+    serve.add_argument("--version", help="Ladda en viss snapshot i stället för den CURRENT pekar på")
+    serve.add_argument("--embeddings", help="Ladda en parquet-fil direkt i stället för en snapshot")
+    serve.add_argument("--legacy-embeddings", default=os.path.join("data", "full_embeddings.parquet"),
+                       help="Används bara om index-root saknar snapshots")
+    serve.add_argument("--shard", type=int, required=True)
+    serve.add_argument("--n-shards", type=int, required=True)
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, required=True)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        parquet_path = args.embeddings
+        if not parquet_path:
+            version, parquet_path = resolve_index(args.index_root, args.legacy_embeddings, args.version)
+            print(f"Index {version}: {parquet_path}")
+        serve_shard(parquet_path, args.shard, args.n_shards, (args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# startup_profile.py
+"""
+Mäter hur lång tid det tar att importera app.py:s beroenden, dvs. det varje
+Streamlit-worker betalar innan första sidan kan ritas.
+
+Importraderna på toppnivå i app.py plockas ut och körs i en ny Python-process,
+dels med `-X importtime` för en uppdelning per modul, dels utan för att mäta
+väggklocktiden (median av flera körningar). Med --check avslutas kommandot med
+felkod 1 om medianen överskrider budgeten, så det kan köras i CI:
+
+    python startup_profile.py
+    python startup_profile.py --check --budget-ms 800
+"""
+import argparse
+import ast
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+DEFAULT_BUDGET_MS = float(os.environ.get("STARTUP_BUDGET_MS", "1000"))
+
+
+def startup_imports(app_path: str = APP_PATH) -> str:
+    """Källkoden för entrypointens importsatser på toppnivå."""
+    with open(app_path, "r", encoding="utf-8") as f:
+        source = f.read()
+    tree = ast.parse(source)
+    statements = [
+        ast.get_source_segment(source, node)
+        for node in tree.body
+        if isinstance(node, (ast.Import, ast.ImportFrom))
+    ]
+    return "\n".join(statements)
+
+
+def _run(code: str, importtime: bool = False) -> Tuple[float, str]:
+    """Kör koden i en ny process. Returnerar (väggklocktid i ms, stderr)."""
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    start = time.perf_counter()
+    result = subprocess.run(command, cwd=os.path.dirname(APP_PATH), capture_output=True, text=True)
+    elapsed = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(f"Importen misslyckades:\n{result.stderr[-2000:]}")
+    return elapsed, result.stderr
+
+
+def measure_wall_time(code: str, runs: int = 5) -> List[float]:
+    """Väggklocktid för importerna minus en tom interpretatorstart, per körning."""
+    baseline = statistics.median(_run("pass")[0] for _ in range(runs))
+    return [_run(code)[0] - baseline for _ in range(runs)]
+
+
+def parse_importtime(stderr: str) -> List[Dict]:
+    """
+    Raderna från -X importtime som {"module", "self_us", "cumulative_us", "depth"}.
+    Djupet ges av indraget före modulnamnet (0 = importerad direkt av koden).
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        stripped = name.lstrip(" ")
+        rows.append({
+            "module": stripped.strip(),
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us),
+            "depth": (len(name) - len(stripped) - 1) // 2,
+        })
+    return rows
+
+
+def top_level_costs(rows: List[Dict]) -> List[Dict]:
+    """Direkta importer sorterade på kumulativ tid, dyrast först."""
+    return sorted((r for r in rows if r["depth"] == 0), key=lambda r: r["cumulative_us"], reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profilera importtiden för app.py.")
+    parser.add_argument("--app", default=APP_PATH)
+    parser.add_argument("--runs", type=int, default=5, help="Antal körningar för väggklocktiden")
+    parser.add_argument("--top", type=int, default=15, help="Antal moduler att visa")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS,
+                        help="Budget för medianen (standard: STARTUP_BUDGET_MS eller 1000)")
+    parser.add_argument("--check", action="store_true", help="Felkod 1 om budgeten överskrids")
+    args = parser.parse_args()
+
+    code = startup_imports(args.app)
+    print("Importer på toppnivå i app.py:")
+    print("    " + code.replace("\n", "\n    "))
+
+    # Moduler som interpretatorn själv laddar (site, encodings ...) räknas inte.
+    interpreter_modules = {r["module"] for r in parse_importtime(_run("pass", importtime=True)[1])}
+    _, stderr = _run(code, importtime=True)
+    rows = [r for r in parse_importtime(stderr) if r["module"] not in interpreter_modules]
+    print(f"\n{'modul':<40} {'kumulativt ms':>14} {'eget ms':>9}")
+    for row in top_level_costs(rows)[: args.top]:
+        print(f"{row['module']:<40} {row['cumulative_us'] / 1000:>14.1f} {row['self_us'] / 1000:>9.1f}")
+    print(f"{len(rows)} moduler importerade.")
+
+    for heavy in ("google.generativeai", "polars", "pyarrow", "multiprocessing.connection"):
+        if any(r["module"] == heavy for r in rows):
+            print(f"Varning: {heavy} importeras vid start.")
+
+    timings = measure_wall_time(code, args.runs)
+    median = statistics.median(timings)
+    print(f"\nImporttid (median av {args.runs}): {median:.0f} ms "
+          f"(min {min(timings):.0f}, max {max(timings):.0f}); budget {args.budget_ms:.0f} ms.")
+    if args.check and median > args.budget_ms:
+        print("Budgeten överskriden.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+# stub_servers.py
+"""
+Lokala stand-in-servrar som efterliknar Gemini REST-API:t (embedContent,
+generateContent, streamGenerateContent och cachedContents) så att pipelinen kan
+lasttestas helt utan nätverk.
+
+streamGenerateContent skickar svaret i delar om --stream-chunk-tokens tokens, som SSE
+(?alt=sse) eller som en strömmad JSON-array, med --chunk-latency (plus tiden per
+output-token) mellan delarna. Stänger klienten anslutningen slutar servern skicka och
+räknar "stream_cancelled", så hedging och tidig avbrytning kan testas offline.
+
+Latens, fel och rate limits kan konfigureras per server:
+    python stub_servers.py --port 8765 --latency lognormal:40:0.5 --error-rate 0.01 --rate-limit-rps 50
+    python stub_servers.py --latency const:300 --chunk-latency lognormal:30:0.5 --stream-chunk-tokens 16
+"""
+import argparse
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+EMBEDDING_DIM = 768
+
+
+class LatencyModel:
+    """
+    Latensfördelning angiven som sträng (alla tider i millisekunder):
+    - "const:50"            alltid 50 ms
+    - "uniform:20:80"       likformigt mellan 20 och 80 ms
+    - "normal:50:10"        normalfördelad, medel 50 ms, std 10 ms
+    - "lognormal:50:0.5"    lognormal med median 50 ms och sigma 0.5 (lång svans)
+    """
+
+    def __init__(self, spec: str = "const:0"):
+        self.spec = spec
+        parts = spec.split(":")
+        self.kind = parts[0]
+        self.params = [float(p) for p in parts[1:]]
+        if self.kind not in ("const", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Okänd latensfördelning: {spec}")
+        self._rng = random.Random()
+
+    def sample(self) -> float:
+        """Returnerar en latens i sekunder."""
+        if self.kind == "const":
+            ms = self.params[0]
+        elif self.kind == "uniform":
+            ms = self._rng.uniform(self.params[0], self.params[1])
+        elif self.kind == "normal":
+            ms = self._rng.gauss(self.params[0], self.params[1])
+        else:
+            ms = self._rng.lognormvariate(np.log(max(self.params[0], 1e-6)), self.params[1])
+        return max(ms, 0.0) / 1000.0
+
+
+class TokenBucket:
+    """Enkel token bucket för att simulera kvoter (anrop per sekund)."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return True
+            return False
+
+
+class StubConfig:
+    def __init__(
+        self,
+        latency: str = "const:0",
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        rate_limit_rps: float = 0.0,
+        ms_per_output_token: float = 0.0,
+        output_tokens: int = 200,
+        ms_per_prompt_token: float = 0.0,
+        chunk_latency: str = "const:0",
+        stream_chunk_tokens: int = 20,
+        embed_latency: Optional[str] = None,
+        embed_rate_limit_rps: float = 0.0,
+    ):
+        self.latency = LatencyModel(latency)
+        self.error_rate = error_rate  # Andel anrop som får 500
+        self.rate_limit_rate = rate_limit_rate  # Andel anrop som slumpmässigt får 429
+        self.bucket = TokenBucket(rate_limit_rps) if rate_limit_rps > 0 else None
+        self.ms_per_output_token = ms_per_output_token
+        self.output_tokens = output_tokens
+        self.ms_per_prompt_token = ms_per_prompt_token  # Debiteras bara för tokens som inte ligger i cachen
+        self.chunk_latency = LatencyModel(chunk_latency)  # Extra väntan före varje strömmad del utom den första
+        self.stream_chunk_tokens = max(1, stream_chunk_tokens)
+        # Egen latens och kvot för embedding-anrop, så en server kan spela både embedding- och generate-API:t.
+        self.embed_latency = LatencyModel(embed_latency) if embed_latency else self.latency
+        self.embed_bucket = TokenBucket(embed_rate_limit_rps) if embed_rate_limit_rps > 0 else self.bucket
+
+
+def stub_embedding(text: str, dim: int = EMBEDDING_DIM) -> List[float]:
+    """Deterministisk pseudo-embedding: samma text ger alltid samma normaliserade vektor."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vec = np.random.default_rng(seed).standard_normal(dim)
+    return (vec / np.linalg.norm(vec)).tolist()
+
+
+def estimate_tokens(text: str) -> int:
+    """Grov uppskattning (ca 4 tecken per token), räcker för statistik."""
+    return max(1, len(text) // 4)
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # Tysta access-loggen
+        pass
+
+    def _send_json(self, status: int, payload: Dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: int, grpc_status: str, message: str):
+        self._send_json(status, {"error": {"code": status, "message": message, "status": grpc_status}})
+
+    def do_GET(self):
+        if self.path.rstrip("/") in ("", "/health", "/healthz"):
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_error(404, "NOT_FOUND", f"Okänd sökväg: {self.path}")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_error(400, "INVALID_ARGUMENT", "Ogiltig JSON")
+            return
+
+        config: StubConfig = self.server.stub_config
+        self.server.count("requests")
+        path = self.path.split("?")[0]
+        embed = path.endswith(":embedContent") or path.endswith(":batchEmbedContents")
+        bucket = config.embed_bucket if embed else config.bucket
+
+        # Rate limit kontrolleras innan "arbetet", precis som en riktig kvot.
+        if (bucket is not None and not bucket.try_acquire()) or (
+            config.rate_limit_rate and random.random() < config.rate_limit_rate
+        ):
+            self.server.count("rate_limited")
+            self._send_error(429, "RESOURCE_EXHAUSTED", "Resource has been exhausted (e.g. check quota).")
+            return
+
+        time.sleep((config.embed_latency if embed else config.latency).sample())
+
+        if config.error_rate and random.random() < config.error_rate:
+            self.server.count("errors")
+            self._send_error(500, "INTERNAL", "An internal error has occurred.")
+            return
+
+        if path.rstrip("/").endswith("/cachedContents"):
+            self._send_json(200, self._create_cached_content(payload))
+        elif path.endswith(":embedContent"):
+            self._send_json(200, self._embed(payload))
+        elif path.endswith(":batchEmbedContents"):
+            self._send_json(200, {"embeddings": [self._embed(r)["embedding"] for r in payload.get("requests", [])]})
+        elif path.endswith(":generateContent") or path.endswith(":streamGenerateContent"):
+            cache_name = payload.get("cachedContent")
+            if cache_name and cache_name not in self.server.cached_contents:
+                self._send_error(404, "NOT_FOUND", f"CachedContent not found: {cache_name}")
+                return
+            if path.endswith(":streamGenerateContent"):
+                self._stream(payload, config, sse="alt=sse" in self.path)
+            else:
+                self._send_json(200, self._generate(payload, config))
+        else:
+            self._send_error(404, "NOT_FOUND", f"Okänd sökväg: {self.path}")
+
+    @staticmethod
+    def _content_text(content: Dict) -> str:
+        return "".join(part.get("text", "") for part in content.get("parts", []))
+
+    def _embed(self, payload: Dict) -> Dict:
+        text = self._content_text(payload.get("content", {}))
+        return {"embedding": {"values": stub_embedding(text)}}
+
+    def _create_cached_content(self, payload: Dict) -> Dict:
+        """Efterliknar POST /v1beta/cachedContents: prefixet räknas en gång och sparas under ett namn."""
+        text = self._content_text(payload.get("systemInstruction", {})) + "".join(
+            self._content_text(c) for c in payload.get("contents", [])
+        )
+        tokens = estimate_tokens(text)
+        name = f"cachedContents/{hashlib.sha256(text.encode('utf-8')).hexdigest()[:12]}"
+        self.server.cached_contents[name] = tokens
+        return {"name": name, "model": payload.get("model", ""), "usageMetadata": {"totalTokenCount": tokens}}
+
+    def _prompt_tokens(self, payload: Dict, config: StubConfig) -> Tuple[int, int]:
+        """(promptTokens, cachade tokens); väntar ms_per_prompt_token för de tokens som inte är cachade."""
+        prompt = "".join(self._content_text(c) for c in payload.get("contents", []))
+        system = self._content_text(payload.get("systemInstruction", {}))
+        cached_tokens = self.server.cached_contents.get(payload.get("cachedContent"), 0)
+        new_tokens = estimate_tokens(system + prompt)
+        if config.ms_per_prompt_token:
+            time.sleep(config.ms_per_prompt_token * new_tokens / 1000.0)
+        return cached_tokens + new_tokens, cached_tokens
+
+    @staticmethod
+    def _response(text: str, prompt_tokens: int, cached_tokens: int, output_tokens: int,
+                  finish_reason: Optional[str] = "STOP") -> Dict:
+        candidate = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+        if finish_reason:
+            candidate["finishReason"] = finish_reason
+        return {
+            "candidates": [candidate],
+            "usageMetadata": {
+                "promptTokenCount": prompt_tokens,
+                "cachedContentTokenCount": cached_tokens,
+                "candidatesTokenCount": output_tokens,
+                "totalTokenCount": prompt_tokens + output_tokens,
+            },
+        }
+
+    @staticmethod
+    def _answer_words(prompt_tokens: int, output_tokens: int) -> List[str]:
+        """Svarstexten som ord (ungefär ett ord per token)."""
+        return f"Stub answer ({prompt_tokens} prompt tokens).".split() + ["lorem"] * max(output_tokens - 5, 0)
+
+    def _generate(self, payload: Dict, config: StubConfig) -> Dict:
+        prompt_tokens, cached_tokens = self._prompt_tokens(payload, config)
+        output_tokens = config.output_tokens
+        if config.ms_per_output_token:
+            time.sleep(config.ms_per_output_token * output_tokens / 1000.0)
+        text = " ".join(self._answer_words(prompt_tokens, output_tokens))
+        return self._response(text, prompt_tokens, cached_tokens, output_tokens)
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream(self, payload: Dict, config: StubConfig, sse: bool):
+        """
+        Efterliknar :streamGenerateContent med chunked transfer encoding: SSE-händelser
+        ("data: {...}") eller en JSON-array vars element skickas allt eftersom.
+        """
+        prompt_tokens, cached_tokens = self._prompt_tokens(payload, config)
+        words = self._answer_words(prompt_tokens, config.output_tokens)
+        size = config.stream_chunk_tokens
+        parts = [words[i:i + size] for i in range(0, len(words), size)]
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream" if sse else "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        sent_tokens = 0
+        try:
+            for i, part in enumerate(parts):
+                if i:
+                    time.sleep(config.chunk_latency.sample())
+                if config.ms_per_output_token:
+                    time.sleep(config.ms_per_output_token * len(part) / 1000.0)
+                sent_tokens += len(part)
+                last = i == len(parts) - 1
+                text = (" " if i else "") + " ".join(part)
+                event = json.dumps(self._response(text, prompt_tokens, cached_tokens, sent_tokens,
+                                                  "STOP" if last else None))
+                if sse:
+                    data = f"data: {event}\r\n\r\n"
+                else:
+                    # Avgränsaren skickas direkt efter elementet, så klienten kan tolka det utan att vänta på nästa.
+                    data = ("[" if i == 0 else "") + event + ("]" if last else ",\r\n")
+                self._write_chunk(data.encode("utf-8"))
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # Klienten avbröt (t.ex. ett hedge-försök vann); resten av svaret genereras inte.
+            self.server.count("stream_cancelled")
+            self.close_connection = True
+            return
+        self.server.count("streams")
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], config: StubConfig):
+        super().__init__(address, StubRequestHandler)
+        self.stub_config = config
+        self.cached_contents: Dict[str, int] = {}  # namn -> antal cachade prompt-tokens
+        self.counters: Dict[str, int] = {}
+        self._counter_lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return  # Klienten stängde anslutningen, t.ex. efter en avbruten ström
+        super().handle_error(request, client_address)
+
+    def count(self, name: str):
+        with self._counter_lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_stub_server(config: Optional[StubConfig] = None, host: str = "127.0.0.1", port: int = 0) -> StubServer:
+    """Startar en stub-server i en bakgrundstråd. port=0 ger en ledig port."""
+    server = StubServer((host, port), config or StubConfig())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lokal stub för Gemini embedding- och generate-API:t.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="lognormal:50:0.4", help="Latensfördelning, t.ex. const:50 eller lognormal:50:0.4")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Andel anrop som slumpmässigt får 429")
+    parser.add_argument("--rate-limit-rps", type=float, default=0.0, help="Kvot i anrop per sekund (0 = obegränsad)")
+    parser.add_argument("--ms-per-output-token", type=float, default=0.0)
+    parser.add_argument("--output-tokens", type=int, default=200)
+    parser.add_argument("--ms-per-prompt-token", type=float, default=0.0)
+    parser.add_argument("--chunk-latency", default="const:0",
+                        help="Latens mellan strömmade delar i streamGenerateContent, t.ex. lognormal:30:0.5")
+    parser.add_argument("--stream-chunk-tokens", type=int, default=20, help="Tokens per strömmad del")
+    args = parser.parse_args()
+
+    config = StubConfig(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        rate_limit_rps=args.rate_limit_rps,
+        ms_per_output_token=args.ms_per_output_token,
+        output_tokens=args.output_tokens,
+        ms_per_prompt_token=args.ms_per_prompt_token,
+        chunk_latency=args.chunk_latency,
+        stream_chunk_tokens=args.stream_chunk_tokens,
+    )
+    server = StubServer((args.host, args.port), config)
+    print(f"Stub-server lyssnar på {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Räknare: {server.counters}")
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
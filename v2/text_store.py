@@ -0,0 +1,295 @@
+# text_store.py
+"""
+Komprimerad lagring av chunk-texterna med dekomprimering vid behov.
+
+Vid VectorStore.load hamnade tidigare alla texter i minnet som Python-strängar, fast
+en fråga bara behöver de k som returneras. Här lagras texterna i zstd-block (några
+texter per block) komprimerade med en tränad ordbok, och ett offsetindex pekar ut
+varje text. Filen mappas med mmap, så bara de block som faktiskt läses blir
+residenta; dekomprimerade texter hålls i en liten LRU-cache.
+
+Filformat (texts.zst i snapshotet):
+    MAGIC | uint64 längd på header | header (JSON) | ordbok | blockoffsets (uint64, n_block + 1)
+          | blockstorlekar okomprimerat (uint32) | textstarter i blocket (uint32, en per text) | zstd-frames
+
+    python text_store.py report
+    python text_store.py publish
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Set
+
+import numpy as np
+
+TEXTS_FILE = "texts.zst"
+MAGIC = b"ZTEXTS01"
+DEFAULT_BLOCK_SIZE = 8  # Texter per block
+DEFAULT_DICT_SIZE = 64 * 1024
+DEFAULT_CACHE_SIZE = int(os.environ.get("TEXT_CACHE_SIZE", "256"))
+
+_open_views: "weakref.WeakSet[CompressedTextStore]" = weakref.WeakSet()  # Vyer som håller en mappning
+
+
+def mapped_paths() -> Set[str]:
+    """Absoluta sökvägar till filer som någon vy i den här processen fortfarande mappar."""
+    return {os.path.abspath(view.path) for view in list(_open_views)}
+
+
+def text_id(text: str) -> str:
+    """Kort, stabilt id för en chunk: samma text ger samma id i alla indexbyggen."""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:12]
+
+
+def write_text_store(texts: List[str], path: str, block_size: int = DEFAULT_BLOCK_SIZE,
+                     dict_size: int = DEFAULT_DICT_SIZE, level: int = 19, content_is_text: bool = False) -> Dict:
+    """
+    Komprimerar texterna till path. content_is_text anger att metadatans content-fält
+    är identiskt med texten för varje chunk, så att det inte behöver läsas vid laddning.
+    Returnerar headern (med storlekar).
+    """
+    import zstandard as zstd
+
+    encoded = [text.encode("utf-8") for text in texts]
+    blocks = [encoded[i:i + block_size] for i in range(0, len(encoded), block_size)]
+    dictionary = b""
+    try:
+        # Ordboken tränas på texterna; små korpusar kan sakna underlag och klarar sig utan.
+        dictionary = zstd.train_dictionary(min(dict_size, max(sum(map(len, encoded)) // 10, 1024)), encoded).as_bytes()
+    except zstd.ZstdError:
+        pass
+    compressor = zstd.ZstdCompressor(level=level, dict_data=zstd.ZstdCompressionDict(dictionary) if dictionary else None)
+
+    frames, block_sizes, text_starts = [], [], []
+    for block in blocks:
+        position = 0
+        for text in block:
+            text_starts.append(position)
+            position += len(text)
+        block_sizes.append(position)
+        frames.append(compressor.compress(b"".join(block)))
+    block_offsets = np.zeros(len(frames) + 1, dtype=np.uint64)
+    block_offsets[1:] = np.cumsum([len(frame) for frame in frames], dtype=np.uint64)
+
+    header = {
+        "n_texts": len(texts),
+        "block_size": block_size,
+        "n_blocks": len(frames),
+        "dict_bytes": len(dictionary),
+        "raw_bytes": sum(map(len, encoded)),
+        "compressed_bytes": int(block_offsets[-1]),
+        "content_is_text": content_is_text,
+    }
+    header_bytes = json.dumps(header).encode("utf-8")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        f.write(dictionary)
+        f.write(block_offsets.tobytes())
+        f.write(np.asarray(block_sizes, dtype=np.uint32).tobytes())
+        f.write(np.asarray(text_starts, dtype=np.uint32).tobytes())
+        for frame in frames:
+            f.write(frame)
+    os.replace(tmp_path, path)
+    return header
+
+
+class CompressedTextStore:
+    """
+    Listliknande, skrivskyddad vy över texts.zst. store[i] dekomprimerar bara det block
+    som innehåller text i (eller tar den från LRU-cachen); en slice ger en vy som delar
+    filen, t.ex. för en shard.
+    """
+
+    def __init__(self, path: str, cache_size: int = DEFAULT_CACHE_SIZE):
+        import zstandard as zstd
+
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"'{path}' är inte en komprimerad textfil")
+        position = len(MAGIC)
+        (header_len,) = struct.unpack_from("<Q", self._mmap, position)
+        position += 8
+        self.header = json.loads(self._mmap[position:position + header_len])
+        position += header_len
+        n_texts, n_blocks = self.header["n_texts"], self.header["n_blocks"]
+        dictionary = self._mmap[position:position + self.header["dict_bytes"]]
+        position += self.header["dict_bytes"]
+        # Offsetindexen läses direkt ur mappningen utan kopiering.
+        self.block_offsets = np.frombuffer(self._mmap, dtype=np.uint64, count=n_blocks + 1, offset=position)
+        position += 8 * (n_blocks + 1)
+        self.block_sizes = np.frombuffer(self._mmap, dtype=np.uint32, count=n_blocks, offset=position)
+        position += 4 * n_blocks
+        self.text_starts = np.frombuffer(self._mmap, dtype=np.uint32, count=n_texts, offset=position)
+        position += 4 * n_texts
+        self._data_offset = position
+        self._dict = zstd.ZstdCompressionDict(dictionary) if dictionary else None
+        self._zstd = zstd
+        self._local = threading.local()  # En dekompressor per tråd; de är inte trådsäkra
+        self.block_size = self.header["block_size"]
+        self.content_is_text = self.header.get("content_is_text", False)
+        self._start, self._stop = 0, n_texts  # Vyns intervall i filen
+        self._cache: "OrderedDict[int, str]" = OrderedDict()
+        self._cache_size = cache_size
+        _open_views.add(self)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    @classmethod
+    def open(cls, path: str, cache_size: int = DEFAULT_CACHE_SIZE) -> "CompressedTextStore":
+        return cls(path, cache_size)
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def _decompressor(self):
+        decompressor = getattr(self._local, "decompressor", None)
+        if decompressor is None:
+            decompressor = self._zstd.ZstdDecompressor(dict_data=self._dict) if self._dict else self._zstd.ZstdDecompressor()
+            self._local.decompressor = decompressor
+        return decompressor
+
+    def _block(self, block: int) -> bytes:
+        start = self._data_offset + int(self.block_offsets[block])
+        end = self._data_offset + int(self.block_offsets[block + 1])
+        return self._decompressor().decompress(self._mmap[start:end], max_output_size=int(self.block_sizes[block]))
+
+    def _text(self, i: int, block_data: Optional[bytes] = None) -> str:
+        """Text i (index i filen, inte i vyn)."""
+        block = i // self.block_size
+        if block_data is None:
+            block_data = self._block(block)
+        start = self.text_starts[i]
+        last_in_block = i + 1 == min((block + 1) * self.block_size, self.header["n_texts"])
+        end = self.block_sizes[block] if last_in_block else self.text_starts[i + 1]
+        return block_data[start:end].decode("utf-8")
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._slice(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        i = self._start + index
+        with self._lock:
+            text = self._cache.get(i)
+            if text is not None:
+                self._cache.move_to_end(i)
+                self.stats["hits"] += 1
+                return text
+            self.stats["misses"] += 1
+        text = self._text(i)
+        with self._lock:
+            self._cache[i] = text
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return text
+
+    def __iter__(self) -> Iterator[str]:
+        """Alla texter i ordning, ett block i taget och utan att fylla cachen."""
+        block_data, current = None, -1
+        for i in range(self._start, self._stop):
+            if i // self.block_size != current:
+                current = i // self.block_size
+                block_data = self._block(current)
+            yield self._text(i, block_data)
+
+    def _slice(self, index: slice):
+        start, stop, step = index.indices(len(self))
+        if step != 1:
+            return [self[i] for i in range(start, stop, step)]
+        view = object.__new__(CompressedTextStore)
+        view.__dict__.update(self.__dict__)
+        view._start, view._stop = self._start + start, self._start + max(start, stop)
+        view._cache = OrderedDict()
+        view._lock = threading.Lock()
+        view.stats = {"hits": 0, "misses": 0}
+        _open_views.add(view)
+        return view
+
+    def report(self) -> Dict:
+        return {
+            "texts": len(self),
+            "raw_bytes": self.header["raw_bytes"],
+            "compressed_bytes": self.header["compressed_bytes"] + self.header["dict_bytes"],
+            "cached": len(self._cache),
+            **self.stats,
+        }
+
+
+def content_is_text(store) -> bool:
+    """Sant om ingen chunk har ett content-fält som skiljer sig från texten (se ChunkMetadata.extras)."""
+    return not any("content" in extra for extra in store.metadata.extras.values())
+
+
+def write_for_store(store, path: str, **kwargs) -> Dict:
+    return write_text_store(list(store.texts), path, content_is_text=content_is_text(store), **kwargs)
+
+
+def main():
+    import time
+
+    from index_snapshots import (DEFAULT_INDEX_ROOT, EMBEDDINGS_FILE, MANIFEST_FILE, commit_snapshot,
+                                 read_current_version, read_manifest, stage_snapshot)
+    from vector_store import VectorStore
+
+    parser = argparse.ArgumentParser(description="Komprimera indexets texter med zstd och en tränad ordbok.")
+    parser.add_argument("--root", default=DEFAULT_INDEX_ROOT)
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE)
+    parser.add_argument("--dict-size", type=int, default=DEFAULT_DICT_SIZE)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("report", help="Komprimeringsgrad och läshastighet för aktivt index")
+    sub.add_parser("publish", help="Publicera aktivt snapshot på nytt med komprimerade texter")
+    args = parser.parse_args()
+
+    version = read_current_version(args.root)
+    if version is None:
+        raise SystemExit("Inget aktivt index; kör generate_and_save_embeddings.py först.")
+    version_dir = os.path.join(args.root, version)
+    store = VectorStore()
+    if not store.load(os.path.join(version_dir, EMBEDDINGS_FILE)):
+        raise SystemExit(f"Snapshot {version} saknar {EMBEDDINGS_FILE}")
+
+    staging_dir = stage_snapshot(args.root)
+    try:
+        start = time.perf_counter()
+        header = write_for_store(store, os.path.join(staging_dir, TEXTS_FILE), block_size=args.block_size,
+                                 dict_size=args.dict_size)
+        print(f"{header['n_texts']} texter: {header['raw_bytes'] / 1e6:.2f} MB -> "
+              f"{(header['compressed_bytes'] + header['dict_bytes']) / 1e6:.2f} MB "
+              f"(ordbok {header['dict_bytes'] / 1024:.0f} kB) på {time.perf_counter() - start:.1f} s.")
+        if args.command == "report":
+            texts = CompressedTextStore.open(os.path.join(staging_dir, TEXTS_FILE), cache_size=0)
+            rows = np.random.default_rng(0).integers(0, len(texts), size=min(1000, len(texts)))
+            start = time.perf_counter()
+            for row in rows:
+                texts[int(row)]
+            print(f"Slumpvis läsning: {(time.perf_counter() - start) / len(rows) * 1e6:.0f} µs per text (utan cache).")
+            shutil.rmtree(staging_dir)
+            return
+        for name in os.listdir(version_dir):
+            if name not in (MANIFEST_FILE, TEXTS_FILE):
+                shutil.copy2(os.path.join(version_dir, name), os.path.join(staging_dir, name))
+        manifest = read_manifest(args.root, version)
+        metadata = {key: value for key, value in manifest.items() if key not in ("version", "created_at", "files")}
+        new_version = commit_snapshot(staging_dir, {**metadata, "compressed_texts": True})
+    except Exception:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+    print(f"Publicerade version {new_version} med komprimerade texter.")
+
+
+if __name__ == "__main__":
+    main()
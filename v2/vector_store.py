@@ -1,64 +1,213 @@
 import numpy as np
-import polars as pl
 import os # Lade till denna import
+from typing import Optional, Tuple
+
+from section_table import ChunkMetadata
+
+
+def parquet_row_count(file_path: str) -> int:
+    """Antal rader i en parquet-fil, ur filens metadata utan att läsa kolumnerna."""
+    import polars as pl
+
+    return pl.scan_parquet(file_path).select(pl.len()).collect().item()
+
+
+class AdaptiveK:
+    """
+    Väljer antalet träffar ur likhetsfördelningen i stället för ett fast k:
+    - träffar under min_similarity räknas inte; klarar ingen golvet finns ingen relevant kontext,
+    - listan kapas vid största glappet ("armbågen") mellan två på varandra följande
+      likheter, om glappet är minst min_gap,
+    - k i search/semantic_search är taket.
+    Med en projektion (projection.py) mäts likheterna i det projicerade rummet; justera golvet därefter.
+    """
+
+    def __init__(self, min_similarity=0.45, min_gap=0.05, min_k=1):
+        self.min_similarity = min_similarity
+        self.min_gap = min_gap
+        self.min_k = min_k
+
+    def select(self, scores):
+        """Antal träffar att behålla ur likheter sorterade bäst först (0 = ingen relevant kontext)."""
+        n = 0
+        while n < len(scores) and scores[n] >= self.min_similarity:
+            n += 1
+        if n <= self.min_k:
+            return n
+        gaps = [scores[i] - scores[i + 1] for i in range(self.min_k - 1, n - 1)]
+        largest = max(range(len(gaps)), key=gaps.__getitem__)
+        if gaps[largest] >= self.min_gap:
+            return self.min_k + largest
+        return n
+
+adaptive_k = AdaptiveK(
+    min_similarity=float(os.environ.get("ADAPTIVE_MIN_SIMILARITY", "0.45")),
+    min_gap=float(os.environ.get("ADAPTIVE_MIN_GAP", "0.05")),
+)
 
 class VectorStore:
     def __init__(self):
         self.vectors = []
         self.texts = []
-        self.metadata = []
+        self.metadata = ChunkMetadata(texts=self.texts) # Dictar byggs först när en chunk efterfrågas
+        self._matrix = None  # Normaliserad (n, dim)-matris, byggs vid första sökningen
+        self.projection = None  # Valfri projection.Projection; vektorerna lagras då i reducerad dimension
+        self.related = None  # Valfri related_sections.RelatedSections, förberäknade grannar per chunk
+        self.hierarchy = None  # Valfri hierarchical_search.HierarchicalIndex; söker då bara i de bästa kapitlen
+
+    def __len__(self):
+        return len(self.texts)
 
     def add_item(self, text, embedding, metadata=None):
+        if self.projection is not None:
+            embedding = self.projection.project(embedding)
         self.vectors.append(np.array(embedding))
         self.texts.append(text)
-        self.metadata.append(metadata or {})
+        self.metadata.append(metadata or {}, text)
+        self._matrix = None
 
+    def set_projection(self, projection):
+        """Projicerar alla lagrade vektorer; frågor projiceras sedan på samma sätt i search."""
+        if self.vectors:
+            self.vectors = list(projection.project(np.vstack(self.vectors)))
+        self.projection = projection
+        self._matrix = None
 
-    def semantic_search(self, query_embedding, k=15):
+    def project_query(self, query_embedding):
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        if self.projection is not None:
+            query_vector = self.projection.project(query_vector)
+        return query_vector
+
+    def _normalized_matrix(self):
+        if self._matrix is None:
+            matrix = np.vstack(self.vectors).astype(np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0 # Nollvektorer får likhet 0 i stället för division med noll
+            self._matrix = matrix / norms
+        return self._matrix
+
+    def search(self, query_embedding, k=15, adaptive=None):
+        """
+        Returnerar [(index, likhet), ...] för de k mest lika vektorerna, bäst först.
+        Med adaptive (AdaptiveK) är k ett tak och listan kortas efter likheterna; en tom
+        lista betyder då att ingen chunk var relevant nog.
+        Med en hierarki skannas bara chunks i de kapitel som liknar frågan mest.
+        """
         if not self.vectors:
             return []
-        query_vector = np.array(query_embedding)
-        similarities = []
-        for i, vector in enumerate(self.vectors):
-            # Lägg till en kontroll för att undvika division med noll om normen är noll
-            norm_query = np.linalg.norm(query_vector)
-            norm_vector = np.linalg.norm(vector)
-            if norm_query == 0 or norm_vector == 0:
-                similarity = 0.0
-            else:
-                similarity = np.dot(query_vector, vector) / (norm_query * norm_vector)
-            similarities.append((i, similarity))
-        similarities.sort(key=lambda x: x[1], reverse=True)
-        results = []
-        for i in range(min(k, len(similarities))):
-            idx, score = similarities[i]
-            results.append({
-                "text": self.texts[idx],
-                "metadata": self.metadata[idx],
-                "similarity": score
-            })
-        return results
+        query_vector = self.project_query(query_embedding)
+        norm_query = np.linalg.norm(query_vector)
+        rows = None  # Radindex för similarities; None = alla rader
+        if norm_query == 0:
+            similarities = np.zeros(len(self.vectors), dtype=np.float32)
+        else:
+            query_unit = query_vector / norm_query
+            if self.hierarchy is not None:
+                rows = self.hierarchy.candidates(query_unit, k)
+            matrix = self._normalized_matrix()
+            similarities = (matrix if rows is None else matrix[rows]) @ query_unit
+        k = min(k, len(similarities))
+        if k <= 0:
+            return []
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top], kind="stable")]
+        ids = top if rows is None else rows[top]
+        hits = [(int(i), float(similarities[j])) for i, j in zip(ids, top)]
+        if adaptive is not None:
+            hits = hits[: adaptive.select([score for _, score in hits])]
+        return hits
+
+    def result(self, idx, score):
+        return {
+            "text": self.texts[idx],
+            "metadata": self.metadata[idx],
+            "similarity": score
+        }
+
+    def memory_bytes(self) -> int:
+        """
+        Ungefärligt minne för vektorer, sökmatris, okomprimerade texter och grannar (metadatan räknas inte).
+        Sökmatrisen räknas även innan den byggts, så värdet ändras inte vid första sökningen.
+        """
+        total = sum(vector.nbytes for vector in self.vectors)
+        if self._matrix is not None:
+            total += self._matrix.nbytes
+        elif self.vectors:
+            total += len(self.vectors) * len(self.vectors[0]) * 4  # float32
+        if isinstance(self.texts, list):  # En CompressedTextStore är mmappad och räknas inte
+            total += sum(len(text) for text in self.texts)
+        if self.related is not None:
+            total += self.related.ids.nbytes + self.related.scores.nbytes
+        if self.hierarchy is not None:
+            total += self.hierarchy.chapter_centroids.nbytes + self.hierarchy.section_centroids.nbytes
+        return total
+
+    def semantic_search(self, query_embedding, k=15, adaptive=None):
+        return [self.result(idx, score) for idx, score in self.search(query_embedding, k, adaptive)]
 
     def save(self, file_path: str = "data/embeddings.parquet"): # Nu korrekt indenterad
+        import polars as pl # Importeras först när parquet läses/skrivs; polars är tungt att importera
         df = pl.DataFrame(
             dict(
                 vectors=self.vectors,
-                texts=self.texts,
-                metadata=self.metadata
+                texts=list(self.texts),
+                # Schemat härleds från alla rader, inte bara den första, så att fält som bara
+                # vissa chunks har (page_start, aliases) inte tappas.
+                metadata=pl.Series("metadata", list(self.metadata), strict=False)
             )
         )
         df.write_parquet(file_path)
         print(f"Vector store saved to {file_path}")
 
-    def load(self, file_path: str = "data/embeddings.parquet"): # Nu korrekt indenterad
+    def load(self, file_path: str = "data/embeddings.parquet", text_store_path: str = None,
+             row_range: Optional[Tuple[int, int]] = None): # Nu korrekt indenterad
+        """Med row_range = (start, slut) läses bara de raderna, t.ex. en shard (sharded_store.py)."""
+        import polars as pl
         if not os.path.exists(file_path):
             print(f"Error: Vector store file not found at {file_path}")
             return False
-        df = pl.read_parquet(file_path)
-        self.vectors = df["vectors"].to_list()
-        self.texts = df["texts"].to_list()
-        self.metadata = df["metadata"].to_list()
-        # Konvertera listor till numpy arrayer igen om det behövs för att matcha add_item
-        self.vectors = [np.array(vec) for vec in self.vectors]
+
+        def read(columns=None):
+            if row_range is None:
+                return pl.read_parquet(file_path, columns=columns)
+            frame = pl.scan_parquet(file_path)
+            if columns is not None:
+                frame = frame.select(columns)
+            return frame.slice(row_range[0], row_range[1] - row_range[0]).collect()
+
+        texts = None
+        if text_store_path and os.path.exists(text_store_path):
+            # Texterna läses komprimerat vid behov (text_store.py); kolumnen i parquet-filen hoppas över.
+            from text_store import CompressedTextStore
+
+            texts = CompressedTextStore.open(text_store_path)
+        if texts is not None and row_range is not None:
+            # Jämför med hela filen innan texterna kapas till samma rader som vektorerna.
+            texts = texts[row_range[0]:row_range[1]] if len(texts) == parquet_row_count(file_path) else []
+        df = read(["vectors", "metadata"] if texts is not None else None)
+        if texts is not None and len(texts) != df.height:
+            print(f"Varning: '{text_store_path}' matchar inte indexet; läser texterna ur parquet-filen.")
+            texts = None
+            df = read()
+        self.texts = texts if texts is not None else df["texts"].to_list()
+        # Metadatan normaliseras kolumnvis till en sektionstabell i stället för en dict per chunk.
+        self.metadata = ChunkMetadata.from_polars(df["metadata"], self.texts,
+                                                  content_is_text=texts is not None and texts.content_is_text)
+        vectors = df["vectors"]
+        if isinstance(vectors.dtype, pl.List) and len(vectors):
+            lengths = vectors.list.len()
+            if lengths.min() == lengths.max():
+                vectors = vectors.list.to_array(int(lengths.max()))
+        if isinstance(vectors.dtype, pl.Array):
+            # En sammanhängande matris; raderna blir vyer i stället för en array per vektor.
+            self.vectors = list(vectors.to_numpy())
+        else:
+            # Konvertera listor till numpy arrayer igen om det behövs för att matcha add_item
+            self.vectors = [np.array(vec) for vec in df["vectors"].to_list()]
+        self._matrix = None
+        self.projection = None
+        self.related = None
+        self.hierarchy = None
         print(f"Vector store loaded from {file_path}")
         return True
\ No newline at end of file
@@ -0,0 +1,195 @@
+# warmup.py
+"""
+Uppvärmning av kalla vägar när appen startar, i en bakgrundstråd.
+
+Efter en deploy skulle annars de första användarna betala för att parquet-filen
+laddas, Gemini-modellerna byggs och vanliga frågor embeddas. Warmup kör de stegen
+direkt vid start: laddar indexet, bygger klienterna och fyller den processgemensamma
+cachen av frågeembeddings med Evaluation-frågorna, deras idealsvar och en
+konfigurerbar lista med toppfrågor (data/top_queries.txt, en per rad).
+
+När alla steg är klara sätts `ready` och en beredskapsfil skrivs, så att en
+health check utanför Streamlit kan vänta på den:
+
+    python warmup.py wait --timeout 120
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+DEFAULT_READINESS_PATH = os.environ.get("WARMUP_READY_FILE", os.path.join(DATA_DIR, ".warmup_ready.json"))
+DEFAULT_TOP_QUERIES_PATH = os.environ.get("WARMUP_QUERIES_PATH", os.path.join(DATA_DIR, "top_queries.txt"))
+
+
+class QueryEmbeddingCache:
+    """Trådsäker LRU-cache av embeddings för frågor, delad av alla sessioner i processen."""
+
+    def __init__(self, max_items: int = 5000):
+        self.max_items = max_items
+        self._items: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "warmed": 0}
+
+    def __len__(self):
+        return len(self._items)
+
+    def embed(self, texts: List[str], embed_fn: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """Som embed_fn(texts), men bara texter som saknas i cachen skickas vidare."""
+        keys = [text.strip() for text in texts]
+        results: Dict[str, List[float]] = {}
+        with self._lock:
+            for key in keys:
+                if key in self._items:
+                    self._items.move_to_end(key)
+                    results[key] = self._items[key]
+        missing = [key for key in dict.fromkeys(keys) if key not in results]
+        with self._lock:
+            self.stats["hits"] += len(keys) - len(missing)
+            self.stats["misses"] += len(missing)
+        if missing:
+            for key, embedding in zip(missing, embed_fn(missing)):
+                results[key] = embedding
+                if embedding is not None and len(embedding):  # Misslyckade embeddings cachas inte
+                    self._put(key, embedding)
+        return [results[key] for key in keys]
+
+    def _put(self, key: str, embedding: List[float]):
+        with self._lock:
+            self._items[key] = embedding
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def wrap(self, embed_fn: Callable[[List[str]], List[List[float]]]) -> Callable[[List[str]], List[List[float]]]:
+        """embed_fn med samma signatur, men genom cachen."""
+        def cached(texts):
+            return self.embed(texts, embed_fn)
+        return cached
+
+    def warm(self, texts: List[str], embed_fn: Callable[[List[str]], List[List[float]]], batch_size: int = 20) -> int:
+        """Embeddar texter som inte redan finns. Returnerar antalet nya."""
+        with self._lock:
+            missing = [t for t in dict.fromkeys(t.strip() for t in texts) if t and t not in self._items]
+        for i in range(0, len(missing), batch_size):
+            self.embed(missing[i:i + batch_size], embed_fn)
+        with self._lock:
+            self.stats["warmed"] += len(missing)
+        return len(missing)
+
+
+query_embedding_cache = QueryEmbeddingCache()
+
+
+def load_top_queries(path: str = DEFAULT_TOP_QUERIES_PATH) -> List[str]:
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+class Warmup:
+    """
+    Kör namngivna steg i ordning i en bakgrundstråd. Ett steg som misslyckas loggas
+    men stoppar inte de övriga; appen faller då tillbaka på att göra jobbet vid första
+    förfrågan. Resultatet av varje steg kan hämtas med result(), som väntar på steget.
+    """
+
+    def __init__(self, readiness_path: Optional[str] = DEFAULT_READINESS_PATH):
+        self.readiness_path = readiness_path
+        self.ready = threading.Event()
+        self._steps: List = []
+        self._done: Dict[str, threading.Event] = {}
+        self._results: Dict[str, object] = {}
+        self.status: Dict[str, Dict] = {}
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def add_step(self, name: str, fn: Callable[[], object]):
+        self._steps.append((name, fn))
+        self._done[name] = threading.Event()
+        self.status[name] = {"state": "pending"}
+
+    def start(self):
+        if self._thread is not None:
+            return
+        if self.readiness_path and os.path.exists(self.readiness_path):
+            os.remove(self.readiness_path)  # Från en tidigare process; vi är inte redo än
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        for name, fn in self._steps:
+            self.status[name] = {"state": "running"}
+            start = time.perf_counter()
+            try:
+                self._results[name] = fn()
+                self.status[name] = {"state": "done"}
+            except Exception as e:
+                self._results[name] = None
+                self.status[name] = {"state": "failed", "error": str(e)}
+                print(f"Uppvärmningssteget '{name}' misslyckades: {e}")
+            self.status[name]["seconds"] = round(time.perf_counter() - start, 3)
+            self._done[name].set()
+        self.finished_at = time.time()
+        self._write_readiness()
+        self.ready.set()
+        print(f"Uppvärmning klar på {self.finished_at - self.started_at:.1f} s.")
+
+    def _write_readiness(self):
+        if not self.readiness_path:
+            return
+        os.makedirs(os.path.dirname(self.readiness_path) or ".", exist_ok=True)
+        tmp_path = f"{self.readiness_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"pid": os.getpid(), "ready_at": self.finished_at, "steps": self.status}, f, indent=1)
+        os.replace(tmp_path, self.readiness_path)
+
+    def result(self, name: str, timeout: Optional[float] = None):
+        """Väntar på steget och returnerar dess resultat (None om det misslyckades)."""
+        if not self._done[name].wait(timeout):
+            raise TimeoutError(f"Uppvärmningssteget '{name}' blev inte klart inom {timeout} s")
+        return self._results.get(name)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self.ready.wait(timeout)
+
+    def report(self) -> Dict:
+        return {
+            "ready": self.ready.is_set(),
+            "seconds": round((self.finished_at or time.time()) - self.started_at, 3) if self.started_at else None,
+            "steps": self.status,
+            "query_cache": {"size": len(query_embedding_cache), **query_embedding_cache.stats},
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Health check för appens uppvärmning.")
+    parser.add_argument("--ready-file", default=DEFAULT_READINESS_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("check", help="Felkod 0 om appen är redo, annars 1")
+    wait = sub.add_parser("wait", help="Vänta tills appen är redo")
+    wait.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    deadline = time.time() + (args.timeout if args.command == "wait" else 0)
+    while True:
+        if os.path.exists(args.ready_file):
+            with open(args.ready_file, "r", encoding="utf-8") as f:
+                print(f.read())
+            sys.exit(0)
+        if time.time() >= deadline:
+            print("Inte redo.")
+            sys.exit(1)
+        time.sleep(0.5)
+
+
+if __name__ == "__main__":
+    main()